@@ -0,0 +1,145 @@
+"""
+Prompt and reply handling for the analysis of query results.
+
+Shared by simplified_sql_app.py, fixed_app.py and async_app.py. The
+analysis is requested through an analyze_data tool call whose "analysis"
+and "suggestions" fields are returned as
+"<analysis>...</analysis><suggestions>...</suggestions>".
+"""
+from prompt_encoding import encode_results
+
+
+def analysis_request(question, sql_query, query_results):
+    """Messages API arguments for analysing the results of an executed query."""
+    # Define the analysis tools
+    tools = [
+        {
+            "name": "analyze_data",
+            "description": "Analyze query results and provide insights",
+            "input_schema": {
+                "type": "object",
+                "properties": {
+                    "analysis": {
+                        "type": "string",
+                        "description": "Analysis of the query results"
+                    },
+                    "suggestions": {
+                        "type": "string",
+                        "description": "Suggested follow-up queries"
+                    }
+                },
+                "required": ["analysis"]
+            }
+        }
+    ]
+    
+    system_prompt = """You are a friendly and helpful SQL analyst. 
+    You will receive:
+    1. The original user question
+    2. The SQL query that was executed
+    3. The results of that query
+    
+    Your task is to:
+    1. Analyze the results in a clear, concise way
+    2. Point out any interesting patterns or insights
+    3. Answer the user's original question using the data
+    4. Suggest any relevant follow-up queries they might be interested in
+    
+    Use the analyze_data tool to structure your response with:
+    - Required analysis section
+    - Optional suggestions for follow-up queries
+    
+    IMPORTANT: Do not include any internal thinking or reasoning in your responses. Only provide the final output."""
+
+    # Format the query results for Claude: column statistics plus CSV rows, within a token budget
+    formatted_results = encode_results(query_results)
+    
+    message_content = f"""Original question: {question}
+SQL Query executed: {sql_query}
+Query Results:
+{formatted_results}
+
+Please analyze these results and provide insights."""
+
+    return dict(
+        model="claude-3-7-sonnet-20250219",
+        max_tokens=1000,
+        temperature=0.7,
+        system=system_prompt,
+        messages=[
+            {"role": "user", "content": message_content}
+        ],
+        tools=tools
+    )
+
+
+def parse_analysis_message(message):
+    """
+    Turns the analysis reply into "<analysis>...</analysis><suggestions>...</suggestions>"
+    (or the plain text reply when the tool was not used).
+    """
+    # Check if Claude used the tool
+    if message.content and len(message.content) > 0:
+        for content in message.content:
+            # Filter out any content containing thinking tags
+            if content.type == 'text' and ("<thinking>" in content.text or "</thinking>" in content.text):
+                continue
+                
+            if content.type == 'tool_use':
+                # Claude is requesting to use a tool - access the name directly from content
+                tool_name = content.name
+                tool_input = content.input
+                
+                if tool_name == "analyze_data":
+                    # Extract the components from the tool call
+                    analysis = tool_input.get("analysis", "")
+                    suggestions = tool_input.get("suggestions", "")
+                    
+                    response = ""
+                    if analysis:
+                        response += f"<analysis>{analysis}</analysis>"
+                    if suggestions:
+                        response += f"<suggestions>{suggestions}</suggestions>"
+                        
+                    return response
+    
+    # If Claude didn't use the tool or used it incorrectly, return the text content
+    response_text = ""
+    if message.content:
+        for content in message.content:
+            if content.type == 'text':
+                # Remove thinking sections from the response
+                text = content.text
+                if "<thinking>" in text and "</thinking>" in text:
+                    start = text.find("<thinking>")
+                    end = text.find("</thinking>") + len("</thinking>")
+                    text = text[:start] + text[end:]
+                response_text += text.strip()
+                
+    if response_text:
+        return response_text
+    else:
+        # Fallback if no text content
+        return "I couldn't analyze the results. Please try again with a different query."
+
+
+def extract_analysis(response):
+    """
+    Extracts analysis from response if it exists.
+    """
+    if "<analysis>" in response and "</analysis>" in response:
+        start = response.find("<analysis>") + 10
+        end = response.find("</analysis>")
+        return response[start:end].strip()
+    return None
+
+
+def extract_suggestions(response):
+    """
+    Extracts suggestions from response if it exists.
+    """
+    if "<suggestions>" in response and "</suggestions>" in response:
+        start = response.find("<suggestions>") + 13
+        end = response.find("</suggestions>")
+        return response[start:end].strip()
+    return None
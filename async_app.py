@@ -0,0 +1,701 @@
+"""
+Async (ASGI) serving mode for the SQL chat assistant.
+
+Serves the same /query, /generate-visualization and /api/chat contracts as
+simplified_sql_app.py and fixed_app.py, but every Claude call goes through
+AsyncAnthropic and every query through an asyncpg pool. A request waiting on
+the model or the database no longer holds a worker thread, so one process
+can keep hundreds of conversations in flight.
+
+Prompts, tools and response parsing are shared with the Flask apps, as are
+the SQL generation cache, the result cache and schema retrieval.
+
+Run with an ASGI server, e.g.:
+    hypercorn async_app:app --bind 0.0.0.0:5001
+
+Configuration (environment variables):
+    DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT   database connection
+    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT
+                                                      asyncpg pool sizing (same meaning as in db_pool.py)
+    DB_POOL_MAX_LIFETIME                              seconds an idle asyncpg connection is kept (default 1800)
+    QUERY_STREAM_BATCH_SIZE                           rows per NDJSON batch (default 500)
+"""
+import os
+import json
+import time
+import asyncio
+import functools
+import logging
+from contextlib import asynccontextmanager
+
+import asyncpg
+from anthropic import AsyncAnthropic
+from quart import Quart, request, Response, jsonify, render_template, redirect
+
+from simplified_sql_app import (
+    ANALYSIS_MAX_ROWS, QUERY_STREAM_BATCH_SIZE, SCHEMA_VERSION,
+    chart_data_json, check_visualization_data, get_schema_for_question, ndjson_line,
+    parse_sql_message, parse_visualization_message, query_results_payload, repair_request, sql_request,
+    visualization_request,
+)
+from analysis import analysis_request, extract_analysis, extract_suggestions, parse_analysis_message
+from chat_sql import chat_sql_request
+from sql_cache import get_sql_cache
+from prompt_cache import record_usage, prompt_cache_stats
+from sql_stream import stream_sql_generation_async
+from chat_stream import SSE_HEADERS, analysis_fragments, sse_stream_async
+from chart_planner import CHART_MAX_ROWS, local_visualization
+from chart_cache import get_chart_cache, bind_template
+from result_cache import get_result_cache
+from result_store import get_result_store, paged_sql
+from result_cursors import get_async_cursor_registry
+from result_export import EXPORT_BATCH_ROWS, ExportError, ResultWriter, stored_batches
+from result_encoding import QueryResult, dumps, encode_rows
+from schema_retrieval import get_schema_index
+from sql_utils import is_read_only, written_tables
+from sql_guard import guard_sql_async
+from sql_repair import run_with_repair_async, get_repair_cache
+import tracing
+from tracing import span, first_token_async
+
+logger = logging.getLogger(__name__)
+
+app = Quart(__name__)
+tracing.init_async_app(app)
+
+async_client = AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+
+_db_pool = None
+_db_pool_lock = asyncio.Lock()
+
+
+def db_settings():
+    """Connection settings from the environment; raises if a required one is missing."""
+    settings = {
+        "database": os.getenv("DB_NAME"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "host": os.getenv("DB_HOST"),
+        "port": os.getenv("DB_PORT"),
+    }
+    for key, env in (("database", "DB_NAME"), ("user", "DB_USER"), ("host", "DB_HOST"), ("port", "DB_PORT")):
+        if not settings[key]:
+            logger.error("{} environment variable not set.".format(env))
+            raise ValueError("{} environment variable is required but not set.".format(env))
+    settings["port"] = int(settings["port"])
+    return settings
+
+
+async def _init_connection(conn):
+    # Decode json/jsonb like psycopg2 does, so results match the Flask app
+    for type_name in ("json", "jsonb"):
+        await conn.set_type_codec(type_name, encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+
+async def get_db_pool():
+    """The process-wide asyncpg pool, created on first use."""
+    global _db_pool
+    if _db_pool is None:
+        async with _db_pool_lock:
+            if _db_pool is None:
+                settings = db_settings()
+                _db_pool = await asyncpg.create_pool(
+                    min_size=int(os.getenv("DB_POOL_MIN_SIZE", "1")),
+                    max_size=int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+                    max_inactive_connection_lifetime=float(os.getenv("DB_POOL_MAX_LIFETIME", "1800")),
+                    init=_init_connection,
+                    **settings
+                )
+                logger.info("Opened asyncpg pool to database '{}' on {}:{}".format(
+                    settings["database"], settings["host"], settings["port"]))
+    return _db_pool
+
+
+@asynccontextmanager
+async def _acquire(pool):
+    with span("db_checkout"):
+        conn = await pool.acquire(timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")))
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+
+def _cache_scope():
+    return (os.getenv("DB_NAME"), os.getenv("DB_HOST"), os.getenv("DB_PORT"))
+
+
+async def execute_sql(query):
+    """
+    Async counterpart of simplified_sql_app.execute_sql: returns a QueryResult
+    for a read-only statement, commits anything else, and raises on failure
+    (SqlRejected when sql_guard turns the statement down).
+    """
+    # The cache and the guard use the same definition of a read (WITH, TABLE, VALUES, ...)
+    is_read = is_read_only(query)
+    result_cache = get_result_cache()
+    if result_cache and is_read:
+        cached_results = result_cache.get(query, _cache_scope())
+        if cached_results is not None:
+            logger.info("Returning {} cached results for query: {}".format(len(cached_results), query))
+            return cached_results
+
+    pool = await get_db_pool()
+    try:
+        async with _acquire(pool) as conn:
+            # The guard's SET LOCAL statement_timeout lasts for this transaction
+            async with conn.transaction():
+                with span("sql_guard"):
+                    guarded_query = await guard_sql_async(conn, query)
+                logger.info("Executing SQL query: {}".format(guarded_query))
+                if is_read:
+                    with span("db_query") as attributes:
+                        # Prepared, so the column names are known even for an empty result
+                        statement = await conn.prepare(guarded_query)
+                        records = await statement.fetch()
+                        attributes["db.rows"] = len(records)
+                    results = QueryResult([attribute.name for attribute in statement.get_attributes()], records)
+                    logger.info("Query returned {} results.".format(len(results)))
+                else:
+                    with span("db_query"):
+                        status = await conn.execute(guarded_query)
+                    logger.info("Query executed successfully: {}".format(status))
+                    results = []
+    except Exception as e:
+        logger.error("Database error occurred for query: {}".format(query))
+        logger.error("Error details: {}".format(str(e)))
+        raise
+
+    if result_cache:
+        if is_read:
+            result_cache.put(query, results, _cache_scope())
+        else:
+            # Evict cached results that read the tables this statement wrote
+            result_cache.invalidate_tables(written_tables(query))
+    return results
+
+
+async def stream_sql(query, batch_size=QUERY_STREAM_BATCH_SIZE):
+    """
+    Async counterpart of simplified_sql_app.stream_sql: yields (column_names,
+    rows) batches read from a server-side cursor, with no row limit. The first
+    batch may be empty.
+    """
+    pool = await get_db_pool()
+    async with _acquire(pool) as conn:
+        # Cursors only live inside a transaction
+        async with conn.transaction(readonly=True):
+            with span("sql_guard"):
+                guarded_query = await guard_sql_async(conn, query, limit_rows=False)
+            logger.info("Streaming SQL query: {}".format(guarded_query))
+            # Time to the first batch; later batches wait on the client
+            with span("db_query"):
+                statement = await conn.prepare(guarded_query)
+                colnames = [attribute.name for attribute in statement.get_attributes()]
+                cursor = await statement.cursor()
+                rows = await cursor.fetch(batch_size)
+            yield colnames, [list(row) for row in rows]
+            while len(rows) == batch_size:
+                rows = await cursor.fetch(batch_size)
+                if rows:
+                    yield colnames, [list(row) for row in rows]
+
+
+async def stream_query_results(sql_query, question=None):
+    """
+    Async counterpart of simplified_sql_app.stream_query_results: NDJSON
+    meta/rows/end lines read from a server-side cursor, one batch at a time.
+    """
+    row_count = 0
+    started = False
+    store = get_result_store()
+    kept_rows, kept_bytes = [], 0
+    try:
+        async for colnames, rows in stream_sql(sql_query):
+            if not started:
+                yield ndjson_line({"type": "meta", "sql_query": sql_query, "columns": colnames})
+                started = True
+            if rows:
+                row_count += len(rows)
+                yield ndjson_line({"type": "rows", "rows": encode_rows(colnames, rows)})
+                if kept_rows is not None:
+                    kept_bytes += QueryResult(colnames, rows).estimate_size()
+                    if kept_bytes <= store.max_entry_bytes:
+                        kept_rows.extend(rows)
+                    else:
+                        kept_rows = None
+        if kept_rows is not None:
+            kept_rows = QueryResult(colnames, kept_rows)
+        result_handle = store.put(sql_query, colnames, kept_rows, row_count, question)
+        yield ndjson_line({"type": "end", "row_count": row_count, "result_handle": result_handle})
+        logger.info("Successfully streamed SQL query with {} results".format(row_count))
+    except Exception as e:
+        logger.error("Error streaming SQL results: {}".format(str(e)))
+        if not started:
+            yield ndjson_line({"type": "meta", "sql_query": sql_query, "columns": []})
+        yield ndjson_line({
+            "type": "error",
+            "message": "I generated a SQL query, but there was an error executing it: {}".format(str(e))
+        })
+
+
+async def get_sql_from_claude(question):
+    """Async counterpart of simplified_sql_app.get_sql_from_claude; returns (sql_query, text_response)."""
+    schema_index = get_schema_index()
+    current_schema_version = schema_index.version if schema_index else SCHEMA_VERSION
+
+    # Cache lookups embed the question and may hit SQLite, so keep them off the event loop
+    sql_cache = get_sql_cache()
+    if sql_cache:
+        cached_sql = await asyncio.to_thread(sql_cache.lookup, question, current_schema_version)
+        if cached_sql:
+            return cached_sql, None
+
+    schema_description = await asyncio.to_thread(get_schema_for_question, question, schema_index)
+
+    try:
+        with span("llm_sql"):
+            sql_query, response_text = await stream_sql_generation_async(
+                async_client.messages.stream(**sql_request(question, schema_description)),
+                on_message=lambda message: record_usage("SQL", message))
+        if sql_query is not None:
+            logger.info("Generated SQL Query: {}".format(sql_query))
+            if sql_cache and sql_query:
+                await asyncio.to_thread(sql_cache.store, question, current_schema_version, sql_query)
+        return sql_query, response_text
+    except Exception as e:
+        logger.error("Error calling Claude API: {}".format(str(e)))
+        return None, "Error generating SQL: {}".format(str(e))
+
+
+async def repair_sql_from_claude(question, sql_query, error):
+    """Async counterpart of simplified_sql_app.repair_sql_from_claude."""
+    try:
+        schema_description = await asyncio.to_thread(get_schema_for_question, question, get_schema_index())
+        with span("llm_sql_repair"):
+            message = await async_client.messages.create(
+                **repair_request(question, sql_query, error, schema_description))
+            record_usage("SQL repair", message)
+        fixed_sql, _ = parse_sql_message(message)
+        if fixed_sql:
+            logger.info("Repaired SQL Query: {}".format(fixed_sql))
+        return fixed_sql
+    except Exception as e:
+        logger.error("Error repairing SQL: {}".format(str(e)))
+        return None
+
+
+async def check_sql(query, limit_rows=True):
+    """Async counterpart of simplified_sql_app.check_sql: the guard's checks without executing."""
+    pool = await get_db_pool()
+    async with _acquire(pool) as conn:
+        async with conn.transaction(readonly=True):
+            with span("sql_guard"):
+                await guard_sql_async(conn, query, limit_rows=limit_rows)
+
+
+async def checked_sql(question, sql_query, limit_rows=True):
+    """Async counterpart of simplified_sql_app.checked_sql."""
+    try:
+        check = functools.partial(check_sql, limit_rows=limit_rows)
+        return (await run_with_repair_async(question, sql_query, check, repair_sql_from_claude))[0]
+    except Exception as e:
+        logger.warning("Could not repair SQL before streaming: {}".format(str(e)))
+        return sql_query
+
+
+async def get_analysis_from_claude(question, sql_query, results):
+    """Async counterpart of simplified_sql_app.get_analysis_from_claude."""
+    try:
+        with span("llm_analysis"):
+            message = await async_client.messages.create(
+                **analysis_request(question, sql_query, results[:ANALYSIS_MAX_ROWS]))
+            record_usage("Analysis", message)
+        analysis_response = parse_analysis_message(message)
+        return {
+            "analysis": extract_analysis(analysis_response) or analysis_response,
+            "suggestions": extract_suggestions(analysis_response)
+        }
+    except Exception as e:
+        logger.error("Error generating analysis: {}".format(str(e)))
+        return {"analysis": "Error analyzing results: {}".format(str(e)), "suggestions": None}
+
+
+async def get_visualization_from_claude(results, question=None):
+    """Async counterpart of simplified_sql_app.get_visualization_from_claude."""
+    try:
+        chart_cache = get_chart_cache()
+        template = await asyncio.to_thread(chart_cache.lookup, results, question) if chart_cache else None
+        if template is None:
+            with span("llm_visualization"):
+                message = await async_client.messages.create(**visualization_request(results))
+                record_usage("Visualization", message)
+            template = parse_visualization_message(message)
+            if chart_cache:
+                await asyncio.to_thread(chart_cache.store, results, question, template)
+        return bind_template(template, chart_data_json(results))
+    except Exception as e:
+        logger.error("Error generating visualization: {}".format(str(e)))
+        return "<div class='error'>Error generating visualization: {}</div>".format(str(e))
+
+
+async def get_visualization(results, question=None):
+    """Async counterpart of simplified_sql_app.get_visualization."""
+    with span("chart_planner"):
+        local_chart = local_visualization(results[:CHART_MAX_ROWS])
+    return local_chart or await get_visualization_from_claude(results, question)
+
+
+async def stream_pipeline_results(question, sql_query):
+    """Async counterpart of simplified_sql_app.stream_pipeline_results."""
+    try:
+        results = await execute_sql(sql_query)
+    except Exception as e:
+        yield ndjson_line({"type": "meta", "sql_query": sql_query, "columns": []})
+        yield ndjson_line({
+            "type": "error",
+            "message": "I generated a SQL query, but there was an error executing it: {}".format(str(e))
+        })
+        return
+
+    columns = results.columns
+    yield ndjson_line({"type": "meta", "sql_query": sql_query, "columns": columns})
+    for start in range(0, len(results), QUERY_STREAM_BATCH_SIZE):
+        yield ndjson_line({"type": "rows",
+                           "rows": encode_rows(columns, results.rows[start:start + QUERY_STREAM_BATCH_SIZE])})
+
+    if results:
+        chartable = check_visualization_data(results) is None
+        local_chart = None
+        if chartable:
+            with span("chart_planner"):
+                local_chart = local_visualization(results[:CHART_MAX_ROWS])
+        if local_chart:
+            yield ndjson_line({"type": "visualization", "visualization_html": local_chart})
+        tasks = {asyncio.create_task(get_analysis_from_claude(question, sql_query, results)): "analysis"}
+        if chartable and not local_chart:
+            tasks[asyncio.create_task(get_visualization_from_claude(results, question))] = "visualization"
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if tasks[task] == "analysis":
+                        yield ndjson_line(dict(task.result(), type="analysis"))
+                    else:
+                        yield ndjson_line({"type": "visualization", "visualization_html": task.result()})
+        finally:
+            # Client went away: stop waiting on the model
+            for task in pending:
+                task.cancel()
+
+    result_handle = get_result_store().put(sql_query, columns, results, question=question)
+    yield ndjson_line({"type": "end", "row_count": len(results), "result_handle": result_handle})
+
+
+async def rows_for_handle(entry, limit=None):
+    """Async counterpart of simplified_sql_app.rows_for_handle."""
+    if entry.rows is not None:
+        return entry.rows if limit is None else entry.rows[:limit]
+    if limit is None:
+        return await execute_sql(entry.sql)
+    return await execute_sql(paged_sql(entry.sql, 0, limit, stable=False))
+
+
+async def page_rows(entry, offset, limit):
+    """Async counterpart of simplified_sql_app.page_rows."""
+    if entry.rows is not None:
+        return entry.page(offset, limit)
+    registry = get_async_cursor_registry()
+    if registry is None:
+        return (await execute_sql(paged_sql(entry.sql, offset, limit))).page(0, limit)
+    _, rows, _ = await registry.page(entry, offset, limit, await get_db_pool())
+    return rows
+
+
+@app.after_serving
+async def close_db_pool():
+    if _db_pool is not None:
+        # Held cursors keep connections checked out, and close() waits for them
+        registry = get_async_cursor_registry()
+        if registry is not None:
+            await registry.close_all()
+        await _db_pool.close()
+
+
+@app.route('/')
+async def index():
+    """Render the chat interface."""
+    return await render_template('index.html')
+
+
+@app.route('/pool-stats')
+async def get_pool_stats():
+    """Expose asyncpg pool counters and held result cursors."""
+    registry = get_async_cursor_registry()
+    cursor_stats = registry.stats() if registry else None
+    if _db_pool is None:
+        return jsonify({"pools": [], "result_cursors": cursor_stats})
+    size = _db_pool.get_size()
+    idle = _db_pool.get_idle_size()
+    return jsonify({"pools": [{
+        "database": os.getenv("DB_NAME"),
+        "host": os.getenv("DB_HOST"),
+        "port": os.getenv("DB_PORT"),
+        "min_size": _db_pool.get_min_size(),
+        "max_size": _db_pool.get_max_size(),
+        "size": size,
+        "idle": idle,
+        "checked_out": size - idle,
+    }], "result_cursors": cursor_stats})
+
+
+@app.route('/cache-stats')
+async def get_cache_stats():
+    """Expose hit/miss counters for the application caches."""
+    sql_cache = get_sql_cache()
+    result_cache = get_result_cache()
+    chart_cache = get_chart_cache()
+    repair_cache = get_repair_cache()
+    return jsonify({
+        "sql_generation": sql_cache.stats() if sql_cache else None,
+        "results": result_cache.stats() if result_cache else None,
+        "result_handles": get_result_store().stats(),
+        "chart_templates": chart_cache.stats() if chart_cache else None,
+        "prompt": prompt_cache_stats(),
+        "sql_repairs": repair_cache.stats() if repair_cache else None
+    })
+
+
+@app.route('/metrics')
+async def metrics():
+    """Expose request and stage latency histograms and model token counters to Prometheus."""
+    return tracing.metrics_response()
+
+
+@app.route('/query', methods=['POST'])
+async def query():
+    """API endpoint for processing questions and returning SQL query results."""
+    data = await request.get_json()
+    user_question = data.get('question', '')
+    # Clients can ask for rows to be streamed as NDJSON instead of one JSON document
+    stream = data.get('stream', False) or 'application/x-ndjson' in request.headers.get('Accept', '')
+    pipeline = data.get('pipeline', False)
+    columnar = data.get('format') == 'columnar'
+
+    if not user_question:
+        return jsonify({"error": "No question provided"}), 400
+
+    try:
+        logger.info("Processing question: {}".format(user_question))
+        with span("sql_generation"):
+            sql_query, text_response = await get_sql_from_claude(user_question)
+
+        if sql_query and pipeline and sql_query.strip().lower().startswith("select"):
+            sql_query = await checked_sql(user_question, sql_query)
+            return Response(stream_pipeline_results(user_question, sql_query), mimetype='application/x-ndjson')
+
+        if sql_query and stream and sql_query.strip().lower().startswith("select"):
+            sql_query = await checked_sql(user_question, sql_query, limit_rows=False)
+            return Response(stream_query_results(sql_query, user_question), mimetype='application/x-ndjson')
+
+        if sql_query:
+            try:
+                sql_query, results = await run_with_repair_async(
+                    user_question, sql_query, execute_sql, repair_sql_from_claude)
+                payload = query_results_payload(sql_query, results, user_question, columnar)
+                with span("serialize"):
+                    return Response(dumps(payload), mimetype='application/json')
+            except Exception as e:
+                logger.error("Error executing SQL: {}".format(str(e)))
+                return jsonify({
+                    "sql_query": sql_query,
+                    "message": "I generated a SQL query, but there was an error executing it: {}".format(str(e)),
+                    "has_error": True
+                })
+        else:
+            logger.warning("Could not generate SQL for question: {}".format(user_question))
+            return jsonify({
+                "message": text_response or "I couldn't generate a SQL query for your question. Could you please rephrase or provide more context?",
+                "no_sql": True
+            })
+    except Exception as e:
+        logger.error("Error processing query: {}".format(str(e)))
+        return jsonify({
+            "message": "Sorry, I encountered an error: {}".format(str(e)),
+            "has_error": True
+        }), 500
+
+
+@app.route('/generate-visualization', methods=['POST'])
+async def generate_visualization():
+    """API endpoint to generate visualizations from query results."""
+    try:
+        data = await request.get_json()
+        result_handle = data.get('result_handle')
+        question = data.get('question')
+        if result_handle:
+            entry = get_result_store().get(result_handle)
+            if entry is None:
+                return jsonify({"error": "Result handle expired or unknown."}), 404
+            with span("result_fetch"):
+                results = await rows_for_handle(entry, CHART_MAX_ROWS)
+            question = question or entry.question
+        else:
+            results = data.get('results', [])
+
+        error_response = check_visualization_data(results)
+        if error_response:
+            payload, status = error_response
+            return jsonify(payload), status
+
+        logger.info("Generating visualization for {} data points".format(len(results)))
+        visualization_html = await get_visualization(results, question)
+
+        with span("serialize"):
+            return jsonify({
+                "visualization_html": visualization_html
+            })
+    except Exception as e:
+        logger.error("Error generating visualization: {}".format(str(e)))
+        return jsonify({
+            "visualization_html": "<div class='error-message'>Error generating visualization: {}</div>".format(str(e))
+        }), 500
+
+
+@app.route('/analyze', methods=['POST'])
+async def analyze():
+    """API endpoint to analyse a stored result, referenced by its result handle."""
+    data = await request.get_json()
+    entry = get_result_store().get(data.get('result_handle', ''))
+    if entry is None:
+        return jsonify({"error": "Result handle expired or unknown."}), 404
+    try:
+        with span("result_fetch"):
+            results = await rows_for_handle(entry, ANALYSIS_MAX_ROWS)
+        question = data.get('question') or entry.question or ""
+        return jsonify(await get_analysis_from_claude(question, entry.sql, results))
+    except Exception as e:
+        logger.error("Error analyzing results: {}".format(str(e)))
+        return jsonify({"error": "Error analyzing results: {}".format(str(e))}), 500
+
+
+@app.route('/results/<result_handle>')
+async def get_results_page(result_handle):
+    """Async counterpart of simplified_sql_app.get_results_page."""
+    entry = get_result_store().get(result_handle)
+    if entry is None:
+        return jsonify({"error": "Result handle expired or unknown."}), 404
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = min(max(1, request.args.get('limit', 100, type=int)), 1000)
+    try:
+        with span("result_fetch"):
+            rows = await page_rows(entry, offset, limit)
+    except Exception as e:
+        logger.error("Error fetching result page: {}".format(str(e)))
+        return jsonify({"error": "Error fetching results: {}".format(str(e))}), 500
+    return Response(dumps({
+        "result_handle": result_handle,
+        "columns": entry.columns,
+        "rows": encode_rows(entry.columns, rows),
+        "offset": offset,
+        "limit": limit,
+        "next_offset": offset + len(rows) if len(rows) == limit else None,
+        "row_count": entry.row_count
+    }), mimetype='application/json')
+
+
+@app.route('/export/<result_handle>.<export_format>')
+async def export_result(result_handle, export_format):
+    """Async counterpart of simplified_sql_app.export_result."""
+    entry = get_result_store().get(result_handle)
+    if entry is None:
+        return jsonify({"error": "Result handle expired or unknown."}), 404
+    try:
+        writer = ResultWriter(entry.columns, export_format, request.args.get('compression'))
+    except ExportError as e:
+        return jsonify({"error": str(e)}), 400
+
+    async def batches():
+        if entry.rows is not None:
+            for rows in stored_batches(entry):
+                yield rows
+        else:
+            async for _, rows in stream_sql(entry.sql, batch_size=EXPORT_BATCH_ROWS):
+                yield rows
+
+    async def chunks():
+        chunk = writer.header()
+        if chunk:
+            yield chunk
+        async for rows in batches():
+            # Encoding a batch (Parquet especially) is CPU work; keep it off the event loop
+            chunk = await asyncio.to_thread(writer.write, rows)
+            if chunk:
+                yield chunk
+        chunk = await asyncio.to_thread(writer.close)
+        if chunk:
+            yield chunk
+
+    return Response(chunks(), mimetype=writer.mimetype,
+                    headers={"Content-Disposition": "attachment; filename=results-{}.{}".format(
+                        result_handle[:8], writer.extension)})
+
+
+async def stream_chat_reply(question, emit):
+    """Async counterpart of fixed_app.stream_chat_reply; emit is awaited."""
+    with span("llm_sql"):
+        sql_query, _ = await stream_sql_generation_async(
+            async_client.messages.stream(**chat_sql_request(question)),
+            on_message=lambda message: record_usage("Chat SQL", message),
+            on_text=lambda text: emit("delta", {"text": text}),
+            stage="Chat SQL")
+    if sql_query is None:
+        return
+    if not sql_query:
+        await emit("error", {"message": "Error: Failed to extract SQL query."})
+        return
+
+    await emit("sql", {"sql_query": sql_query})
+    try:
+        results = await execute_sql(sql_query)
+    except Exception as e:
+        await emit("error", {"message": "Database Error: {}".format(str(e))})
+        return
+
+    # Cancelling the task on disconnect leaves the block and closes the upstream stream
+    state = {}
+    with span("llm_analysis"):
+        started = time.perf_counter()
+        async with async_client.messages.stream(**analysis_request(question, sql_query, results)) as stream:
+            async for event in first_token_async("Analysis", stream, started):
+                for text in analysis_fragments(event, state):
+                    await emit("delta", {"text": text})
+            record_usage("Analysis", await stream.get_final_message())
+
+
+@app.route('/api/chat', methods=['POST'])
+async def chat():
+    """Chat endpoint of fixed_app.py: the reply streamed as server-sent events."""
+    data = await request.get_json()
+    user_input = data.get('message', '')
+    return Response(sse_stream_async(lambda emit: stream_chat_reply(user_input, emit)),
+                    mimetype='text/event-stream', headers=SSE_HEADERS)
+
+
+@app.errorhandler(404)
+async def page_not_found(e):
+    # Handle static file 404 errors specially
+    path = request.path
+    if path.startswith('/static/'):
+        if path.endswith('.js'):
+            return "// JavaScript file not found: {}".format(path), 404, {'Content-Type': 'application/javascript'}
+        elif path.endswith('.css'):
+            return "/* CSS file not found: {} */".format(path), 404, {'Content-Type': 'text/css'}
+    return redirect('/')
+
+
+if __name__ == '__main__':
+    print("Starting SQL Chat Application (async)...")
+    print("Web interface available at: http://localhost:5001")
+    app.run(host='0.0.0.0', port=5001)
@@ -0,0 +1,414 @@
+"""
+Offline benchmark of the /query, /generate-visualization and /api/chat endpoints.
+
+The apps' Anthropic clients are replaced by stub_llm.StubAnthropic, which
+answers from recorded responses with a simulated time to first token and
+generation rate, so runs need no network access and no API key. Requests go
+through the apps' test clients in this process, against a real PostgreSQL
+database (the app relies on psycopg2, EXPLAIN (FORMAT JSON) and Postgres
+SQL, so there is no SQLite mode).
+
+Stages, each run for --requests requests at --concurrency:
+    query          POST /query
+    query_columnar POST /query with "format": "columnar"
+    query_stream   POST /query with "stream": true (NDJSON)
+    visualization  POST /generate-visualization with a result handle
+    chat           POST /api/chat (server-sent events)
+
+For every stage the report gives p50/p95/p99 latency, time to first byte,
+throughput, errors and peak RSS of the process while the stage ran.
+
+--load recreates the sample tables from create_tables.sql and the
+insert_*.sql files. It drops the app's tables first, so point DB_NAME at a
+database used only for benchmarking. --stock-prices then tops stock_prices up
+to the given number of rows with generated data. --load --rows N instead
+loads about N rows of generated, referentially consistent data for all the
+tables with seed_data.py.
+
+The SQL, result and chart caches are disabled unless --caches is given, so
+every request reaches the database.
+
+Examples:
+    python benchmark.py --load --stock-prices 2000000
+    python benchmark.py --load --rows 10000000
+    python benchmark.py --concurrency 16 --requests 200 --json baseline.json
+    python benchmark.py --compare baseline.json --tolerance 0.2
+
+Configuration (environment variables):
+    DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT   database to benchmark against
+"""
+import os
+import sys
+import json
+import math
+import time
+import asyncio
+import argparse
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+import seed_data
+from seed_data import DATA_TABLES
+from stub_llm import DEFAULT_RESPONSES, StubAnthropic, AsyncStubAnthropic
+
+STAGES = ["query", "query_columnar", "query_stream", "visualization", "chat"]
+
+INSERT_FILES = ["insert_companies.sql", "insert_financials.sql", "insert_stock_prices.sql",
+                "insert_analysts.sql", "insert_supply_chain.sql"]
+
+# Rows added to stock_prices per INSERT when scaling up
+SCALE_BATCH_ROWS = 1000000
+
+SCALE_STOCK_PRICES_SQL = """
+INSERT INTO stock_prices (company_id, price_date, open_price, high_price, low_price, close_price, volume, adj_close)
+SELECT c.company_id, p.price_date, p.open_price, p.open_price * 1.02, p.open_price * 0.98,
+       p.close_price, p.volume, p.close_price
+FROM (
+    SELECT g,
+           DATE '2021-01-01' + (g % 1095) AS price_date,
+           (random() * 990 + 10)::NUMERIC(10,2) AS open_price,
+           (random() * 990 + 10)::NUMERIC(10,2) AS close_price,
+           floor(random() * 9900000 + 100000)::BIGINT AS volume
+    FROM generate_series(1, %s) AS g
+) p
+JOIN (SELECT company_id, row_number() OVER (ORDER BY company_id) - 1 AS slot,
+             count(*) OVER () AS companies FROM companies) c
+  ON c.slot = p.g % c.companies
+"""
+
+# How often peak RSS is sampled
+RSS_SAMPLE_SECONDS = 0.05
+
+
+def db_settings():
+    return {
+        "dbname": os.getenv("DB_NAME"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "host": os.getenv("DB_HOST"),
+        "port": os.getenv("DB_PORT"),
+    }
+
+
+def load_data(stock_prices=0):
+    """Recreate the sample tables and load insert_*.sql; optionally scale stock_prices up."""
+    import psycopg2
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    conn = psycopg2.connect(**db_settings())
+    try:
+        with conn, conn.cursor() as cur:
+            print("Dropping and recreating the sample tables...")
+            cur.execute("DROP TABLE IF EXISTS {} CASCADE".format(", ".join(DATA_TABLES)))
+            with open(os.path.join(here, "create_tables.sql")) as f:
+                cur.execute(f.read())
+            for name in INSERT_FILES:
+                print("Loading {}...".format(name))
+                with open(os.path.join(here, name)) as f:
+                    cur.execute(f.read())
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM stock_prices")
+            rows = cur.fetchone()[0]
+        while rows < stock_prices:
+            batch = min(SCALE_BATCH_ROWS, stock_prices - rows)
+            with conn, conn.cursor() as cur:
+                cur.execute(SCALE_STOCK_PRICES_SQL, (batch,))
+            rows += batch
+            print("stock_prices: {} rows".format(rows))
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE")
+    finally:
+        conn.close()
+
+
+class RssSampler:
+    """Samples the resident set size of this process on a thread and keeps the peak."""
+
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def current():
+        """Current RSS in bytes; falls back to the lifetime peak where /proc is unavailable."""
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.current())
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(math.ceil(p / 100.0 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(stage, samples, elapsed, peak_rss):
+    latencies = [s["latency"] for s in samples]
+    first_bytes = [s["ttfb"] for s in samples]
+    return {
+        "stage": stage,
+        "requests": len(samples),
+        "errors": sum(1 for s in samples if s["error"]),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "ttfb_p50_ms": percentile(first_bytes, 50) * 1000,
+        "throughput_rps": len(samples) / elapsed if elapsed else 0.0,
+        "peak_rss_mb": peak_rss / (1024.0 * 1024.0),
+    }
+
+
+def is_error(status, body):
+    """True for failed requests: a non-200 status or an error reported in the body."""
+    if status != 200:
+        return True
+    if body.startswith(b"event:") or body.startswith(b":"):
+        return b"event: error" in body
+    for line in body.splitlines():
+        try:
+            payload = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(payload, dict) and (payload.get("has_error") or "error" in payload):
+            return True
+    return False
+
+
+def stage_request(stage, question, handles):
+    """(path, JSON body) of one request of a stage."""
+    if stage == "query":
+        return "/query", {"question": question}
+    if stage == "query_columnar":
+        return "/query", {"question": question, "format": "columnar"}
+    if stage == "query_stream":
+        return "/query", {"question": question, "stream": True}
+    if stage == "visualization":
+        return "/generate-visualization", {"result_handle": handles[question], "question": question}
+    return "/api/chat", {"message": question}
+
+
+class FlaskTarget:
+    """Runs requests against simplified_sql_app (and fixed_app for chat) on a thread pool."""
+
+    def __init__(self, llm):
+        import simplified_sql_app
+        import fixed_app
+
+        simplified_sql_app.client = llm
+        fixed_app.client = llm
+        # The chat app's execute_sql has hard-coded connection defaults
+        fixed_app.execute_sql = functools.partial(fixed_app.execute_sql, **{
+            key: value for key, value in db_settings().items() if value is not None})
+        self.apps = {"sql": simplified_sql_app.app, "chat": fixed_app.app}
+
+    def request(self, path, body):
+        app = self.apps["chat" if path == "/api/chat" else "sql"]
+        started = time.perf_counter()
+        response = app.test_client().post(path, json=body, buffered=False)
+        first_byte = None
+        chunks = []
+        try:
+            for chunk in response.response:
+                if first_byte is None:
+                    first_byte = time.perf_counter()
+                chunks.append(chunk if isinstance(chunk, bytes) else chunk.encode())
+        finally:
+            response.close()
+        finished = time.perf_counter()
+        return response.status_code, b"".join(chunks), started, first_byte or finished, finished
+
+    def run(self, requests, concurrency):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(lambda item: self.request(*item), requests))
+
+
+class AsyncTarget:
+    """Runs requests against async_app with the Quart test client on one event loop."""
+
+    def __init__(self, llm):
+        import async_app
+
+        async_app.async_client = llm
+        self.app = async_app.app
+
+    async def _request(self, client, semaphore, path, body):
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post(path, json=body)
+            first_byte = time.perf_counter()
+            data = await response.get_data()
+            finished = time.perf_counter()
+            return response.status_code, data, started, first_byte, finished
+
+    async def _run(self, requests, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        async with self.app.test_app() as test_app:
+            client = test_app.test_client()
+            return await asyncio.gather(*[self._request(client, semaphore, path, body) for path, body in requests])
+
+    def run(self, requests, concurrency):
+        return asyncio.run(self._run(requests, concurrency))
+
+
+def collect_handles(target, questions):
+    """Result handle of every question, for the visualization stage (not timed)."""
+    handles = {}
+    for question in questions:
+        status, body, _, _, _ = target.run([("/query", {"question": question})], 1)[0]
+        payload = json.loads(body) if status == 200 else {}
+        if payload.get("result_handle"):
+            handles[question] = payload["result_handle"]
+        else:
+            print("No result handle for {!r}; skipped in the visualization stage.".format(question))
+    return handles
+
+
+def run_stage(target, stage, questions, requests, concurrency, handles):
+    if stage == "visualization":
+        questions = [q for q in questions if q in handles]
+    if not questions:
+        return None
+    batch = [stage_request(stage, questions[i % len(questions)], handles) for i in range(requests)]
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        results = target.run(batch, concurrency)
+        elapsed = time.perf_counter() - started
+    samples = [{"latency": finished - begun, "ttfb": first_byte - begun, "error": is_error(status, body)}
+               for status, body, begun, first_byte, finished in results]
+    return summarize(stage, samples, elapsed, rss.peak)
+
+
+def print_report(report):
+    columns = [("stage", 14, ""), ("requests", 8, ""), ("errors", 6, ""), ("p50_ms", 9, ".1f"),
+               ("p95_ms", 9, ".1f"), ("p99_ms", 9, ".1f"), ("ttfb_p50_ms", 11, ".1f"),
+               ("throughput_rps", 14, ".2f"), ("peak_rss_mb", 11, ".1f")]
+    print(" ".join("{:{}{}}".format(name, "<" if i == 0 else ">", width)
+                   for i, (name, width, _) in enumerate(columns)))
+    for row in report["stages"]:
+        print(" ".join("{:{}{}{}}".format(row[name], "<" if i == 0 else ">", width, spec)
+                       for i, (name, width, spec) in enumerate(columns)))
+
+
+def regressions(report, baseline, tolerance):
+    """Stages whose p95 latency grew by more than tolerance (a fraction) over the baseline."""
+    previous = {row["stage"]: row for row in baseline["stages"]}
+    found = []
+    for row in report["stages"]:
+        before = previous.get(row["stage"])
+        if before and before["p95_ms"] and row["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            found.append("{}: p95 {:.1f} ms, baseline {:.1f} ms".format(row["stage"], row["p95_ms"], before["p95_ms"]))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the SQL chat endpoints")
+    parser.add_argument("--load", action="store_true", help="recreate and load the sample tables first")
+    parser.add_argument("--stock-prices", type=int, default=0, help="with --load, scale stock_prices to this many rows")
+    parser.add_argument("--rows", type=int, default=0,
+                        help="with --load, generate about this many rows with seed_data.py instead")
+    parser.add_argument("--app", choices=["flask", "async"], default="flask", help="app to benchmark")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma-separated stages to run")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight")
+    parser.add_argument("--requests", type=int, default=100, help="requests per stage")
+    parser.add_argument("--responses", help="JSON file of recorded responses ({question: {\"sql\": ...}})")
+    parser.add_argument("--ttft", type=float, default=0.4, help="simulated model time to first token, seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0, help="simulated model output rate")
+    parser.add_argument("--caches", action="store_true", help="keep the SQL, result and chart caches enabled")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--compare", help="baseline report to compare p95 latencies against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 growth over the baseline")
+    args = parser.parse_args()
+
+    load_dotenv()
+    # The apps refuse to start without a key; the stub never uses it
+    os.environ.setdefault("ANTHROPIC_API_KEY", "benchmark-stub")
+    if not args.caches:
+        for name in ("SQL_CACHE_ENABLED", "RESULT_CACHE_ENABLED", "CHART_CACHE_ENABLED"):
+            os.environ[name] = "0"
+
+    if args.load and args.rows:
+        seed_data.load(args.rows, workers=os.cpu_count() or 4)
+    elif args.load:
+        load_data(args.stock_prices)
+
+    responses = DEFAULT_RESPONSES
+    if args.responses:
+        with open(args.responses) as f:
+            responses = json.load(f)
+    questions = list(responses)
+
+    if args.app == "async":
+        llm = AsyncStubAnthropic(responses, ttft=args.ttft, tokens_per_second=args.tokens_per_second)
+        target = AsyncTarget(llm)
+    else:
+        llm = StubAnthropic(responses, ttft=args.ttft, tokens_per_second=args.tokens_per_second)
+        target = FlaskTarget(llm)
+
+    stages = [stage for stage in args.stages.split(",") if stage]
+    handles = collect_handles(target, questions) if "visualization" in stages else {}
+    report = {
+        "app": args.app,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "ttft": args.ttft,
+        "tokens_per_second": args.tokens_per_second,
+        "caches": args.caches,
+        "stages": [],
+    }
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error("unknown stage: {}".format(stage))
+        print("Running {} ({} requests, concurrency {})...".format(stage, args.requests, args.concurrency))
+        summary = run_stage(target, stage, questions, args.requests, args.concurrency, handles)
+        if summary:
+            report["stages"].append(summary)
+    report["llm"] = {"requests": llm.requests, "input_tokens": llm.input_tokens, "output_tokens": llm.output_tokens}
+
+    print()
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            found = regressions(report, json.load(f), args.tolerance)
+        for line in found:
+            print("Regression: {}".format(line))
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
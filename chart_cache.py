@@ -0,0 +1,242 @@
+"""
+Cache of model-generated chart templates, keyed by result shape and chart intent.
+
+The visualization prompt asks the model for a template rather than a finished
+chart: Chart.js code that reads its rows from a __CHART_DATA__ placeholder
+and draws on a canvas with the id __CHART_ID__. A template depends only on
+the result's columns and on what kind of chart the question asks for. So it
+is cached under (column names and kinds, intent), and later results with
+the same shape (revenue by quarter for another company, say) are bound into
+it locally without a model call.
+
+Configuration (environment variables):
+    CHART_CACHE_ENABLED      set to 0 to disable the cache (default 1)
+    CHART_CACHE_BACKEND      "sqlite" (default, survives restarts) or "memory"
+    CHART_CACHE_PATH         SQLite file for the sqlite backend (default chart_cache.db)
+    CHART_CACHE_MAX_ENTRIES  templates kept before the least recently used are evicted (default 500)
+"""
+import os
+import re
+import time
+import uuid
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from chart_planner import column_kind
+
+logger = logging.getLogger(__name__)
+
+DATA_PLACEHOLDER = "__CHART_DATA__"
+ID_PLACEHOLDER = "__CHART_ID__"
+
+# Bump when the visualization prompt changes so stale templates are not reused
+TEMPLATE_VERSION = "1"
+
+# Rows inspected to classify columns for the signature
+_SIGNATURE_SAMPLE = 200
+
+# Checked in order; the first matching intent wins
+_INTENTS = [
+    ("trend", re.compile(r"\b(trend|over time|history|historical|daily|weekly|monthly|quarterly|yearly|"
+                         r"annual|growth|change|evolution|timeline|since)\b")),
+    ("composition", re.compile(r"\b(share|breakdown|composition|proportion|percent|percentage|split|mix|"
+                               r"portion|fraction)\b")),
+    ("distribution", re.compile(r"\b(distribution|histogram|spread|range|frequency)\b")),
+    ("relationship", re.compile(r"\b(correlat\w*|relationship|versus|vs|against|scatter)\b")),
+    ("ranking", re.compile(r"\b(top|bottom|highest|lowest|most|least|largest|smallest|best|worst|rank\w*)\b")),
+    ("comparison", re.compile(r"\b(compare|comparison|by|per|each|across|between)\b")),
+]
+
+
+def chart_intent(question):
+    """Coarse kind of chart the question asks for ("trend", "ranking", ...), or "any"."""
+    text = (question or "").lower()
+    for intent, pattern in _INTENTS:
+        if pattern.search(text):
+            return intent
+    return "any"
+
+
+def result_signature(results):
+    """Column names with their kinds, e.g. "quarter:ordinal|revenue:number"."""
+    sample = results[:_SIGNATURE_SAMPLE]
+    columns = list(sample[0].keys()) if sample else []
+    return "|".join("{}:{}".format(c, column_kind(c, [row.get(c) for row in sample])) for c in columns)
+
+
+def is_template(html):
+    """True when the HTML reads its data and canvas id from the placeholders."""
+    return DATA_PLACEHOLDER in html and ID_PLACEHOLDER in html
+
+
+def bind_template(template, data_json):
+    """Chart HTML for a template and the JSON text of the rows to draw."""
+    # "</" would end the script element early
+    return (template.replace(ID_PLACEHOLDER, "chart-{}".format(uuid.uuid4().hex[:8]))
+            .replace(DATA_PLACEHOLDER, data_json.replace("</", "<\\/")))
+
+
+class MemoryBackend:
+    """In-process LRU store."""
+
+    def __init__(self, max_entries=500):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            template = self._entries.get(key)
+            if template is not None:
+                self._entries.move_to_end(key)
+            return template
+
+    def put(self, key, template, signature="", intent=""):
+        with self._lock:
+            self._entries[key] = template
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """Persistent store shared by all worker processes on a host; LRU by last access."""
+
+    def __init__(self, path="chart_cache.db", max_entries=500):
+        self.path = path
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chart_templates (
+                    cache_key TEXT PRIMARY KEY,
+                    signature TEXT NOT NULL,
+                    intent TEXT NOT NULL,
+                    template TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._conn()
+        row = conn.execute("SELECT template FROM chart_templates WHERE cache_key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute("UPDATE chart_templates SET last_access = ? WHERE cache_key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key, template, signature="", intent=""):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO chart_templates VALUES (?, ?, ?, ?, ?, ?)",
+                         (key, signature, intent, template, now, now))
+            excess = conn.execute("SELECT COUNT(*) FROM chart_templates").fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM chart_templates WHERE rowid IN ("
+                    "SELECT rowid FROM chart_templates ORDER BY last_access LIMIT ?)", (excess,))
+                self.evictions += excess
+
+    def clear(self):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM chart_templates")
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM chart_templates").fetchone()[0]
+
+
+class ChartTemplateCache:
+    """Chart templates keyed by result signature and question intent."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, results, question=None):
+        """(cache key, signature, intent) for a result and the question that produced it."""
+        signature = result_signature(results)
+        intent = chart_intent(question)
+        digest = hashlib.sha256("{}|{}|{}".format(TEMPLATE_VERSION, signature, intent).encode("utf-8"))
+        return digest.hexdigest()[:32], signature, intent
+
+    def lookup(self, results, question=None):
+        """The cached template for a result's shape and intent, or None on a miss."""
+        key, signature, intent = self.key(results, question)
+        template = self.backend.get(key)
+        with self._lock:
+            if template is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if template is not None:
+            logger.info("Chart template cache hit for {} ({})".format(signature, intent))
+        return template
+
+    def store(self, results, question, template):
+        if not is_template(template):
+            logger.info("Visualization does not use the data placeholders; not caching it.")
+            return
+        key, signature, intent = self.key(results, question)
+        self.backend.put(key, template, signature, intent)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": type(self.backend).__name__,
+                "entries": len(self.backend),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.backend.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_chart_cache():
+    """Process-wide template cache configured from CHART_CACHE_*; None when disabled."""
+    global _cache
+    if os.getenv("CHART_CACHE_ENABLED", "1") == "0":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            max_entries = int(os.getenv("CHART_CACHE_MAX_ENTRIES", "500"))
+            if os.getenv("CHART_CACHE_BACKEND", "sqlite") == "memory":
+                backend = MemoryBackend(max_entries)
+            else:
+                backend = SQLiteBackend(os.getenv("CHART_CACHE_PATH", "chart_cache.db"), max_entries)
+            _cache = ChartTemplateCache(backend)
+        return _cache
@@ -0,0 +1,410 @@
+"""
+Rule-based chart planning for query results.
+
+Most results have one of a few shapes: a time column with measures, a category
+with measures, a category split by a second low-cardinality category, or two
+measures to plot against each other. For these the chart is chosen from the
+column types and cardinalities and a Chart.js config is built directly, in
+milliseconds, instead of asking the model for a page of HTML. plan_chart
+returns None for any other shape, and callers fall back to the model.
+
+Large results are reduced first (see chart_reduction.py). Series are
+downsampled with LTTB or min/max buckets, long category lists are cut to the
+top N plus "Other", and dense scatter plots are binned. sample_rows picks the
+rows shown to the model on the same principles.
+
+Configuration (environment variables):
+    CHART_PLANNER      "on" (default) or "off" to always use the model
+    CHART_MAX_ROWS     rows read from a stored result for charting (default 200000)
+    CHART_MAX_POINTS   points drawn per chart before reducing (default 1000)
+    CHART_TOP_N        bars drawn before the rest are folded into "Other" (default 20)
+"""
+import os
+import re
+import json
+import uuid
+import decimal
+import logging
+from datetime import datetime, date
+from email.utils import parsedate_to_datetime
+
+import numpy as np
+
+from chart_reduction import lttb_indices, minmax_indices, top_n, bin_points, even_indices
+
+logger = logging.getLogger(__name__)
+
+CHART_MAX_ROWS = int(os.getenv("CHART_MAX_ROWS", "200000"))
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "1000"))
+CHART_TOP_N = int(os.getenv("CHART_TOP_N", "20"))
+
+# Most labels in a grouped bar chart before the shape is left to the model
+_MAX_BARS = 50
+# Most lines/bars per label in a grouped chart
+_MAX_SERIES = 8
+# Most measure columns plotted side by side
+_MAX_MEASURES = 4
+
+# Integer columns with these names are positions on an axis, not measures
+_ORDINAL_NAMES = {"year", "quarter", "month", "week", "day", "hour", "fiscal_year", "fiscal_quarter"}
+
+_ISO_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?([+-]\d{2}:?\d{2}|Z)?)?$")
+# jsonify renders dates as RFC 1123 strings, so rows posted back by the UI look like this
+_HTTP_DATE_RE = re.compile(r"^[A-Z][a-z]{2}, \d{2} [A-Z][a-z]{2} \d{4} \d{2}:\d{2}:\d{2} GMT$")
+_NUMBER_RE = re.compile(r"^-?\d+(\.\d+)?$")
+# Measures that cannot be summed into an "Other" bar
+_NON_ADDITIVE_RE = re.compile(r"avg|average|mean|median|min|max|price|rate|ratio|pct|percent|share|margin|score")
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+_PALETTE = ["#4e79a7", "#f28e2b", "#e15759", "#76b7b2", "#59a14f", "#edc948", "#b07aa1", "#ff9da7"]
+
+
+def is_number(value):
+    """True for int/float/Decimal values and numeric strings (not bools)."""
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, (int, float, decimal.Decimal)):
+        return True
+    return isinstance(value, str) and bool(_NUMBER_RE.match(value))
+
+
+def _is_time(value):
+    if isinstance(value, (datetime, date)):
+        return True
+    return isinstance(value, str) and bool(_ISO_DATE_RE.match(value) or _HTTP_DATE_RE.match(value))
+
+
+def _to_number(value):
+    if value is None:
+        return None
+    return float(value) if not isinstance(value, int) else value
+
+
+def _numbers(rows, column):
+    """Float array of a column, NaN where the value is missing."""
+    return np.array([np.nan if row[column] is None else float(row[column]) for row in rows], dtype=float)
+
+
+def _json_values(values):
+    """List for a Chart.js dataset, with None (a gap) in place of NaN."""
+    return [None if v != v else v for v in np.asarray(values, dtype=float).tolist()]
+
+
+def _to_time(value):
+    """Naive datetime for a date, datetime, ISO string or RFC 1123 string."""
+    if isinstance(value, str):
+        value = (parsedate_to_datetime(value) if _HTTP_DATE_RE.match(value)
+                 else datetime.fromisoformat(value.replace("Z", "+00:00")))
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    return value.replace(tzinfo=None)
+
+
+def _time_positions(values):
+    """Seconds since the epoch for a list of time values, as a float array."""
+    if all(type(v) is date for v in values):
+        # DATE columns: day ordinals are much cheaper than datetime64 conversion
+        days = np.fromiter(map(date.toordinal, values), dtype=np.int64, count=len(values))
+        return (days - _EPOCH_ORDINAL) * 86400.0
+    try:
+        # Vectorized for date/datetime objects and plain ISO strings
+        stamps = np.array(values, dtype="datetime64[us]")
+    except (ValueError, TypeError):
+        stamps = np.array([_to_time(v) for v in values], dtype="datetime64[us]")
+    return stamps.astype(np.int64) / 1e6
+
+
+def _time_labels(positions):
+    """Axis labels for epoch seconds: plain dates when every time is midnight."""
+    stamps = (np.asarray(positions) * 1e6).astype(np.int64).astype("datetime64[us]")
+    if np.all(np.asarray(positions) % 86400 == 0):
+        return np.datetime_as_string(stamps, unit="D").tolist()
+    return [label.replace("T", " ") for label in np.datetime_as_string(stamps, unit="s").tolist()]
+
+
+def column_kind(name, values):
+    """
+    "time", "ordinal", "number", "id", "category" or None (unusable) for a
+    column, judged from all of its non-null values.
+    """
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    # Type checks first; values are only inspected one by one for strings
+    types = {type(v) for v in values}
+    if types <= {date, datetime} or (str in types and all(_is_time(v) for v in values)):
+        return "time"
+    if types <= {int, float, decimal.Decimal} or (str in types and all(is_number(v) for v in values)):
+        lowered = name.lower()
+        if lowered in _ORDINAL_NAMES:
+            return "ordinal"
+        if lowered == "id" or lowered.endswith("_id"):
+            return "id"
+        return "number"
+    if all(isinstance(v, (str, bool)) for v in values):
+        return "category"
+    return None
+
+
+def _title(text):
+    return text.replace("_", " ").strip().title()
+
+
+def _dataset(label, data, index, chart_type):
+    color = _PALETTE[index % len(_PALETTE)]
+    dataset = {"label": label, "data": data, "borderColor": color,
+               "backgroundColor": color + ("33" if chart_type == "line" else "cc")}
+    if chart_type == "line":
+        dataset.update(fill=False, tension=0.2, pointRadius=2)
+    return dataset
+
+
+def _config(chart_type, labels, datasets, title, x_title=None, y_title=None, horizontal=False):
+    scales = {}
+    if chart_type not in ("scatter", "bubble") or x_title:
+        value_axis, label_axis = ("x", "y") if horizontal else ("y", "x")
+        scales = {
+            label_axis: {"title": {"display": bool(x_title), "text": x_title or ""}},
+            value_axis: {"beginAtZero": chart_type == "bar",
+                         "title": {"display": bool(y_title), "text": y_title or ""}},
+        }
+    config = {
+        "type": chart_type,
+        "data": {"datasets": datasets},
+        "options": {
+            "responsive": True,
+            "maintainAspectRatio": False,
+            "plugins": {
+                "title": {"display": True, "text": title},
+                "legend": {"display": len(datasets) > 1},
+            },
+            "scales": scales,
+        },
+    }
+    if labels is not None:
+        config["data"]["labels"] = labels
+    if horizontal:
+        config["options"]["indexAxis"] = "y"
+    return config
+
+
+def _pivot(labelled_rows, series_column, measure):
+    """
+    Labels, series and {series: [value per label]} for (label, row) pairs of
+    a long-format result, or None when a (label, series) pair repeats and
+    would need aggregating first.
+    """
+    labels, series, cells = [], [], {}
+    for x, row in labelled_rows:
+        s = row[series_column]
+        if x not in cells:
+            labels.append(x)
+            cells[x] = {}
+        if s not in series:
+            series.append(s)
+        if s in cells[x]:
+            return None
+        cells[x][s] = _to_number(row[measure])
+    return labels, series, {s: [cells[x].get(s) for x in labels] for s in series}
+
+
+def _axis_chart(results, x_column, kind, measures, categories):
+    """Line chart over a time or ordinal column."""
+    rows = [row for row in results if row[x_column] is not None]
+    if kind == "time":
+        positions = _time_positions([row[x_column] for row in rows])
+        to_labels = _time_labels
+    else:
+        positions = _numbers(rows, x_column)
+        to_labels = lambda picked: [p if p != int(p) else int(p) for p in np.asarray(picked).tolist()]
+    order = np.argsort(positions, kind="stable")
+    rows, positions = [rows[i] for i in order], positions[order]
+
+    if len(np.unique(positions)) == len(positions):
+        measures = measures[:_MAX_MEASURES]
+        values = np.vstack([_numbers(rows, m) for m in measures])
+        title = "{} over {}".format(", ".join(_title(m) for m in measures), _title(x_column))
+        if len(rows) > CHART_MAX_POINTS:
+            picked = (lttb_indices(positions, values[0], CHART_MAX_POINTS) if len(measures) == 1
+                      else minmax_indices(values, CHART_MAX_POINTS))
+            title += " ({} of {} points)".format(len(picked), len(rows))
+            positions, values = positions[picked], values[:, picked]
+        datasets = [_dataset(_title(m), _json_values(values[i]), i, "line") for i, m in enumerate(measures)]
+        return _config("line", to_labels(positions), datasets, title, _title(x_column),
+                       _title(measures[0]) if len(datasets) == 1 else None)
+
+    # Repeated x values: one line per value of a low-cardinality category
+    if len(measures) != 1:
+        return None
+    for series_column in categories:
+        if len({row[series_column] for row in rows}) <= _MAX_SERIES:
+            pivot = _pivot(zip(positions.tolist(), rows), series_column, measures[0])
+            if pivot is None:
+                return None
+            pivot_positions, series, values = pivot
+            matrix = np.array([[np.nan if v is None else v for v in values[s]] for s in series], dtype=float)
+            title = "{} over {} by {}".format(_title(measures[0]), _title(x_column), _title(series_column))
+            if len(pivot_positions) > CHART_MAX_POINTS:
+                picked = minmax_indices(matrix, CHART_MAX_POINTS)
+                title += " ({} of {} points)".format(len(picked), len(pivot_positions))
+                pivot_positions, matrix = [pivot_positions[i] for i in picked], matrix[:, picked]
+            datasets = [_dataset(str(s), _json_values(matrix[i]), i, "line") for i, s in enumerate(series)]
+            return _config("line", to_labels(pivot_positions), datasets, title, _title(x_column),
+                           _title(measures[0]))
+    return None
+
+
+def _category_chart(results, categories, measures):
+    """Bar chart of measures per category, or grouped bars for two categories."""
+    label_column = max(categories, key=lambda c: len({row[c] for row in results}))
+    labels = [row[label_column] for row in results]
+    distinct = len(set(labels))
+
+    if distinct == len(labels):
+        measures = measures[:_MAX_MEASURES]
+        labels = ["" if label is None else str(label) for label in labels]
+        values = np.vstack([_numbers(results, m) for m in measures])
+        title = "{} by {}".format(", ".join(_title(m) for m in measures), _title(label_column))
+        if distinct > CHART_TOP_N:
+            additive = not any(_NON_ADDITIVE_RE.search(m.lower()) for m in measures)
+            labels, values, rest = top_n(labels, values, CHART_TOP_N, fold_other=additive)
+            labels = labels.tolist()
+            title += (" (top {}, {} more in Other)".format(CHART_TOP_N - 1, rest) if additive
+                      else " (top {} of {})".format(CHART_TOP_N, distinct))
+        datasets = [_dataset(_title(m), _json_values(values[i]), i, "bar") for i, m in enumerate(measures)]
+        horizontal = len(labels) > 12 or sum(len(label) for label in labels) / max(len(labels), 1) > 15
+        return _config("bar", labels, datasets, title, _title(label_column),
+                       _title(measures[0]) if len(datasets) == 1 else None, horizontal=horizontal)
+
+    # Repeated labels: grouped bars split by a second, low-cardinality category
+    if len(measures) != 1 or distinct > _MAX_BARS:
+        return None
+    for series_column in categories:
+        if series_column == label_column or len({row[series_column] for row in results}) > _MAX_SERIES:
+            continue
+        pivot = _pivot(((row[label_column], row) for row in results), series_column, measures[0])
+        if pivot is None:
+            return None
+        labels, series, values = pivot
+        datasets = [_dataset(str(s), values[s], i, "bar") for i, s in enumerate(series)]
+        title = "{} by {} and {}".format(_title(measures[0]), _title(label_column), _title(series_column))
+        return _config("bar", [str(label) for label in labels], datasets, title,
+                       _title(label_column), _title(measures[0]))
+    return None
+
+
+def plan_chart(results):
+    """
+    Chart.js config for a list of row dicts, or None when the shape of the
+    result is not one the planner handles.
+    """
+    if not results or len(results) < 2 or not isinstance(results[0], dict):
+        return None
+    columns = list(results[0].keys())
+    kinds = {c: column_kind(c, [row.get(c) for row in results]) for c in columns}
+
+    measures = [c for c in columns if kinds[c] == "number"]
+    axes = [c for c in columns if kinds[c] in ("time", "ordinal")]
+    categories = [c for c in columns if kinds[c] == "category"]
+    if not measures:
+        return None
+
+    if axes:
+        return _axis_chart(results, axes[0], kinds[axes[0]], measures, categories)
+    if categories:
+        return _category_chart(results, categories, measures)
+    if len(measures) == 2:
+        return _scatter_chart(results, *measures)
+    return None
+
+
+def _scatter_chart(results, x, y):
+    """Scatter plot of two measures; dense plots become a bubble chart of binned counts."""
+    title = "{} vs {}".format(_title(y), _title(x))
+    xs, ys = _numbers(results, x), _numbers(results, y)
+    present = ~(np.isnan(xs) | np.isnan(ys))
+    if present.sum() <= CHART_MAX_POINTS:
+        points = [{"x": px, "y": py} for px, py in zip(xs[present].tolist(), ys[present].tolist())]
+        dataset = _dataset(title, points, 0, "scatter")
+        return _config("scatter", None, [dataset], title, _title(x), _title(y))
+
+    centers_x, centers_y, counts = bin_points(xs, ys, CHART_MAX_POINTS)
+    # Bubble area proportional to the number of points in the cell
+    radii = 2 + 13 * np.sqrt(counts / counts.max())
+    points = [{"x": px, "y": py, "r": round(r, 1), "count": int(c)}
+              for px, py, r, c in zip(centers_x.tolist(), centers_y.tolist(), radii.tolist(), counts.tolist())]
+    dataset = _dataset("Points per cell", points, 0, "bubble")
+    title += " ({} points binned)".format(int(present.sum()))
+    return _config("bubble", None, [dataset], title, _title(x), _title(y))
+
+
+def sample_rows(results, limit):
+    """
+    At most limit rows that represent the whole result, for prompts that
+    cannot take every row. Series are downsampled along their time or ordinal
+    axis, category results keep their largest rows, and anything else is
+    sampled evenly instead of just taking the first rows.
+    """
+    if len(results) <= limit or not isinstance(results[0], dict):
+        return results[:limit]
+    columns = list(results[0].keys())
+    kinds = {c: column_kind(c, [row.get(c) for row in results]) for c in columns}
+    measures = [c for c in columns if kinds[c] == "number"]
+    axes = [c for c in columns if kinds[c] in ("time", "ordinal")]
+
+    if measures and axes:
+        x_column = axes[0]
+        rows = [row for row in results if row[x_column] is not None]
+        positions = (_time_positions([row[x_column] for row in rows]) if kinds[x_column] == "time"
+                     else _numbers(rows, x_column))
+        order = np.argsort(positions, kind="stable")
+        rows = [rows[i] for i in order]
+        return [rows[i] for i in lttb_indices(positions[order], _numbers(rows, measures[0]), limit)]
+    if measures and kinds.get(columns[0]) == "category":
+        ranking = np.argsort(-np.nan_to_num(_numbers(results, measures[0]), nan=-np.inf), kind="stable")
+        return [results[i] for i in np.sort(ranking[:limit])]
+    return [results[i] for i in even_indices(len(results), limit)]
+
+
+def chart_html(config):
+    """
+    HTML snippet rendering a Chart.js config, in the same form the model is
+    asked for: a canvas plus a script that draws on it (loading Chart.js from
+    the CDN if the page does not already have it).
+    """
+    canvas_id = "chart-{}".format(uuid.uuid4().hex[:8])
+    # "</" would end the script element early
+    config_json = json.dumps(config).replace("</", "<\\/")
+    return """<div style="position: relative; height: 400px; width: 100%;">
+    <canvas id="{canvas_id}"></canvas>
+</div>
+<script>
+(function() {{
+    var config = {config};
+    function draw() {{ new Chart(document.getElementById('{canvas_id}'), config); }}
+    if (window.Chart) {{
+        draw();
+    }} else {{
+        var script = document.createElement('script');
+        script.src = 'https://cdn.jsdelivr.net/npm/chart.js';
+        script.onload = draw;
+        document.head.appendChild(script);
+    }}
+}})();
+</script>""".format(canvas_id=canvas_id, config=config_json)
+
+
+def local_visualization(results):
+    """Chart HTML from the planner, or None when the model should be asked instead."""
+    if os.getenv("CHART_PLANNER", "on") == "off":
+        return None
+    try:
+        config = plan_chart(results)
+    except Exception as e:
+        logger.warning("Chart planner failed, falling back to the model: {}".format(str(e)))
+        return None
+    if config is None:
+        return None
+    logger.info("Chart planner drew a {} chart for {} rows".format(config["type"], len(results)))
+    return chart_html(config)
@@ -0,0 +1,118 @@
+"""
+Vectorized reductions applied to query results before they are charted.
+
+A browser chart cannot show more points than it has pixels, and the model only
+sees a handful of rows. Sending the first N rows of a long result gives a
+misleading chart. These functions reduce a result to a bounded number of
+points that keeps its overall shape instead:
+
+    lttb_indices      Largest-Triangle-Three-Buckets for one series
+    minmax_indices    min and max of every bucket, for several series on one axis
+    top_n             the largest categories, the rest folded into "Other"
+    bin_points        2-D binning of a scatter plot into weighted cells
+
+All take and return NumPy arrays; NaN marks a missing value.
+"""
+import numpy as np
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Indices of the n_out points picked by Largest-Triangle-Three-Buckets.
+    x must be sorted. The first and last points are always kept.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+
+    # n_out - 2 buckets between the fixed first and last points
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    # Each bucket's triangle uses the average of the following bucket; the last uses the final point
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    next_x = np.append((sums_x / counts)[1:], x[-1])
+    next_y = np.append((sums_y / counts)[1:], y[-1])
+
+    picked = np.empty(n_out, dtype=int)
+    picked[0], picked[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        area = np.abs((x[a] - next_x[i]) * (y[start:end] - y[a])
+                      - (x[a] - x[start:end]) * (next_y[i] - y[a]))
+        a = start + int(np.argmax(area))
+        picked[i + 1] = a
+    return picked
+
+
+def minmax_indices(series, n_out):
+    """
+    Sorted indices keeping the minimum and maximum of each of about n_out / 2
+    equal-width buckets, for every series in a 2-D array (one row per series,
+    all sharing one x axis). Spikes survive in every series.
+    """
+    series = np.atleast_2d(np.asarray(series, dtype=float))
+    n = series.shape[1]
+    buckets = max(1, n_out // (2 * len(series)))
+    if n <= n_out or n <= 2 * buckets:
+        return np.arange(n)
+
+    size = -(-n // buckets)
+    padded = np.full((len(series), buckets * size), np.nan)
+    padded[:, :n] = series
+    shaped = padded.reshape(len(series), buckets, size)
+    offsets = np.arange(buckets)[None, :] * size
+    lows = np.argmin(np.where(np.isnan(shaped), np.inf, shaped), axis=2) + offsets
+    highs = np.argmax(np.where(np.isnan(shaped), -np.inf, shaped), axis=2) + offsets
+    picked = np.unique(np.concatenate([lows.ravel(), highs.ravel(), [0, n - 1]]))
+    return picked[picked < n]
+
+
+def top_n(labels, values, n, fold_other=True):
+    """
+    Keep the n categories with the largest first measure, in their original
+    order. With fold_other the remaining rows are summed into an "Other"
+    category (only meaningful for additive measures such as counts or totals).
+    labels is a 1-D array; values is 2-D, one row per measure.
+    Returns (labels, values, number of categories folded or dropped).
+    """
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    if len(labels) <= n:
+        return labels, values, 0
+    keep = n - 1 if fold_other else n
+    ranking = np.argsort(-np.nan_to_num(values[0], nan=-np.inf), kind="stable")
+    kept = np.sort(ranking[:keep])
+    rest = ranking[keep:]
+    labels = np.asarray(labels, dtype=object)[kept]
+    kept_values = values[:, kept]
+    if fold_other:
+        labels = np.append(labels, "Other")
+        kept_values = np.concatenate([kept_values, np.nansum(values[:, rest], axis=1)[:, None]], axis=1)
+    return labels, kept_values, len(rest)
+
+
+def bin_points(x, y, n_cells):
+    """
+    Bin a scatter plot into about n_cells grid cells. Returns the centers of
+    the non-empty cells and their point counts as (x, y, counts).
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    present = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[present], y[present]
+    bins = max(1, int(np.sqrt(n_cells)))
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=bins)
+    xi, yi = np.nonzero(counts)
+    x_centers = (x_edges[:-1] + x_edges[1:]) / 2
+    y_centers = (y_edges[:-1] + y_edges[1:]) / 2
+    return x_centers[xi], y_centers[yi], counts[xi, yi]
+
+
+def even_indices(n, n_out):
+    """n_out indices spread evenly over range(n), first and last included."""
+    if n <= n_out:
+        return np.arange(n)
+    return np.unique(np.linspace(0, n - 1, n_out).round().astype(int))
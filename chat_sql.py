@@ -0,0 +1,138 @@
+"""
+The chat's SQL generation request: schema, generate_sql tool and system prompt.
+
+Shared by fixed_app.py and async_app.py. The system prompt is built once per
+schema version and marked for prompt caching.
+"""
+from prompt_cache import system_blocks
+from sql_cache import schema_version
+
+# Hard-coded schema information extracted directly from the database
+CHAT_SCHEMA = """
+   analyst_estimates table:
+   Description: Wall Street analyst recommendations and price targets
+   Columns:
+      * estimate_id (PRIMARY KEY): Primary key for analyst estimate records
+      * company_id (FOREIGN KEY references companies.company_id): Foreign key linking to companies table
+      * analyst_firm: Name of the firm providing the analysis
+      * target_price: Analyst's 12-month price target
+      * recommendation: Analyst's recommendation (Buy, Sell, Hold, etc.)
+      * estimated_eps_next_quarter: Projected earnings per share for next quarter
+      * estimated_revenue_next_quarter: Projected revenue for next quarter
+      * estimate_date: Date when the estimate was published
+
+   companies table:
+   Description: Basic information about companies including sector, industry, and key details
+   Columns:
+      * company_id (PRIMARY KEY): Primary key and unique identifier for each company
+      * ticker: Stock market ticker symbol
+      * company_name: Full legal name of the company
+      * sector: Economic sector the company operates in
+      * industry: Specific industry within the sector
+      * founded_date: Date when the company was founded
+      * headquarters: Location of company headquarters
+      * employee_count: Number of employees at the company
+      * ceo_name: Name of the current CEO
+
+   company_financials table:
+   Description: Quarterly and annual financial data for companies including revenue and profits
+   Columns:
+      * financial_id (PRIMARY KEY): Primary key for financial records
+      * company_id (FOREIGN KEY references companies.company_id): Foreign key linking to companies table
+      * fiscal_year: Year of the financial reporting period
+      * fiscal_quarter: Quarter of the financial reporting period (1-4)
+      * revenue: Total sales during the reported period
+      * gross_profit: Revenue minus cost of goods sold
+      * operating_income: Profit from operations before interest and taxes
+      * net_income: Profit after all expenses and taxes
+      * eps: Earnings per share
+      * total_assets: Total value of assets owned by the company
+      * total_liabilities: Total debts and obligations owed by the company
+      * cash_and_equivalents: Cash and liquid assets available to the company
+      * report_date: Date when the financial report was published
+
+   stock_prices table:
+   Description: Daily stock price data for companies
+   Columns:
+      * price_id (PRIMARY KEY): Primary key for stock price records
+      * company_id (FOREIGN KEY references companies.company_id): Foreign key linking to companies table
+      * price_date: Date of the stock price information
+      * open_price: Stock price at market open
+      * high_price: Highest stock price during the trading day
+      * low_price: Lowest stock price during the trading day
+      * close_price: Stock closing price for the day
+      * volume: Number of shares traded
+      * adj_close: Adjusted closing price accounting for corporate actions
+
+   supply_chain table:
+   Description: Information about supplier relationships between companies
+   Columns:
+      * relationship_id (PRIMARY KEY): Primary key for supply chain relationship records
+      * company_id (FOREIGN KEY references companies.company_id): Foreign key linking to companies table (the buyer)
+      * supplier_id (FOREIGN KEY references companies.company_id): Foreign key linking to companies table (the supplier)
+      * component: Component or service provided by the supplier
+      * annual_value: Annual contract value in dollars
+      * contract_start_date: Start date of the supplier contract
+      * contract_end_date: End date of the supplier contract
+      * risk_level: Risk assessment level of the supply relationship
+    """
+CHAT_SCHEMA_VERSION = schema_version(CHAT_SCHEMA)
+
+# Define ONLY the SQL generation tool
+CHAT_SQL_TOOLS = [
+    {
+        "name": "generate_sql",
+        "description": "Generate a SQL query based on the user's request and the database schema",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "sql_query": {
+                    "type": "string",
+                    "description": "The SQL query to execute"
+                }
+            },
+            "required": ["sql_query"]
+        }
+    }
+]
+
+# System prompt for the chat's SQL generation; the schema is filled in once
+CHAT_SQL_SYSTEM_PROMPT = """You are a friendly and helpful AI assistant specializing in database querying.
+
+Your role is to:
+- Convert natural language questions into SQL queries based ONLY on the provided schema.
+- ALWAYS call the generate_sql tool for all user questions.
+- The database has the following tables and columns:
+{}
+
+IMPORTANT INSTRUCTIONS FOR DATABASE QUERIES:
+1. ALWAYS use the generate_sql tool for ALL questions.
+2. ONLY use the tables and columns listed in the schema description above. Do NOT invent tables or columns. Verify column names like primary/foreign keys from the list above.
+3. When joining tables, ALWAYS use the appropriate primary and foreign keys:
+   - Join tables using the exact foreign key relationships shown in the schema.
+   - All foreign keys are explicitly marked with "(FOREIGN KEY references table.column)".
+4. If the schema doesn't contain exactly what the user is asking for, use the most relevant tables and columns FROM THE PROVIDED SCHEMA.
+5. Pay close attention to column names including their exact spelling and table prefixes.
+6. Use JOINs, subqueries, and advanced SQL features when appropriate, but ensure all referenced tables/columns are in the provided schema.
+
+IMPORTANT: Do not include any internal thinking or reasoning in your responses. Only provide the final output using the generate_sql tool."""
+
+
+def chat_sql_request(question):
+    """
+    Messages API arguments for the chat's SQL generation call.
+    Shared by the Flask app and the async app. The system prompt is built
+    once and marked for prompt caching, so only the question varies.
+    """
+    system = system_blocks("chat_sql", CHAT_SCHEMA_VERSION,
+                           lambda: CHAT_SQL_SYSTEM_PROMPT.format(CHAT_SCHEMA))
+
+    return dict(
+        model="claude-3-7-sonnet-20250219",
+        max_tokens=1000,
+        temperature=0.1,
+        system=system,
+        messages=[{"role": "user", "content": question}],
+        tools=CHAT_SQL_TOOLS,
+        tool_choice={"type": "auto"}
+    )
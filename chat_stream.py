@@ -0,0 +1,276 @@
+"""
+Server-sent events for the chat endpoint.
+
+The chat reply is produced by a function that calls emit(event, data) for
+every piece of output (model text deltas, the generated SQL, errors) as soon
+as it exists. sse_stream runs that producer on a thread and turns its output
+into SSE frames:
+
+- output goes through a bounded queue, so a slow client makes emit() block
+  and the producer stops reading from the model (backpressure)
+- a comment frame is sent when nothing was emitted for CHAT_HEARTBEAT_SECONDS,
+  which keeps proxies from closing the connection and lets the server notice
+  a client that went away while the database or the model is busy
+- when the client disconnects, the next emit() raises ClientGone, which closes
+  the upstream model stream the producer is reading
+
+sse_stream_async does the same for the async app with an asyncio task, which
+is cancelled outright on disconnect.
+
+Analysis replies arrive as the string fields of an analyze_data tool call;
+JsonStringStreamer decodes those fields incrementally from the partial JSON.
+
+Configuration (environment variables):
+    CHAT_HEARTBEAT_SECONDS   idle seconds before a heartbeat frame (default 15)
+    CHAT_STREAM_QUEUE_SIZE   events buffered ahead of the client (default 64)
+"""
+import os
+import re
+import json
+import queue
+import asyncio
+import logging
+import threading
+import contextvars
+
+logger = logging.getLogger(__name__)
+
+CHAT_HEARTBEAT_SECONDS = float(os.getenv("CHAT_HEARTBEAT_SECONDS", "15"))
+CHAT_STREAM_QUEUE_SIZE = int(os.getenv("CHAT_STREAM_QUEUE_SIZE", "64"))
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+HEARTBEAT = ": heartbeat\n\n"
+
+# Headings the chat reply puts before each analyze_data field
+ANALYSIS_HEADINGS = {"analysis": "Analysis:\n", "suggestions": "\n\nSuggestions:\n"}
+
+# How often a producer blocked on a full queue checks whether the client is gone
+_PUT_POLL_SECONDS = 0.5
+
+_DONE = object()
+
+# A \uXXXX escape cut off at the end of a chunk, or a high surrogate that needs its pair
+_PARTIAL_ESCAPE = re.compile(r'\\u(?:[0-9a-fA-F]{0,3}|[dD][89abAB][0-9a-fA-F]{2})$')
+
+
+class ClientGone(Exception):
+    """Raised by emit() once the client has disconnected."""
+
+
+def sse(event, data):
+    """One SSE frame with a JSON payload."""
+    return "event: {}\ndata: {}\n\n".format(event, json.dumps(data))
+
+
+class JsonStringStreamer:
+    """
+    Incremental decoder for the top-level string fields of a streamed JSON
+    object (a tool call's input). feed() returns (field, text) fragments as
+    soon as they can be decoded; non-string values are skipped.
+    """
+
+    def __init__(self):
+        self._state = "key_wait"
+        self._key = ""
+        self._raw = ""
+        self._escaped = False
+        self._depth = 0
+        self._in_string = False
+
+    def feed(self, partial_json):
+        fragments = []
+        for ch in partial_json:
+            state = self._state
+            if state == "key_wait":
+                if ch == '"':
+                    self._state, self._raw, self._escaped = "key", "", False
+            elif state in ("key", "string"):
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    if state == "key":
+                        self._key = json.loads('"' + self._raw + '"')
+                        self._state = "colon"
+                    else:
+                        self._flush(fragments, final=True)
+                        self._state = "key_wait"
+                    continue
+                self._raw += ch
+            elif state == "colon":
+                if ch == ":":
+                    self._state = "value_wait"
+            elif state == "value_wait":
+                if ch == '"':
+                    self._state, self._raw, self._escaped = "string", "", False
+                elif not ch.isspace():
+                    self._state, self._in_string = "other", False
+                    self._depth = 1 if ch in "[{" else 0
+            else:
+                self._skip_value(ch)
+        if self._state == "string":
+            self._flush(fragments)
+        return fragments
+
+    def _skip_value(self, ch):
+        """Track a number, literal, array or object value until it ends."""
+        if self._in_string:
+            if self._escaped:
+                self._escaped = False
+            elif ch == "\\":
+                self._escaped = True
+            elif ch == '"':
+                self._in_string = False
+        elif ch == '"':
+            self._in_string = True
+        elif ch in "[{":
+            self._depth += 1
+        elif ch in "]}":
+            self._depth -= 1
+            if self._depth < 0:
+                self._state = "key_wait"
+        elif ch == "," and self._depth == 0:
+            self._state = "key_wait"
+
+    def _flush(self, fragments, final=False):
+        raw = self._raw
+        if not final:
+            # Hold back an escape that is not complete yet
+            if self._escaped:
+                raw = raw[:-1]
+            while True:
+                match = _PARTIAL_ESCAPE.search(raw)
+                if not match:
+                    break
+                before = raw[:match.start()]
+                # Only an unescaped backslash starts an escape
+                if (len(before) - len(before.rstrip("\\"))) % 2:
+                    break
+                raw = before
+        if raw:
+            fragments.append((self._key, json.loads('"' + raw + '"')))
+        self._raw = self._raw[len(raw):]
+
+
+def analysis_fragments(event, state):
+    """
+    Chat text from one analysis stream event: the analyze_data fields under
+    their headings, or the plain text of a reply that did not use the tool.
+    state is a dict shared across the events of one stream.
+    """
+    if event.type == "content_block_start":
+        block = event.content_block
+        state["streamer"] = JsonStringStreamer() if block.type == "tool_use" and block.name == "analyze_data" else None
+        return []
+    if event.type != "content_block_delta":
+        return []
+    if event.delta.type == "text_delta":
+        # Text around a tool call is commentary; it is only the reply when no tool is used
+        return [] if state.get("used_tool") else [event.delta.text]
+    if event.delta.type == "input_json_delta" and state.get("streamer"):
+        state["used_tool"] = True
+        texts = []
+        for field, text in state["streamer"].feed(event.delta.partial_json):
+            if field not in ANALYSIS_HEADINGS:
+                continue
+            started = state.setdefault("started", [])
+            if field not in started:
+                heading = ANALYSIS_HEADINGS[field]
+                texts.append(heading if started else heading.lstrip())
+                started.append(field)
+            texts.append(text)
+        return texts
+    return []
+
+
+def sse_stream(produce, heartbeat=CHAT_HEARTBEAT_SECONDS, queue_size=CHAT_STREAM_QUEUE_SIZE):
+    """
+    Generator of SSE frames for produce(emit), run on a worker thread. Ends
+    with a "done" event; an exception in the producer becomes an "error" event.
+    Closing the generator (client disconnect) makes the next emit() raise ClientGone.
+    """
+    events = queue.Queue(maxsize=queue_size)
+    cancelled = threading.Event()
+
+    def put(item):
+        while not cancelled.is_set():
+            try:
+                events.put(item, timeout=_PUT_POLL_SECONDS)
+                return
+            except queue.Full:
+                continue
+        raise ClientGone()
+
+    def emit(event, data):
+        put((event, data))
+
+    def run():
+        try:
+            produce(emit)
+        except ClientGone:
+            logger.info("Chat client disconnected; upstream stream closed.")
+            return
+        except Exception as e:
+            logger.error("Error in chat stream: {}".format(str(e)))
+            try:
+                emit("error", {"message": "Oops! Something went wrong processing your request."})
+            except ClientGone:
+                return
+        try:
+            put(_DONE)
+        except ClientGone:
+            pass
+
+    # The producer's spans belong to the request that started it
+    threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True).start()
+    try:
+        while True:
+            try:
+                item = events.get(timeout=heartbeat)
+            except queue.Empty:
+                yield HEARTBEAT
+                continue
+            if item is _DONE:
+                yield sse("done", {})
+                return
+            yield sse(*item)
+    finally:
+        cancelled.set()
+
+
+async def sse_stream_async(produce, heartbeat=CHAT_HEARTBEAT_SECONDS, queue_size=CHAT_STREAM_QUEUE_SIZE):
+    """
+    Async counterpart of sse_stream: produce(emit) is a coroutine function
+    run as a task, emit is awaited, and the task is cancelled on disconnect.
+    """
+    events = asyncio.Queue(maxsize=queue_size)
+
+    async def emit(event, data):
+        await events.put((event, data))
+
+    async def run():
+        try:
+            await produce(emit)
+        except Exception as e:
+            logger.error("Error in chat stream: {}".format(str(e)))
+            await emit("error", {"message": "Oops! Something went wrong processing your request."})
+        await events.put(_DONE)
+
+    task = asyncio.create_task(run())
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(events.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield HEARTBEAT
+                continue
+            if item is _DONE:
+                yield sse("done", {})
+                return
+            yield sse(*item)
+    finally:
+        if not task.done():
+            task.cancel()
+            logger.info("Chat client disconnected; upstream stream cancelled.")
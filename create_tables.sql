@@ -5,7 +5,9 @@ CREATE TABLE IF NOT EXISTS table_metadata (
     id SERIAL PRIMARY KEY,
     table_name TEXT NOT NULL,
     table_description TEXT,
-    embedding VECTOR(1536)
+    embedding VECTOR(1536),
+    description_hash TEXT,
+    embedding_model TEXT
 );
 
 CREATE TABLE IF NOT EXISTS column_metadata (
@@ -13,7 +15,9 @@ CREATE TABLE IF NOT EXISTS column_metadata (
     table_name TEXT NOT NULL,
     column_name TEXT NOT NULL,
     column_description TEXT,
-    embedding VECTOR(1536)
+    embedding VECTOR(1536),
+    description_hash TEXT,
+    embedding_model TEXT
 );
 
 -- Create companies table
@@ -0,0 +1,288 @@
+"""
+Process-wide PostgreSQL connection pool.
+
+execute_sql used to open a fresh psycopg2 connection for every query and close
+it again afterwards. This module keeps warm connections around instead and
+hands them out per request, with a bounded size, health checks for
+connections that sat idle, and a timeout on checkout.
+
+Configuration (environment variables):
+    DB_POOL_MIN_SIZE            connections opened up front (default 1)
+    DB_POOL_MAX_SIZE            hard cap on open connections (default 10)
+    DB_POOL_TIMEOUT             seconds to wait for a free connection (default 30)
+    DB_POOL_HEALTH_CHECK_AFTER  idle seconds after which a connection is pinged
+                                before being handed out (default 30)
+    DB_POOL_MAX_LIFETIME        seconds after which a connection is recycled
+                                (default 1800)
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+try:
+    import psycopg2
+    import psycopg2.extensions
+    psycopg2_available = True
+except ImportError:
+    psycopg2_available = False
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out within the timeout."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+
+    Idle connections are reused most-recently-used first so the warmest
+    connection is handed out. Connections that have been idle longer than
+    health_check_after are pinged with SELECT 1 before use, and connections
+    older than max_lifetime are closed and replaced.
+    """
+
+    def __init__(self, min_size=1, max_size=10, timeout=30.0,
+                 health_check_after=30.0, max_lifetime=1800.0, **conn_kwargs):
+        if not psycopg2_available:
+            raise ImportError("psycopg2 library is required but not installed. Please install it to connect to PostgreSQL.")
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError("Invalid pool size: min_size={}, max_size={}".format(min_size, max_size))
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self.max_lifetime = max_lifetime
+        self.conn_kwargs = conn_kwargs
+
+        self._cond = threading.Condition()
+        self._idle = []        # (conn, last_used) pairs, most recently used last
+        self._born = {}        # id(conn) -> creation time
+        self._size = 0         # open connections, idle + checked out + being opened
+        self._checked_out = 0
+        self._waiting = 0
+        self._created = 0
+        self._recycled = 0
+        self._closed = False
+
+        for _ in range(min_size):
+            with self._cond:
+                self._size += 1
+            conn = self._open()
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+
+    def _open(self):
+        """Open a new connection. The caller must already have reserved a slot."""
+        try:
+            conn = psycopg2.connect(**self.conn_kwargs)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._born[id(conn)] = time.monotonic()
+            self._created += 1
+        logger.info("Opened pooled connection to database '{}' on {}:{}".format(
+            self.conn_kwargs.get('dbname'), self.conn_kwargs.get('host'), self.conn_kwargs.get('port')))
+        return conn
+
+    def _close(self, conn):
+        """Close a connection and release its slot."""
+        with self._cond:
+            self._born.pop(id(conn), None)
+            self._size -= 1
+            self._cond.notify()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, last_used):
+        """Check a connection before handing it out."""
+        if conn.closed:
+            return False
+        now = time.monotonic()
+        with self._cond:
+            born = self._born.get(id(conn), now)
+        if now - born > self.max_lifetime:
+            return False
+        if now - last_used < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception as e:
+            logger.warning("Pooled connection failed health check: {}".format(str(e)))
+            return False
+
+    def getconn(self, timeout=None):
+        """
+        Check out a connection, waiting up to timeout seconds for one to free up.
+        Raises PoolTimeout if the pool stays exhausted for the whole timeout.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolTimeout("Connection pool is closed.")
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        conn, last_used = None, None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout("Timed out after {}s waiting for a database connection "
+                                          "(pool max_size={}).".format(timeout, self.max_size))
+                    # Only callers actually blocked on the pool count as waiting
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+            if conn is None:
+                conn = self._open()
+            elif not self._is_healthy(conn, last_used):
+                self._close(conn)
+                with self._cond:
+                    self._recycled += 1
+                continue
+
+            with self._cond:
+                self._checked_out += 1
+            return conn
+
+    def putconn(self, conn, discard=False):
+        """
+        Return a connection to the pool. Any open transaction is rolled back so
+        the next user starts clean; broken connections are closed instead.
+        """
+        with self._cond:
+            self._checked_out -= 1
+
+        if not discard and not self._closed and not conn.closed:
+            try:
+                status = conn.get_transaction_status()
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    discard = True
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        else:
+            discard = True
+
+        if discard:
+            self._close(conn)
+            with self._cond:
+                self._recycled += 1
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Context manager that checks out a connection and always returns it,
+        including when a generator holding it is closed early. Connections that
+        fail with an OperationalError/InterfaceError are discarded rather than
+        put back.
+        """
+        with span("db_checkout"):
+            conn = self.getconn(timeout)
+        try:
+            yield conn
+        except BaseException as e:
+            broken = conn.closed or isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            self.putconn(conn, discard=broken)
+            raise
+        else:
+            self.putconn(conn)
+
+    def close(self):
+        """Close all idle connections and refuse further checkouts."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        """Snapshot of pool counters."""
+        with self._cond:
+            return {
+                "database": self.conn_kwargs.get('dbname'),
+                "host": self.conn_kwargs.get('host'),
+                "port": self.conn_kwargs.get('port'),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "checked_out": self._checked_out,
+                "waiting": self._waiting,
+                "created": self._created,
+                "recycled": self._recycled,
+            }
+
+
+# Registry of pools, one per distinct set of connection parameters
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+# Pools inherited across a fork are kept referenced but never touched, so the
+# child does not close sockets that still belong to the parent process.
+_inherited_pools = []
+
+
+def get_pool(**conn_kwargs):
+    """
+    Return the process-wide pool for the given connection parameters,
+    creating it on first use with settings from the DB_POOL_* variables.
+    """
+    global _pools_pid
+    key = tuple(sorted(conn_kwargs.items()))
+
+    with _pools_lock:
+        if os.getpid() != _pools_pid:
+            _inherited_pools.extend(_pools.values())
+            _pools.clear()
+            _pools_pid = os.getpid()
+
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(
+                min_size=int(os.getenv("DB_POOL_MIN_SIZE", "1")),
+                max_size=int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+                timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+                health_check_after=float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER", "30")),
+                max_lifetime=float(os.getenv("DB_POOL_MAX_LIFETIME", "1800")),
+                **conn_kwargs
+            )
+            _pools[key] = pool
+        return pool
+
+
+def pool_stats():
+    """Stats for every pool opened by this process."""
+    with _pools_lock:
+        pools = list(_pools.values()) if os.getpid() == _pools_pid else []
+    return [pool.stats() for pool in pools]
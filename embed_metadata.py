@@ -0,0 +1,146 @@
+"""
+Offline job that fills the embedding columns of table_metadata and column_metadata.
+
+Descriptions are embedded in batches with the configured embedder (see
+embeddings.py) and written back with one UPDATE ... FROM (VALUES ...) per
+batch via execute_values. Each row records a hash of the embedded text and
+the embedding model, so re-running the job only embeds rows whose description
+(or model) changed. Finally an HNSW index (ivfflat on pgvector < 0.5) is
+built on each embedding column for fast cosine-distance lookups.
+
+Usage:
+    python embed_metadata.py [--batch-size 256] [--force] [--no-index]
+
+Connection settings come from DB_NAME, DB_USER, DB_PASSWORD, DB_HOST and DB_PORT.
+"""
+import os
+import time
+import hashlib
+import logging
+import argparse
+
+from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+
+from db_pool import get_pool
+from embeddings import get_embedder
+from schema_retrieval import table_text, column_text, vector_literal
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Per metadata table: the SELECT listing rows and how to build the text to embed
+_TARGETS = {
+    'table_metadata': (
+        "SELECT id, table_name, table_description, description_hash, embedding_model FROM table_metadata",
+        lambda row: table_text(row[1], row[2]),
+    ),
+    'column_metadata': (
+        "SELECT id, table_name, column_name, column_description, description_hash, embedding_model "
+        "FROM column_metadata",
+        lambda row: column_text(row[1], row[2], row[3]),
+    ),
+}
+
+
+def description_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def ensure_columns(conn):
+    """Add the bookkeeping columns to databases created before they existed."""
+    with conn.cursor() as cur:
+        for table in _TARGETS:
+            cur.execute("ALTER TABLE {} ADD COLUMN IF NOT EXISTS description_hash TEXT".format(table))
+            cur.execute("ALTER TABLE {} ADD COLUMN IF NOT EXISTS embedding_model TEXT".format(table))
+    conn.commit()
+
+
+def stale_rows(conn, table, embedder, force=False):
+    """(id, text, hash) for rows whose embedding is missing or out of date."""
+    query, to_text = _TARGETS[table]
+    with conn.cursor() as cur:
+        cur.execute(query)
+        rows = cur.fetchall()
+    stale = []
+    for row in rows:
+        text = to_text(row)
+        digest = description_hash(text)
+        if force or row[-2] != digest or row[-1] != embedder.name:
+            stale.append((row[0], text, digest))
+    return stale, len(rows)
+
+
+def embed_table(conn, table, embedder, batch_size=256, force=False):
+    """Embed and write back the stale rows of one metadata table; returns the number updated."""
+    stale, total = stale_rows(conn, table, embedder, force)
+    logger.info("{}: {} of {} rows need embedding".format(table, len(stale), total))
+
+    for start in range(0, len(stale), batch_size):
+        batch = stale[start:start + batch_size]
+        vectors = embedder.embed_batch([text for _, text, _ in batch])
+        values = [(row_id, vector_literal(vector), digest, embedder.name)
+                  for (row_id, _, digest), vector in zip(batch, vectors)]
+        with conn.cursor() as cur:
+            execute_values(cur, """
+                UPDATE {table} AS t
+                SET embedding = v.embedding, description_hash = v.description_hash,
+                    embedding_model = v.embedding_model
+                FROM (VALUES %s) AS v (id, embedding, description_hash, embedding_model)
+                WHERE t.id = v.id
+            """.format(table=table), values, template="(%s, %s::vector, %s, %s)", page_size=batch_size)
+        conn.commit()
+    return len(stale)
+
+
+def build_index(conn, table):
+    """Cosine-distance index on the embedding column: HNSW, or ivfflat where HNSW is unavailable."""
+    name = "{}_embedding_idx".format(table)
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_indexes WHERE indexname = %s", (name,))
+        if cur.fetchone():
+            return
+        try:
+            cur.execute("CREATE INDEX {} ON {} USING hnsw (embedding vector_cosine_ops)".format(name, table))
+            method = "hnsw"
+        except Exception as e:
+            conn.rollback()
+            logger.warning("HNSW index not available ({}); using ivfflat.".format(str(e).strip()))
+            cur.execute("SELECT count(*) FROM {}".format(table))
+            # pgvector's guidance: about rows / 1000 lists, at least 1
+            lists = max(1, cur.fetchone()[0] // 1000)
+            cur.execute("CREATE INDEX {} ON {} USING ivfflat (embedding vector_cosine_ops) "
+                        "WITH (lists = {})".format(name, table, lists))
+            method = "ivfflat"
+        cur.execute("ANALYZE {}".format(table))
+    conn.commit()
+    logger.info("Built {} index {}".format(method, name))
+
+
+def embed_metadata(batch_size=256, force=False, create_index=True):
+    embedder = get_embedder()
+    pool = get_pool(dbname=os.getenv("DB_NAME"), user=os.getenv("DB_USER"), password=os.getenv("DB_PASSWORD"),
+                    host=os.getenv("DB_HOST"), port=os.getenv("DB_PORT"))
+    started = time.monotonic()
+    updated = 0
+    with pool.connection() as conn:
+        ensure_columns(conn)
+        for table in _TARGETS:
+            updated += embed_table(conn, table, embedder, batch_size, force)
+            if create_index:
+                build_index(conn, table)
+    logger.info("Embedded {} descriptions with {} in {:.2f}s".format(
+        updated, embedder.name, time.monotonic() - started))
+    return updated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fill the embedding columns of table_metadata and column_metadata.")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("EMBED_BATCH_SIZE", "256")),
+                        help="descriptions embedded and written per round trip (default 256)")
+    parser.add_argument("--force", action="store_true", help="re-embed every row, even unchanged ones")
+    parser.add_argument("--no-index", action="store_true", help="skip building the vector indexes")
+    args = parser.parse_args()
+    embed_metadata(batch_size=args.batch_size, force=args.force, create_index=not args.no_index)
@@ -0,0 +1,139 @@
+"""
+Text embeddings used for similarity lookups (question cache, schema retrieval).
+
+The default HashingEmbedder needs no model download or network access: it
+hashes words, word bigrams and character trigrams into a fixed-size vector.
+That is enough to catch rephrasings and typos of the same question offline.
+If EMBEDDING_MODEL names a sentence-transformers model and the library is
+installed, that local model is used instead.
+
+Vectors are L2-normalised float32 arrays of EMBEDDING_DIM entries, the size
+of the VECTOR(1536) columns in table_metadata/column_metadata, so a dot
+product is the cosine similarity.
+"""
+import os
+import re
+import zlib
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 1536
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Filler words that carry no meaning for matching questions to each other or to schema text
+STOPWORDS = frozenset("""
+a an the of for in on at to by with from and or is are was were be been what which who whom
+whose how show me give list find get tell display please can could would you i we our all each
+their there this that these those do does did
+""".split())
+
+
+def tokenize(text):
+    """Lowercase word tokens; identifiers like close_price split on underscores."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+def stem(word):
+    """Crude plural stripping so "companies" matches "company" and "prices" matches "price"."""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+class HashingEmbedder:
+    """Feature-hashing embedder over words, word bigrams and char trigrams."""
+
+    name = "hashing-v1"
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+
+    def _features(self, text):
+        words = [w for w in tokenize(text) if w not in STOPWORDS]
+        features = list(words)
+        features.extend("{} {}".format(a, b) for a, b in zip(words, words[1:]))
+        for word in words:
+            padded = "<{}>".format(word)
+            features.extend("#" + padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def embed_batch(self, texts):
+        """Embed a list of texts into an (n, dim) array."""
+        rows, cols, signs = [], [], []
+        for i, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                rows.append(i)
+                cols.append(h % self.dim)
+                signs.append(1.0 if (h >> 31) & 1 else -1.0)
+
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        if rows:
+            np.add.at(vectors, (np.array(rows), np.array(cols)), np.array(signs, dtype=np.float32))
+        return _normalize(vectors)
+
+    def embed(self, text):
+        return self.embed_batch([text])[0]
+
+
+class SentenceTransformerEmbedder:
+    """Local sentence-transformers model, zero-padded to EMBEDDING_DIM."""
+
+    def __init__(self, model_name, dim=EMBEDDING_DIM):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+        self.name = "st:{}".format(model_name)
+        self.dim = dim
+
+    def embed_batch(self, texts, batch_size=64):
+        vectors = self.model.encode(list(texts), batch_size=batch_size, convert_to_numpy=True)
+        return _normalize(_fit_dimension(vectors.astype(np.float32), self.dim))
+
+    def embed(self, text):
+        return self.embed_batch([text])[0]
+
+
+def _fit_dimension(vectors, dim):
+    """Zero-pad or truncate vectors to dim columns (padding keeps cosine intact)."""
+    if vectors.shape[1] == dim:
+        return vectors
+    if vectors.shape[1] > dim:
+        return vectors[:, :dim]
+    padded = np.zeros((vectors.shape[0], dim), dtype=np.float32)
+    padded[:, :vectors.shape[1]] = vectors
+    return padded
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder():
+    """Process-wide embedder chosen from EMBEDDING_MODEL (hashing by default)."""
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            model_name = os.getenv("EMBEDDING_MODEL", "")
+            if model_name and model_name != "hashing":
+                try:
+                    _embedder = SentenceTransformerEmbedder(model_name)
+                    logger.info("Using local embedding model {}".format(model_name))
+                except Exception as e:
+                    logger.warning("Could not load embedding model {} ({}); falling back to hashing embedder.".format(
+                        model_name, str(e)))
+            if _embedder is None:
+                _embedder = HashingEmbedder()
+        return _embedder
@@ -0,0 +1,144 @@
+"""
+Provider-side prompt caching for the static SQL generation system prompts.
+
+The system prompt (instructions plus schema text) is assembled once per
+schema version and sent as a text block marked with cache_control, so the
+provider caches the tools and system prompt and only the question is
+processed anew on later requests. Prompts shorter than the provider's
+minimum cacheable length (e.g. small retrieved schema slices) are sent
+as usual and simply not cached.
+
+Cache write/read token counts reported in each response's usage are logged
+per request and summed for GET /cache-stats.
+
+Configuration (environment variables):
+    PROMPT_CACHE_ENABLED      set to 0 to send system prompts without cache_control (default 1)
+    PROMPT_CACHE_MAX_PROMPTS  assembled system prompts kept in memory (default 64)
+"""
+import os
+import logging
+import threading
+from collections import OrderedDict, deque
+
+from tracing import record_llm_usage
+
+logger = logging.getLogger(__name__)
+
+# Per-request usage records kept for /cache-stats
+_RECENT_REQUESTS = 20
+
+
+class SystemPrompts:
+    """LRU of assembled system prompt blocks keyed by (prompt name, schema version)."""
+
+    def __init__(self, max_prompts=64, cache_control=True):
+        self.max_prompts = max_prompts
+        self.cache_control = cache_control
+        self._prompts = OrderedDict()
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def get(self, name, version, build):
+        """System blocks for the prompt, calling build() for its text only on the first use of a version."""
+        key = (name, version)
+        with self._lock:
+            blocks = self._prompts.get(key)
+            if blocks is not None:
+                self._prompts.move_to_end(key)
+                return blocks
+
+        block = {"type": "text", "text": build()}
+        if self.cache_control:
+            block["cache_control"] = {"type": "ephemeral"}
+        blocks = [block]
+        with self._lock:
+            self._prompts[key] = blocks
+            self.builds += 1
+            while len(self._prompts) > self.max_prompts:
+                self._prompts.popitem(last=False)
+        return blocks
+
+
+class PromptCacheUsage:
+    """Token counters of the provider's prompt cache, summed over requests."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=_RECENT_REQUESTS)
+        self.requests = 0
+        self.cache_hits = 0
+        self.cache_write_tokens = 0
+        self.cache_read_tokens = 0
+        self.uncached_input_tokens = 0
+
+    def record(self, stage, message):
+        """Record the usage of one Messages API response."""
+        usage = getattr(message, "usage", None)
+        if usage is None:
+            return
+        written = getattr(usage, "cache_creation_input_tokens", None) or 0
+        read = getattr(usage, "cache_read_input_tokens", None) or 0
+        uncached = getattr(usage, "input_tokens", None) or 0
+        logger.info("{} prompt cache: {} tokens written, {} read, {} uncached input".format(
+            stage, written, read, uncached))
+        with self._lock:
+            self.requests += 1
+            self.cache_hits += read > 0
+            self.cache_write_tokens += written
+            self.cache_read_tokens += read
+            self.uncached_input_tokens += uncached
+            self._recent.append({
+                "stage": stage,
+                "cache_write_tokens": written,
+                "cache_read_tokens": read,
+                "uncached_input_tokens": uncached,
+            })
+
+    def stats(self):
+        with self._lock:
+            input_tokens = self.cache_write_tokens + self.cache_read_tokens + self.uncached_input_tokens
+            return {
+                "requests": self.requests,
+                "cache_hits": self.cache_hits,
+                "cache_write_tokens": self.cache_write_tokens,
+                "cache_read_tokens": self.cache_read_tokens,
+                "uncached_input_tokens": self.uncached_input_tokens,
+                "read_token_rate": self.cache_read_tokens / input_tokens if input_tokens else 0.0,
+                "recent": list(self._recent),
+            }
+
+
+_prompts = None
+_usage = PromptCacheUsage()
+_prompts_lock = threading.Lock()
+
+
+def get_system_prompts():
+    """Process-wide system prompt store configured from PROMPT_CACHE_*."""
+    global _prompts
+    with _prompts_lock:
+        if _prompts is None:
+            _prompts = SystemPrompts(
+                max_prompts=int(os.getenv("PROMPT_CACHE_MAX_PROMPTS", "64")),
+                cache_control=os.getenv("PROMPT_CACHE_ENABLED", "1") != "0",
+            )
+        return _prompts
+
+
+def system_blocks(name, version, build):
+    """Cacheable system prompt blocks for (name, version); see SystemPrompts.get."""
+    return get_system_prompts().get(name, version, build)
+
+
+def record_usage(stage, message):
+    """Log and count the prompt cache usage of a response, and export its token counts."""
+    _usage.record(stage, message)
+    usage = getattr(message, "usage", None)
+    if usage is not None:
+        record_llm_usage(stage, usage)
+
+
+def prompt_cache_stats():
+    stats = _usage.stats()
+    stats["system_prompts_built"] = get_system_prompts().builds
+    return stats
@@ -0,0 +1,149 @@
+"""
+Compact, token-budgeted encoding of query results for model prompts.
+
+Pretty-printed JSON repeats every column name on every row and spends a
+large share of its tokens on whitespace, and a big result can overflow the
+context window. encode_results writes a result as:
+
+    - a one-line summary (row and column counts, how many rows are shown)
+    - one line of statistics per column: type, nulls and distinct values,
+      min/max/mean for numbers, min/max for times, most common values for text
+    - the rows themselves as CSV under one header
+
+The whole result goes in when it fits the token budget. Otherwise the rows
+are a representative sample (see chart_planner.sample_rows), while the
+statistics still describe every row. Tokens are estimated from characters.
+
+Configuration (environment variables):
+    PROMPT_DATA_TOKEN_BUDGET  tokens a result may take in a prompt (default 4000)
+    PROMPT_CHARS_PER_TOKEN    characters per token used for estimates (default 3.5)
+    PROMPT_MAX_CELL_CHARS     longer text values are cut to this length (default 80)
+"""
+import os
+import io
+import csv
+import decimal
+import logging
+from collections import Counter
+from datetime import datetime, date
+
+import numpy as np
+
+from chart_planner import column_kind, sample_rows
+from result_encoding import QueryResult
+
+logger = logging.getLogger(__name__)
+
+PROMPT_DATA_TOKEN_BUDGET = int(os.getenv("PROMPT_DATA_TOKEN_BUDGET", "4000"))
+_CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "3.5"))
+_MAX_CELL_CHARS = int(os.getenv("PROMPT_MAX_CELL_CHARS", "80"))
+
+# Most common values listed for text columns
+_TOP_VALUES = 3
+# Rows whose CSV length is measured to estimate how many rows fit
+_MEASURE_ROWS = 50
+
+_KIND_NAMES = {"number": "number", "ordinal": "integer", "id": "id", "time": "time", "category": "text"}
+
+
+def estimate_tokens(text):
+    """Approximate token count of a piece of text."""
+    return int(len(text) / _CHARS_PER_TOKEN) + 1
+
+
+def format_value(value):
+    """Short text for one value: ISO dates, about 6 significant digits, long text cut."""
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        # Keep large magnitudes out of scientific notation
+        return format(value, ".0f" if abs(value) >= 1e6 else ".6g")
+    if isinstance(value, decimal.Decimal):
+        return format(value.normalize(), "f") if value == value.to_integral() else str(value)
+    text = str(value)
+    if len(text) > _MAX_CELL_CHARS:
+        text = text[:_MAX_CELL_CHARS - 3] + "..."
+    return text
+
+
+def column_stats(name, values):
+    """One line describing a column over all rows."""
+    kind = column_kind(name, values)
+    present = [v for v in values if v is not None]
+    nulls = len(values) - len(present)
+    parts = ["{} ({})".format(name, _KIND_NAMES.get(kind, "other"))]
+    if nulls:
+        parts.append("nulls {}".format(nulls))
+    if not present:
+        return "- {}: all null".format(parts[0])
+
+    hashable = [v if not isinstance(v, (list, dict)) else str(v) for v in present]
+    distinct = len(set(hashable))
+    parts.append("distinct {}".format(distinct))
+    if kind in ("number", "ordinal", "id"):
+        numbers = np.array([float(v) for v in present], dtype=float)
+        parts.append("min {} max {}".format(format_value(numbers.min()), format_value(numbers.max())))
+        if kind == "number":
+            parts.append("mean {}".format(format_value(float(numbers.mean()))))
+    elif kind == "time":
+        parts.append("min {} max {}".format(format_value(min(present)), format_value(max(present))))
+    elif distinct < len(present):
+        common = Counter(hashable).most_common(_TOP_VALUES)
+        parts.append("top " + ", ".join("{} ({})".format(format_value(v), n) for v, n in common))
+    return "- " + parts[0] + ": " + ", ".join(parts[1:])
+
+
+def _csv_text(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    writer.writerows([format_value(row.get(c)) for c in columns] for row in rows)
+    return buffer.getvalue()
+
+
+def encode_results(results, budget=None, max_rows=None):
+    """
+    Prompt text for a list of row dicts within a token budget. max_rows caps
+    the rows shown even when more would fit.
+    """
+    budget = PROMPT_DATA_TOKEN_BUDGET if budget is None else budget
+    if not results:
+        return "The query returned no rows."
+    if isinstance(results, QueryResult):
+        # Build the row dicts once; the statistics below read every column
+        results = results.records()
+    if not isinstance(results, list) or not isinstance(results[0], dict):
+        return str(results)
+    columns = list(results[0].keys())
+
+    stats = "\n".join(column_stats(c, [row.get(c) for row in results]) for c in columns)
+    header_tokens = estimate_tokens(stats) + 30
+
+    # Estimate rows that fit from the CSV length of the first rows
+    measured = _csv_text(columns, results[:_MEASURE_ROWS])
+    per_row = max(1, estimate_tokens(measured) / (min(len(results), _MEASURE_ROWS) + 1))
+    fit = max(1, int((budget - header_tokens) / per_row))
+    if max_rows is not None:
+        fit = min(fit, max_rows)
+
+    rows = results if len(results) <= fit else sample_rows(results, fit)
+    table = _csv_text(columns, rows)
+    # Long rows past the measured ones can still overshoot; drop rows until it fits
+    while len(rows) > 1 and header_tokens + estimate_tokens(table) > budget:
+        rows = [rows[i] for i in np.linspace(0, len(rows) - 1, max(1, int(len(rows) * 0.8))).astype(int)]
+        table = _csv_text(columns, rows)
+
+    if len(rows) == len(results):
+        shown = "all rows shown"
+    else:
+        shown = "{} representative rows shown".format(len(rows))
+    summary = "{} rows x {} columns ({}).".format(len(results), len(columns), shown)
+    text = "{}\nColumns:\n{}\nRows (CSV):\n{}".format(summary, stats, table)
+    logger.info("Encoded {} rows for the prompt in about {} tokens".format(len(results), estimate_tokens(text)))
+    return text
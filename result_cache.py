@@ -0,0 +1,198 @@
+"""
+Cache of SELECT results keyed by canonicalised SQL text.
+
+Entries are bounded by an approximate size in bytes and evicted least
+recently used first. Every entry remembers which tables it read, so a write
+committed through execute_sql evicts exactly the results that touched the
+written tables. Tables that are bulk-loaded from outside the app can be
+given a maximum age instead.
+
+The cache is per process. Writes made by other processes or other gunicorn
+workers are not seen, so stale results live at most RESULT_CACHE_TTL (or the
+table's max age) seconds.
+
+Configuration (environment variables):
+    RESULT_CACHE_ENABLED        set to 0 to disable the cache (default 1)
+    RESULT_CACHE_MAX_BYTES      approximate memory bound (default 67108864, 64 MiB)
+    RESULT_CACHE_TTL            seconds any entry stays valid (default 300)
+    RESULT_CACHE_TABLE_MAX_AGE  per-table max age, e.g. "stock_prices=60,company_financials=3600"
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import sql_utils
+from result_encoding import QueryResult
+
+logger = logging.getLogger(__name__)
+
+
+def _as_query_result(rows):
+    """A QueryResult holding its own copy of the row list."""
+    if isinstance(rows, QueryResult):
+        return QueryResult(rows.columns, list(rows.rows))
+    columns = list(rows[0]) if rows else []
+    return QueryResult(columns, [tuple(row.get(column) for column in columns) for row in rows])
+
+
+def parse_table_max_age(spec):
+    """Parse "table=seconds,table=seconds" into a dict."""
+    ages = {}
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        table, _, seconds = item.partition("=")
+        try:
+            ages[table.strip().lower()] = float(seconds)
+        except ValueError:
+            logger.warning("Ignoring invalid RESULT_CACHE_TABLE_MAX_AGE entry: {}".format(item))
+    return ages
+
+
+class _Entry:
+    __slots__ = ("rows", "size", "tables", "expires_at")
+
+    def __init__(self, rows, size, tables, expires_at):
+        self.rows = rows
+        self.size = size
+        self.tables = tables
+        self.expires_at = expires_at
+
+
+class ResultCache:
+    """Size-bounded LRU of query results with table-level invalidation."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=300, table_max_age=None):
+        self.max_bytes = max_bytes
+        # A single result may not take more than a quarter of the cache
+        self.max_entry_bytes = max_bytes // 4
+        self.ttl = ttl
+        self.table_max_age = table_max_age or {}
+        self._entries = OrderedDict()
+        self._by_table = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(sql, scope=None):
+        """Cache key: the canonical SQL, scoped to a database (e.g. dbname/host/port)."""
+        return (scope, sql_utils.canonicalize(sql))
+
+    @staticmethod
+    def is_cacheable(sql):
+        return sql_utils.is_read_only(sql) and sql_utils.is_deterministic(sql)
+
+    def get(self, sql, scope=None):
+        """Cached QueryResult for the statement, or None."""
+        key = self.key(sql, scope)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            # A new QueryResult over a copy of the row list, so callers cannot change the entry
+            return QueryResult(entry.rows.columns, list(entry.rows.rows))
+
+    def put(self, sql, rows, scope=None):
+        """
+        Cache the rows of a SELECT (a QueryResult, or a list of row dicts),
+        unless the statement is volatile or the result too big.
+        """
+        if not self.is_cacheable(sql):
+            return False
+        rows = _as_query_result(rows)
+        size = rows.estimate_size()
+        if size > self.max_entry_bytes:
+            logger.info("Result of {} bytes is too large to cache.".format(size))
+            return False
+
+        tables = frozenset(sql_utils.referenced_tables(sql))
+        max_age = min([self.ttl] + [self.table_max_age[t] for t in tables if t in self.table_max_age])
+        key = self.key(sql, scope)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(rows, size, tables, time.monotonic() + max_age)
+            self._bytes += size
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+            while self._bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return True
+
+    def invalidate_tables(self, tables):
+        """Evict every result that read one of the tables; None clears the whole cache."""
+        with self._lock:
+            if tables is None:
+                count = len(self._entries)
+                self._entries.clear()
+                self._by_table.clear()
+                self._bytes = 0
+            else:
+                keys = set()
+                for table in tables:
+                    keys |= self._by_table.get(table.lower(), set())
+                for key in keys:
+                    self._remove(key)
+                count = len(keys)
+            self.invalidations += count
+        if count:
+            logger.info("Invalidated {} cached results for tables: {}".format(
+                count, "all" if tables is None else ", ".join(sorted(tables))))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        for table in entry.tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Process-wide result cache configured from RESULT_CACHE_*; None when disabled."""
+    global _cache
+    if os.getenv("RESULT_CACHE_ENABLED", "1") == "0":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(
+                max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+                ttl=float(os.getenv("RESULT_CACHE_TTL", "300")),
+                table_max_age=parse_table_max_age(os.getenv("RESULT_CACHE_TABLE_MAX_AGE", "")),
+            )
+        return _cache
@@ -0,0 +1,352 @@
+"""
+Paging through stored results that are held only as their SQL.
+
+/results/<handle> used to re-run SELECT * FROM (sql) LIMIT n OFFSET m for
+every page of such a result. Each page of a sorted million-row result sorted
+it again, and every later page scanned all the rows before it. A page request
+now declares a SCROLL cursor over the SQL on a pooled connection and keeps it
+open. Later pages are read with MOVE ABSOLUTE and FETCH FORWARD from where the
+query already stands. When the result store does not know the row count, it
+is counted once with MOVE FORWARD ALL.
+
+A held cursor ties up a pool connection inside an open transaction. So only
+RESULT_CURSOR_MAX_OPEN are kept (the least recently used is closed to make
+room), and one unused for RESULT_CURSOR_IDLE_SECONDS is closed.
+
+Configuration (environment variables):
+    RESULT_CURSOR_MAX_OPEN      cursors held open at once, 0 to re-run the SQL per page (default 2)
+    RESULT_CURSOR_IDLE_SECONDS  seconds an unused cursor is kept open (default 60)
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+
+from sql_guard import guard_sql, guard_sql_async
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class HeldCursor:
+    """An open SCROLL cursor over one stored result's SQL, and the connection holding it."""
+    __slots__ = ("handle", "pool", "conn", "transaction", "name", "columns", "row_count", "last_used", "lock")
+
+    def __init__(self, handle, pool, conn, name, columns, row_count, lock, transaction=None):
+        self.handle = handle
+        self.pool = pool
+        self.conn = conn
+        self.transaction = transaction
+        self.name = name
+        self.columns = columns
+        self.row_count = row_count
+        self.last_used = time.monotonic()
+        self.lock = lock
+
+
+def _cursor_name(handle):
+    return "result_page_{}".format(handle)
+
+
+def _declare(name, sql):
+    return "DECLARE {} SCROLL CURSOR FOR {}".format(name, sql)
+
+
+def _moved_rows(status):
+    """Row count of a MOVE command status ("MOVE 1234")."""
+    return int(status.split()[-1])
+
+
+class CursorRegistry:
+    """Held cursors of the Flask apps, on connections checked out of a db_pool.ConnectionPool."""
+
+    def __init__(self, max_open=2, idle_seconds=60.0):
+        self.max_open = max_open
+        self.idle_seconds = idle_seconds
+        self._cursors = OrderedDict()
+        self._lock = threading.Lock()
+        self._reaper = None
+        self.opened = 0
+        self.reused = 0
+        self.closed_idle = 0
+        self.evicted = 0
+
+    def page(self, entry, offset, limit, pool):
+        """(columns, rows, row_count) of rows offset..offset+limit of a stored result's SQL."""
+        self.close_idle()
+        while True:
+            with self._lock:
+                cursor = self._cursors.get(entry.handle)
+                if cursor is not None:
+                    self._cursors.move_to_end(entry.handle)
+                    self.reused += 1
+            if cursor is None:
+                cursor = self._open(entry, pool)
+            with cursor.lock:
+                # Another request may have closed it in the meantime
+                if cursor.conn is not None:
+                    return cursor.columns, self._fetch(cursor, offset, limit), cursor.row_count
+
+    def _fetch(self, cursor, offset, limit):
+        cursor.last_used = time.monotonic()
+        try:
+            with span("db_query"), cursor.conn.cursor() as cur:
+                cur.execute("MOVE ABSOLUTE {} IN {}".format(int(offset), cursor.name))
+                cur.execute("FETCH FORWARD {} FROM {}".format(int(limit), cursor.name))
+                return cur.fetchall()
+        except Exception:
+            # The transaction is aborted; drop the cursor so the next page opens a new one
+            self._forget(cursor)
+            self._release(cursor, discard=True)
+            raise
+
+    def _open(self, entry, pool):
+        conn = pool.getconn()
+        name = _cursor_name(entry.handle)
+        try:
+            # The guard's SET LOCAL statement_timeout then covers every FETCH too.
+            # Pages are fetched a few at a time, so the row limit is not needed.
+            with span("sql_guard"):
+                guarded_query = guard_sql(conn, entry.sql, limit_rows=False)
+            with span("db_query"), conn.cursor() as cur:
+                cur.execute(_declare(name, guarded_query))
+                cur.execute("FETCH FORWARD 0 FROM {}".format(name))
+                columns = [desc[0] for desc in cur.description]
+                row_count = entry.row_count
+                if row_count is None:
+                    cur.execute("MOVE FORWARD ALL IN {}".format(name))
+                    row_count = entry.row_count = cur.rowcount
+        except BaseException:
+            # putconn rolls back the failed transaction
+            pool.putconn(conn, discard=conn.closed)
+            raise
+        logger.info("Holding a cursor over {} rows of result {}".format(row_count, entry.handle))
+        cursor = HeldCursor(entry.handle, pool, conn, name, columns, row_count, threading.Lock())
+
+        with self._lock:
+            self.opened += 1
+            replaced = self._cursors.pop(entry.handle, None)
+            self._cursors[entry.handle] = cursor
+            evicted = [replaced] if replaced is not None else []
+            while len(self._cursors) > self.max_open:
+                evicted.append(self._cursors.popitem(last=False)[1])
+                self.evicted += 1
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap, daemon=True)
+                self._reaper.start()
+        for old in evicted:
+            self._close(old)
+        return cursor
+
+    def _forget(self, cursor):
+        with self._lock:
+            if self._cursors.get(cursor.handle) is cursor:
+                del self._cursors[cursor.handle]
+
+    def _release(self, cursor, discard=False):
+        conn, cursor.conn = cursor.conn, None
+        if conn is not None:
+            # putconn rolls the transaction back, which closes the cursor
+            cursor.pool.putconn(conn, discard=discard or conn.closed)
+
+    def _close(self, cursor):
+        with cursor.lock:
+            self._release(cursor)
+
+    def close_idle(self):
+        """Close cursors unused for idle_seconds."""
+        deadline = time.monotonic() - self.idle_seconds
+        with self._lock:
+            idle = [cursor for cursor in self._cursors.values() if cursor.last_used < deadline]
+            for cursor in idle:
+                del self._cursors[cursor.handle]
+            self.closed_idle += len(idle)
+        for cursor in idle:
+            self._close(cursor)
+
+    def _reap(self):
+        while True:
+            time.sleep(max(1.0, self.idle_seconds / 2))
+            try:
+                self.close_idle()
+            except Exception as e:
+                logger.warning("Failed to close idle result cursors: {}".format(str(e)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "open": len(self._cursors),
+                "max_open": self.max_open,
+                "opened": self.opened,
+                "reused": self.reused,
+                "closed_idle": self.closed_idle,
+                "evicted": self.evicted,
+            }
+
+
+class AsyncCursorRegistry:
+    """Async counterpart of CursorRegistry for an asyncpg pool."""
+
+    def __init__(self, max_open=2, idle_seconds=60.0):
+        self.max_open = max_open
+        self.idle_seconds = idle_seconds
+        self._cursors = OrderedDict()
+        self._reaper = None
+        self.opened = 0
+        self.reused = 0
+        self.closed_idle = 0
+        self.evicted = 0
+
+    async def page(self, entry, offset, limit, pool):
+        """Async counterpart of CursorRegistry.page."""
+        await self.close_idle()
+        while True:
+            cursor = self._cursors.get(entry.handle)
+            if cursor is not None:
+                self._cursors.move_to_end(entry.handle)
+                self.reused += 1
+            else:
+                cursor = await self._open(entry, pool)
+            async with cursor.lock:
+                if cursor.conn is not None:
+                    return cursor.columns, await self._fetch(cursor, offset, limit), cursor.row_count
+
+    async def _fetch(self, cursor, offset, limit):
+        cursor.last_used = time.monotonic()
+        try:
+            with span("db_query"):
+                await cursor.conn.execute("MOVE ABSOLUTE {} IN {}".format(int(offset), cursor.name))
+                return await cursor.conn.fetch("FETCH FORWARD {} FROM {}".format(int(limit), cursor.name))
+        except Exception:
+            if self._cursors.get(cursor.handle) is cursor:
+                del self._cursors[cursor.handle]
+            await self._release(cursor)
+            raise
+
+    async def _open(self, entry, pool):
+        with span("db_checkout"):
+            conn = await pool.acquire(timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")))
+        name = _cursor_name(entry.handle)
+        transaction = conn.transaction(readonly=True)
+        try:
+            await transaction.start()
+            with span("sql_guard"):
+                guarded_query = await guard_sql_async(conn, entry.sql, limit_rows=False)
+            with span("db_query"):
+                statement = await conn.prepare(guarded_query)
+                columns = [attribute.name for attribute in statement.get_attributes()]
+                await conn.execute(_declare(name, guarded_query))
+                row_count = entry.row_count
+                if row_count is None:
+                    row_count = entry.row_count = _moved_rows(await conn.execute("MOVE FORWARD ALL IN {}".format(name)))
+        except BaseException:
+            await _release_connection(pool, conn, transaction)
+            raise
+        logger.info("Holding a cursor over {} rows of result {}".format(row_count, entry.handle))
+        cursor = HeldCursor(entry.handle, pool, conn, name, columns, row_count, asyncio.Lock(), transaction)
+
+        self.opened += 1
+        replaced = self._cursors.pop(entry.handle, None)
+        self._cursors[entry.handle] = cursor
+        evicted = [replaced] if replaced is not None else []
+        while len(self._cursors) > self.max_open:
+            evicted.append(self._cursors.popitem(last=False)[1])
+            self.evicted += 1
+        if self._reaper is None:
+            self._reaper = asyncio.get_running_loop().create_task(self._reap())
+        for old in evicted:
+            await self._close(old)
+        return cursor
+
+    async def _release(self, cursor):
+        conn, cursor.conn = cursor.conn, None
+        if conn is not None:
+            await _release_connection(cursor.pool, conn, cursor.transaction)
+
+    async def _close(self, cursor):
+        async with cursor.lock:
+            await self._release(cursor)
+
+    async def close_idle(self):
+        """Async counterpart of CursorRegistry.close_idle."""
+        deadline = time.monotonic() - self.idle_seconds
+        idle = [cursor for cursor in self._cursors.values() if cursor.last_used < deadline]
+        for cursor in idle:
+            del self._cursors[cursor.handle]
+        self.closed_idle += len(idle)
+        for cursor in idle:
+            await self._close(cursor)
+
+    async def close_all(self):
+        """Close every held cursor, returning its connection (before the pool is closed)."""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        cursors = list(self._cursors.values())
+        self._cursors.clear()
+        for cursor in cursors:
+            await self._close(cursor)
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(max(1.0, self.idle_seconds / 2))
+            try:
+                await self.close_idle()
+            except Exception as e:
+                logger.warning("Failed to close idle result cursors: {}".format(str(e)))
+
+    def stats(self):
+        return {
+            "open": len(self._cursors),
+            "max_open": self.max_open,
+            "opened": self.opened,
+            "reused": self.reused,
+            "closed_idle": self.closed_idle,
+            "evicted": self.evicted,
+        }
+
+
+async def _release_connection(pool, conn, transaction):
+    try:
+        # Rolling back closes the cursor
+        if not conn.is_closed():
+            await transaction.rollback()
+    except Exception as e:
+        logger.warning("Failed to roll back a result cursor: {}".format(str(e)))
+    finally:
+        await pool.release(conn)
+
+
+_registry = None
+_async_registry = None
+_registry_lock = threading.Lock()
+
+
+def _settings():
+    return int(os.getenv("RESULT_CURSOR_MAX_OPEN", "2")), float(os.getenv("RESULT_CURSOR_IDLE_SECONDS", "60"))
+
+
+def get_cursor_registry():
+    """Process-wide registry of held cursors configured from RESULT_CURSOR_*; None when disabled."""
+    global _registry
+    max_open, idle_seconds = _settings()
+    if max_open <= 0:
+        return None
+    with _registry_lock:
+        if _registry is None:
+            _registry = CursorRegistry(max_open=max_open, idle_seconds=idle_seconds)
+        return _registry
+
+
+def get_async_cursor_registry():
+    """Async counterpart of get_cursor_registry, for async_app."""
+    global _async_registry
+    max_open, idle_seconds = _settings()
+    if max_open <= 0:
+        return None
+    with _registry_lock:
+        if _async_registry is None:
+            _async_registry = AsyncCursorRegistry(max_open=max_open, idle_seconds=idle_seconds)
+        return _async_registry
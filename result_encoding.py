@@ -0,0 +1,174 @@
+"""
+Columnar query results and their fast JSON encoding.
+
+execute_sql used to turn every row into a dict (dict(zip(colnames, row)))
+and every date and Decimal was then converted by DateTimeEncoder.default, one
+Python call per value. QueryResult keeps the column names once and the row
+tuples exactly as the driver returned them. Row dicts are only built for the
+rows a consumer actually reads (charts and prompts read a bounded slice).
+
+For the wire, to_columnar() transposes the rows into one typed array per
+column. Each column is converted in bulk (Decimal to float, dates to ISO
+strings where the serializer cannot write them) and the payload is
+serialized by orjson when it is installed, which writes dates, datetimes and
+UUIDs natively. Without orjson the stdlib json module is used.
+
+Columnar payload:
+    {"columns": [...], "column_types": [...], "data": [[column values], ...], "row_count": n}
+column_types are "integer", "number", "boolean", "date", "datetime", "time",
+"json", "string" or "null" (a column with no values).
+"""
+import sys
+import json
+import uuid
+import decimal
+import logging
+from collections.abc import Sequence
+from datetime import datetime, date, time
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+    orjson_available = True
+except ImportError:
+    logger.warning("orjson not found. Results will be serialized with the json module.")
+    orjson_available = False
+
+# Rows sampled to estimate the size of a result
+_SIZE_SAMPLE = 50
+
+
+class QueryResult(Sequence):
+    """
+    Rows of a SELECT as column names plus row tuples. Indexing, slicing and
+    iteration give row dicts, so code written for lists of row dicts keeps
+    working; a slice is a plain list of dicts.
+    """
+    __slots__ = ("columns", "rows")
+
+    def __init__(self, columns, rows):
+        self.columns = list(columns)
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        columns = self.columns
+        if isinstance(index, slice):
+            return [dict(zip(columns, row)) for row in self.rows[index]]
+        return dict(zip(columns, self.rows[index]))
+
+    def __iter__(self):
+        columns = self.columns
+        for row in self.rows:
+            yield dict(zip(columns, row))
+
+    def records(self):
+        """All rows as dicts (the old execute_sql return value)."""
+        return self[:]
+
+    def page(self, offset, limit):
+        """Rows offset..offset+limit as lists in column order."""
+        return [list(row) for row in self.rows[offset:offset + limit]]
+
+    def column_arrays(self):
+        """One list of values per column."""
+        if not self.rows:
+            return [[] for _ in self.columns]
+        return [list(values) for values in zip(*self.rows)]
+
+    def to_columnar(self):
+        """The columnar payload, with every column converted for serialization."""
+        types, data = [], []
+        for values in self.column_arrays():
+            kind, encoded = encode_column(values)
+            types.append(kind)
+            data.append(encoded)
+        return {"columns": self.columns, "column_types": types, "data": data, "row_count": len(self.rows)}
+
+    def estimate_size(self):
+        """Approximate memory footprint in bytes."""
+        if not self.rows:
+            return sys.getsizeof(self.rows)
+        step = max(1, len(self.rows) // _SIZE_SAMPLE)
+        sample = self.rows[::step]
+        per_row = sum(sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row) for row in sample) / len(sample)
+        return int(sys.getsizeof(self.rows) + per_row * len(self.rows))
+
+
+def column_type(values):
+    """Type name of a column from its first non-null value."""
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            return "boolean"
+        if isinstance(value, int):
+            return "integer"
+        if isinstance(value, (float, decimal.Decimal)):
+            return "number"
+        if isinstance(value, datetime):
+            return "datetime"
+        if isinstance(value, date):
+            return "date"
+        if isinstance(value, time):
+            return "time"
+        if isinstance(value, (dict, list)):
+            return "json"
+        return "string"
+    return "null"
+
+
+def _convert(values, convert):
+    if None in values:
+        return [None if value is None else convert(value) for value in values]
+    return list(map(convert, values))
+
+
+def _to_number(value):
+    return float(value) if isinstance(value, decimal.Decimal) else value
+
+
+def encode_column(values):
+    """(type name, values ready for the serializer) for one column."""
+    kind = column_type(values)
+    if kind == "number":
+        if any(isinstance(value, decimal.Decimal) for value in values):
+            return kind, _convert(values, _to_number)
+        return kind, values
+    if kind in ("date", "datetime", "time"):
+        # orjson writes these natively in the same ISO format
+        return kind, values if orjson_available else _convert(values, lambda value: value.isoformat())
+    if kind == "string" and not all(value is None or isinstance(value, str) for value in values):
+        return kind, _convert(values, str)
+    return kind, values
+
+
+def encode_rows(columns, rows):
+    """Row tuples with their values converted like to_columnar, for row-oriented output."""
+    data = QueryResult(columns, rows).to_columnar()["data"]
+    return [list(row) for row in zip(*data)] if rows else []
+
+
+def _default(obj):
+    """Serializer fallback for values that were not converted column-wise."""
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, QueryResult):
+        return obj.records()
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, (memoryview, bytes)):
+        return bytes(obj).hex()
+    raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
+
+
+def dumps(obj):
+    """JSON bytes for obj; Decimal becomes a float and dates ISO strings."""
+    if orjson_available:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default).encode("utf-8")
@@ -0,0 +1,226 @@
+"""
+Streaming export of query results as CSV, Arrow IPC or Parquet.
+
+GET /export/<handle>.<format> writes a stored result batch by batch. The
+batches come from the rows held by the result store, or from a server-side
+cursor when only the SQL was kept, so an export never holds more than one
+batch of rows plus the writer's buffer:
+
+- csv      text/csv, optionally gzip-compressed
+- arrow    Arrow IPC file format (Feather v2; pandas.read_feather,
+           pyarrow.ipc.open_file), optionally lz4 or zstd compressed
+- parquet  one row group per batch, snappy-compressed unless told otherwise
+
+The Arrow schema is taken from the first batch that has rows: integers
+become int64, numbers (including Decimal) float64, dates, times and
+timestamps keep their type, and everything else is a string (JSON for json
+columns). A column with no values in that batch is a string column.
+
+pyarrow is optional; without it only CSV is offered.
+
+Configuration (environment variables):
+    EXPORT_BATCH_ROWS  rows per batch read from the cursor, and per Parquet row group (default 50000)
+"""
+import io
+import os
+import csv
+import zlib
+import logging
+import decimal
+
+from result_encoding import column_type, dumps
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    pyarrow_available = True
+except ImportError:
+    logger.warning("pyarrow not found. Results can only be exported as CSV.")
+    pyarrow_available = False
+
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "50000"))
+
+# format -> (mimetype, file extension, accepted compressions; the first is the default)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv", ("none", "gzip")),
+    "arrow": ("application/vnd.apache.arrow.file", "arrow", ("none", "lz4", "zstd")),
+    "parquet": ("application/vnd.apache.parquet", "parquet", ("snappy", "none", "gzip", "zstd", "lz4", "brotli")),
+}
+
+
+class ExportError(ValueError):
+    """An export that cannot be produced (unknown format or compression, missing pyarrow)."""
+
+
+def export_options(export_format, compression=None):
+    """
+    (mimetype, filename suffix, compression) for a format and requested
+    compression; raises ExportError when either is not supported.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ExportError("Unknown export format '{}'. Use one of: {}.".format(
+            export_format, ", ".join(EXPORT_FORMATS)))
+    if export_format != "csv" and not pyarrow_available:
+        raise ExportError("Exporting as {} requires pyarrow, which is not installed.".format(export_format))
+    mimetype, extension, compressions = EXPORT_FORMATS[export_format]
+    compression = (compression or compressions[0]).lower()
+    if compression not in compressions:
+        raise ExportError("Compression '{}' is not supported for {}. Use one of: {}.".format(
+            compression, export_format, ", ".join(compressions)))
+    if export_format == "csv" and compression == "gzip":
+        return "application/gzip", "csv.gz", compression
+    return mimetype, extension, compression
+
+
+class _Sink:
+    """Writable file object whose contents are taken after every batch."""
+
+    def __init__(self):
+        self._chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class ResultWriter:
+    """
+    Incremental encoder of one export: write(rows) returns the bytes for a
+    batch of row sequences, close() the bytes that end the file. Usable from
+    sync and async generators alike.
+    """
+
+    def __init__(self, columns, export_format, compression=None):
+        self.columns = list(columns)
+        self.export_format = export_format
+        self.mimetype, self.extension, self.compression = export_options(export_format, compression)
+        self.row_count = 0
+        self._sink = _Sink()
+        self._writer = None
+        self._types = None
+        if export_format == "csv":
+            self._text = io.StringIO()
+            self._csv = csv.writer(self._text)
+            self._gzip = zlib.compressobj(wbits=31) if self.compression == "gzip" else None
+
+    def header(self):
+        """Bytes that can be sent before the first batch."""
+        if self.export_format != "csv":
+            # The Arrow and Parquet headers need the schema, known from the first rows
+            return b""
+        self._csv.writerow(self.columns)
+        return self._take_csv()
+
+    def write(self, rows):
+        if not rows:
+            return b""
+        self.row_count += len(rows)
+        if self.export_format == "csv":
+            self._csv.writerows(rows)
+            return self._take_csv()
+        if self._writer is None:
+            self._open([list(values) for values in zip(*rows)])
+        self._write_batch(rows)
+        return self._sink.take()
+
+    def close(self):
+        logger.info("Exported {} rows as {} ({}).".format(self.row_count, self.export_format, self.compression))
+        if self.export_format == "csv":
+            return self._gzip.flush() if self._gzip is not None else b""
+        if self._writer is None:
+            self._open([[] for _ in self.columns])
+        self._writer.close()
+        return self._sink.take()
+
+    def _take_csv(self):
+        data = self._text.getvalue().encode("utf-8")
+        self._text.seek(0)
+        self._text.truncate()
+        return self._gzip.compress(data) if self._gzip is not None else data
+
+    def _open(self, column_values):
+        self._types = [_arrow_type(values) for values in column_values]
+        schema = pa.schema([pa.field(name, arrow_type) for name, arrow_type in zip(self.columns, self._types)])
+        compression = None if self.compression == "none" else self.compression
+        if self.export_format == "arrow":
+            options = pa.ipc.IpcWriteOptions(compression=compression)
+            self._writer = pa.ipc.new_file(self._sink, schema, options=options)
+        else:
+            self._writer = pq.ParquetWriter(self._sink, schema, compression=compression or "none")
+
+    def _write_batch(self, rows):
+        arrays = [pa.array(_arrow_values(values, arrow_type), type=arrow_type)
+                  for values, arrow_type in zip(zip(*rows), self._types)]
+        batch = pa.RecordBatch.from_arrays(arrays, names=self.columns)
+        if self.export_format == "arrow":
+            self._writer.write_batch(batch)
+        else:
+            self._writer.write_table(pa.Table.from_batches([batch]))
+
+
+def _arrow_type(values):
+    """Arrow type of a column from the values of its first batch."""
+    kind = column_type(values)
+    if kind == "boolean":
+        return pa.bool_()
+    if kind == "integer":
+        return pa.int64()
+    if kind == "number":
+        return pa.float64()
+    if kind == "date":
+        return pa.date32()
+    if kind == "time":
+        return pa.time64("us")
+    if kind == "datetime":
+        first = next(value for value in values if value is not None)
+        return pa.timestamp("us", tz="UTC" if first.tzinfo is not None else None)
+    return pa.string()
+
+
+def _arrow_values(values, arrow_type):
+    """Column values converted to what pa.array expects for arrow_type."""
+    if pa.types.is_floating(arrow_type):
+        return [float(value) if isinstance(value, decimal.Decimal) else value for value in values]
+    if pa.types.is_string(arrow_type):
+        return [value if value is None or isinstance(value, str) else _to_text(value) for value in values]
+    return values
+
+
+def _to_text(value):
+    if isinstance(value, (dict, list)):
+        return dumps(value).decode("utf-8")
+    return str(value)
+
+
+def export_chunks(writer, row_batches):
+    """Bytes of a whole export, one chunk per batch (empty chunks are skipped)."""
+    chunk = writer.header()
+    if chunk:
+        yield chunk
+    for rows in row_batches:
+        chunk = writer.write(rows)
+        if chunk:
+            yield chunk
+    chunk = writer.close()
+    if chunk:
+        yield chunk
+
+
+def stored_batches(entry, batch_size=EXPORT_BATCH_ROWS):
+    """Row batches of a result held in the result store."""
+    for start in range(0, len(entry.rows), batch_size):
+        yield entry.page(start, batch_size)
@@ -0,0 +1,153 @@
+"""
+Short-lived server-side store of query results, addressed by opaque handles.
+
+/query hands the client a result_handle instead of relying on it to upload
+the rows again. /generate-visualization, /analyze, /results/<handle> (paging)
+and /export/<handle>.<format> then read the rows from here. Results too large to
+keep (more than a quarter of the store) are kept as their SQL only. Endpoints
+re-run that SQL (usually a result cache hit) or stream it when they need rows.
+
+Handles are per process: with several gunicorn workers a handle only
+resolves on the worker that issued it, and clients should fall back to
+sending the rows.
+
+Configuration (environment variables):
+    RESULT_STORE_MAX_BYTES    approximate memory bound (default 134217728, 128 MiB)
+    RESULT_STORE_MAX_ENTRIES  maximum number of handles (default 1000)
+    RESULT_STORE_TTL          seconds a handle stays valid after it is issued (default 900)
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+
+import sql_utils
+
+logger = logging.getLogger(__name__)
+
+
+class StoredResult:
+    """A stored query result; rows is None when only the SQL was kept."""
+    __slots__ = ("handle", "sql", "question", "columns", "rows", "row_count", "size", "expires_at")
+
+    def __init__(self, handle, sql, question, columns, rows, row_count, size, expires_at):
+        self.handle = handle
+        self.sql = sql
+        self.question = question
+        self.columns = columns
+        self.rows = rows
+        self.row_count = row_count
+        self.size = size
+        self.expires_at = expires_at
+
+    def page(self, offset, limit):
+        """Rows offset..offset+limit as lists in column order (rows must be held)."""
+        return self.rows.page(offset, limit)
+
+
+class ResultStore:
+    """LRU of query results bounded by approximate bytes and entry count, with a TTL."""
+
+    def __init__(self, max_bytes=128 * 1024 * 1024, max_entries=1000, ttl=900):
+        self.max_bytes = max_bytes
+        # A single result may not take more than a quarter of the store
+        self.max_entry_bytes = max_bytes // 4
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def put(self, sql, columns, rows=None, row_count=None, question=None):
+        """
+        Store a result and return its handle. rows are a QueryResult as
+        returned by execute_sql; pass None to keep only the SQL.
+        """
+        if row_count is None and rows is not None:
+            row_count = len(rows)
+        size = rows.estimate_size() if rows is not None else 0
+        if size > self.max_entry_bytes:
+            logger.info("Result of {} bytes is too large to hold; keeping its SQL only.".format(size))
+            rows, size = None, 0
+
+        handle = uuid.uuid4().hex
+        entry = StoredResult(handle, sql, question, list(columns), rows, row_count, size, time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[handle] = entry
+            self._bytes += size
+            while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return handle
+
+    def get(self, handle):
+        """The StoredResult for a handle, or None if it is unknown or expired."""
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is not None and entry.expires_at < time.monotonic():
+                self._remove(handle)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(handle)
+            self.hits += 1
+            return entry
+
+    def _remove(self, handle):
+        entry = self._entries.pop(handle, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def paged_sql(sql, offset, limit, stable=True):
+    """
+    Wrap a SELECT so the database returns a single page of it. Every page
+    re-runs the query, and without an ORDER BY Postgres may return the rows in
+    a different order each time, so pages could repeat or skip rows. With
+    stable set, a query that does not order its rows is ordered by the whole
+    row. A query with its own ORDER BY keeps that order, though rows that tie
+    on it may still move between pages. Only held cursors (result_cursors)
+    page through one execution and are fully stable.
+    """
+    # The canonical form has comments and trailing semicolons removed, so it nests safely
+    statement = sql_utils.canonicalize(sql)
+    order = ""
+    if stable and not sql_utils.has_top_level_order_by(statement):
+        # Row-to-text comparison works for every column type, json included
+        order = " ORDER BY result_page::text"
+    return "SELECT * FROM ({}) AS result_page{} LIMIT {} OFFSET {}".format(
+        statement, order, int(limit), int(offset))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_result_store():
+    """Process-wide result store configured from RESULT_STORE_*."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ResultStore(
+                max_bytes=int(os.getenv("RESULT_STORE_MAX_BYTES", str(128 * 1024 * 1024))),
+                max_entries=int(os.getenv("RESULT_STORE_MAX_ENTRIES", "1000")),
+                ttl=float(os.getenv("RESULT_STORE_TTL", "900")),
+            )
+        return _store
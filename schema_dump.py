@@ -1,137 +1,192 @@
-import psycopg2
+import os
 import json
+import argparse
+from db_pool import get_pool
 
-def execute_sql(query, dbname="chatbot_semantic_db", user="cooperpenniman", 
+def execute_sql(query, params=None, dbname="chatbot_semantic_db", user="cooperpenniman", 
                 password="", host="localhost", port="5432"):
-    """Executes a SQL query and returns the results"""
-    conn = psycopg2.connect(
-        dbname=dbname,
-        user=user,
-        password=password,
-        host=host,
-        port=port
-    )
-    
-    cur = conn.cursor()
-    cur.execute(query)
-    
-    if query.strip().lower().startswith("select"):
-        columns = [desc[0] for desc in cur.description]
-        results = [dict(zip(columns, row)) for row in cur.fetchall()]
-    else:
-        results = []
-    
-    cur.close()
-    conn.close()
+    """Executes a SQL query on a pooled connection and returns the results"""
+    pool = get_pool(dbname=dbname, user=user, password=password, host=host, port=port)
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+
+            if query.strip().lower().startswith("select"):
+                columns = [desc[0] for desc in cur.description]
+                results = [dict(zip(columns, row)) for row in cur.fetchall()]
+            else:
+                results = []
+
     return results
 
-def get_schema():
-    """Gets complete database schema information"""
-    schema = {}
-    
-    # Get tables
-    tables_query = """
-    SELECT table_name 
-    FROM information_schema.tables 
-    WHERE table_schema = 'public' 
-    AND table_type = 'BASE TABLE'
-    AND table_name NOT IN ('table_metadata', 'column_metadata')
-    ORDER BY table_name;
+def get_table_fingerprints():
     """
-    
-    tables = execute_sql(tables_query)
-    
-    for table in tables:
-        table_name = table['table_name']
-        schema[table_name] = {
-            'description': '',
-            'columns': []
-        }
-        
-        # Get columns
-        columns_query = f"""
-        SELECT 
-            column_name, 
-            data_type,
-            is_nullable
-        FROM information_schema.columns
-        WHERE table_schema = 'public'
-        AND table_name = '{table_name}'
-        ORDER BY ordinal_position;
-        """
-        
-        columns = execute_sql(columns_query)
-        
-        # Get primary keys
-        pk_query = f"""
-        SELECT kc.column_name
-        FROM information_schema.table_constraints tc
-        JOIN information_schema.key_column_usage kc
-        ON kc.constraint_name = tc.constraint_name
-        WHERE tc.constraint_type = 'PRIMARY KEY'
-        AND kc.table_name = '{table_name}'
-        """
-        
-        pk_results = execute_sql(pk_query)
-        primary_keys = [pk['column_name'] for pk in pk_results]
-        
-        # Get foreign keys
-        fk_query = f"""
-        SELECT
-            kcu.column_name,
-            ccu.table_name AS foreign_table_name,
-            ccu.column_name AS foreign_column_name
-        FROM information_schema.table_constraints tc
-        JOIN information_schema.key_column_usage kcu
-        ON tc.constraint_name = kcu.constraint_name
-        JOIN information_schema.constraint_column_usage ccu
-        ON tc.constraint_name = ccu.constraint_name
-        WHERE tc.constraint_type = 'FOREIGN KEY'
-        AND kcu.table_name = '{table_name}';
-        """
-        
-        fk_results = execute_sql(fk_query)
-        foreign_keys = {fk['column_name']: {'referenced_table': fk['foreign_table_name'], 
-                                          'referenced_column': fk['foreign_column_name']} 
-                      for fk in fk_results}
-        
-        # Get table description from metadata
-        table_desc_query = f"""
-        SELECT table_description 
-        FROM table_metadata 
-        WHERE table_name = '{table_name}';
-        """
-        table_desc_result = execute_sql(table_desc_query)
-        
-        if table_desc_result:
-            schema[table_name]['description'] = table_desc_result[0]['table_description']
-        
-        # Process each column
-        for column in columns:
-            column_name = column['column_name']
-            
-            # Get column description
-            col_desc_query = f"""
-            SELECT column_description 
-            FROM column_metadata 
-            WHERE table_name = '{table_name}' 
-            AND column_name = '{column_name}';
-            """
-            col_desc_result = execute_sql(col_desc_query)
-            
-            column_info = {
-                'name': column_name,
-                'type': column['data_type'],
-                'nullable': column['is_nullable'],
-                'is_primary_key': column_name in primary_keys,
-                'foreign_key': foreign_keys.get(column_name),
-                'description': col_desc_result[0]['column_description'] if col_desc_result else ''
-            }
-            
-            schema[table_name]['columns'].append(column_info)
+    Returns {table_name: fingerprint} for every public table in one query.
+    The fingerprint changes whenever a table's columns, keys or metadata
+    descriptions change, so incremental dumps can skip unchanged tables.
+    """
+    fingerprint_query = """
+    SELECT
+        c.relname AS table_name,
+        md5(concat_ws('|',
+            (SELECT string_agg(a.attname || ':' || format_type(a.atttypid, a.atttypmod) || ':' || a.attnotnull,
+                               ',' ORDER BY a.attnum)
+             FROM pg_attribute a
+             WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped),
+            (SELECT string_agg(pg_get_constraintdef(con.oid), ',' ORDER BY con.conname)
+             FROM pg_constraint con
+             WHERE con.conrelid = c.oid AND con.contype IN ('p', 'f')),
+            (SELECT string_agg(tm.table_description, ',' ORDER BY tm.id)
+             FROM table_metadata tm
+             WHERE tm.table_name = c.relname),
+            (SELECT string_agg(cm.column_name || ':' || coalesce(cm.column_description, ''), ',' ORDER BY cm.id)
+             FROM column_metadata cm
+             WHERE cm.table_name = c.relname)
+        )) AS fingerprint
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'public'
+    AND c.relkind IN ('r', 'p')
+    AND c.relname NOT IN ('table_metadata', 'column_metadata')
+    ORDER BY c.relname;
+    """
+    return {row['table_name']: row['fingerprint'] for row in execute_sql(fingerprint_query)}
+
+def get_schema(tables=None):
+    """
+    Gets complete database schema information.
+    All tables (or only the given ones) are introspected with a fixed number
+    of set-based catalog queries and assembled in memory.
+    """
+    if tables is None:
+        tables = list(get_table_fingerprints())
+    tables = sorted(tables)
+    schema = {table_name: {'description': '', 'columns': []} for table_name in tables}
+    if not tables:
+        return schema
+    params = {'tables': tables}
+
+    # Columns of all tables
+    columns_query = """
+    SELECT 
+        table_name,
+        column_name, 
+        data_type,
+        is_nullable
+    FROM information_schema.columns
+    WHERE table_schema = 'public'
+    AND table_name = ANY(%(tables)s)
+    ORDER BY table_name, ordinal_position;
+    """
+    columns = execute_sql(columns_query, params)
+
+    # Primary and foreign key columns of all tables
+    keys_query = """
+    SELECT
+        rel.relname AS table_name,
+        con.contype AS constraint_type,
+        att.attname AS column_name,
+        frel.relname AS foreign_table_name,
+        fatt.attname AS foreign_column_name
+    FROM pg_constraint con
+    JOIN pg_class rel ON rel.oid = con.conrelid
+    JOIN pg_namespace n ON n.oid = rel.relnamespace
+    CROSS JOIN LATERAL unnest(con.conkey, con.confkey) AS k(attnum, foreign_attnum)
+    JOIN pg_attribute att ON att.attrelid = con.conrelid AND att.attnum = k.attnum
+    LEFT JOIN pg_class frel ON frel.oid = con.confrelid
+    LEFT JOIN pg_attribute fatt ON fatt.attrelid = con.confrelid AND fatt.attnum = k.foreign_attnum
+    WHERE n.nspname = 'public'
+    AND con.contype IN ('p', 'f')
+    AND rel.relname = ANY(%(tables)s);
+    """
+    primary_keys = set()
+    foreign_keys = {}
+    for key in execute_sql(keys_query, params):
+        column = (key['table_name'], key['column_name'])
+        if key['constraint_type'] == 'p':
+            primary_keys.add(column)
+        else:
+            foreign_keys[column] = {'referenced_table': key['foreign_table_name'],
+                                    'referenced_column': key['foreign_column_name']}
+
+    # Table and column descriptions from metadata
+    table_desc_query = """
+    SELECT table_name, table_description 
+    FROM table_metadata 
+    WHERE table_name = ANY(%(tables)s)
+    ORDER BY id;
+    """
+    for row in execute_sql(table_desc_query, params):
+        if row['table_description'] and not schema[row['table_name']]['description']:
+            schema[row['table_name']]['description'] = row['table_description']
+
+    col_desc_query = """
+    SELECT table_name, column_name, column_description 
+    FROM column_metadata 
+    WHERE table_name = ANY(%(tables)s)
+    ORDER BY id;
+    """
+    column_descriptions = {}
+    for row in execute_sql(col_desc_query, params):
+        column_descriptions.setdefault((row['table_name'], row['column_name']), row['column_description'])
+
+    # Assemble each column
+    for column in columns:
+        key = (column['table_name'], column['column_name'])
+        schema[column['table_name']]['columns'].append({
+            'name': column['column_name'],
+            'type': column['data_type'],
+            'nullable': column['is_nullable'],
+            'is_primary_key': key in primary_keys,
+            'foreign_key': foreign_keys.get(key),
+            'description': column_descriptions.get(key) or ''
+        })
     
     return schema
 
+def dump_schema(incremental=False, prompt_path='schema_prompt.txt', raw_path='schema_raw.json',
+                state_path='schema_state.json'):
+    """
+    Writes the prompt text and raw JSON schema. In incremental mode only tables
+    whose fingerprint changed since the last dump are re-introspected; the rest
+    are reused from the previous raw schema.
+    """
+    fingerprints = get_table_fingerprints()
+
+    previous_schema, previous_fingerprints = {}, {}
+    if incremental and os.path.exists(raw_path) and os.path.exists(state_path):
+        with open(raw_path) as f:
+            previous_schema = json.load(f)
+        with open(state_path) as f:
+            previous_fingerprints = json.load(f)
+
+    changed = [t for t, fp in fingerprints.items()
+               if previous_fingerprints.get(t) != fp or t not in previous_schema]
+    removed = [t for t in previous_schema if t not in fingerprints]
+
+    if incremental and previous_schema and not changed and not removed:
+        print("Schema unchanged since last dump; nothing to do.")
+        return previous_schema
+
+    print(f"Introspecting {len(changed)} of {len(fingerprints)} tables"
+          + (f" ({len(removed)} removed)" if removed else ""))
+    fresh = get_schema(changed)
+    schema = {t: fresh[t] if t in fresh else previous_schema[t] for t in sorted(fingerprints)}
+
+    with open(prompt_path, 'w') as f:
+        f.write(schema_to_prompt_format(schema))
+    print(f"Schema written to {prompt_path}")
+
+    # Also save raw schema as JSON for future use
+    with open(raw_path, 'w') as f:
+        json.dump(schema, f, indent=2)
+    print(f"Raw schema data written to {raw_path}")
+
+    with open(state_path, 'w') as f:
+        json.dump(fingerprints, f, indent=2)
+
+    return schema
+
 def schema_to_prompt_format(schema):
     """Convert schema dict to a text format for Claude prompt"""
     lines = []
@@ -166,16 +221,9 @@ def schema_to_prompt_format(schema):
     return "\n".join(lines)
 
 if __name__ == "__main__":
-    schema = get_schema()
-    prompt_text = schema_to_prompt_format(schema)
-    
-    with open('schema_prompt.txt', 'w') as f:
-        f.write(prompt_text)
-    
-    print(f"Schema written to schema_prompt.txt")
-    
-    # Also save raw schema as JSON for future use
-    with open('schema_raw.json', 'w') as f:
-        json.dump(schema, f, indent=2)
-    
-    print(f"Raw schema data written to schema_raw.json") 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Dump the database schema for the SQL prompt')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only re-introspect tables whose definitions changed since the last dump')
+    args = parser.parse_args()
+
+    dump_schema(incremental=args.incremental)
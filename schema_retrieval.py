@@ -0,0 +1,256 @@
+"""
+Relevance-ranked schema pruning for the SQL generation prompt.
+
+Instead of pasting every table into the system prompt, the question is
+embedded and tables/columns are ranked by similarity to their names and
+descriptions (plus a bonus when the question mentions them by name). The
+top-k tables are kept, tables needed to join them along foreign keys are
+added back, and only the best-matching columns of each table are sent
+(keys are always kept so joins remain possible).
+
+Similarities come either from embedding the schema locally (default) or from
+the pgvector embedding columns of table_metadata/column_metadata, which
+embed_metadata.py fills in.
+
+Configuration (environment variables):
+    SCHEMA_RETRIEVAL             "auto" (default: on when the schema has more than
+                                 SCHEMA_RETRIEVAL_MIN_TABLES tables), "on" or "off"
+    SCHEMA_RETRIEVAL_MIN_TABLES  table count above which "auto" turns retrieval on (default 8)
+    SCHEMA_RETRIEVAL_SOURCE      "local" (default) or "pgvector"
+    SCHEMA_RAW_PATH              raw schema written by schema_dump.py (default schema_raw.json)
+    SCHEMA_TOP_K_TABLES          tables kept before FK closure (default 4)
+    SCHEMA_TOP_K_COLUMNS         non-key columns kept per table (default 12)
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import deque
+
+from embeddings import get_embedder, stem, tokenize, STOPWORDS
+from schema_dump import schema_to_prompt_format
+
+logger = logging.getLogger(__name__)
+
+# Added to the cosine similarity when the question names a table or column
+_NAME_BONUS = 0.3
+
+# Longest FK path (in joins) used to connect two selected tables
+_MAX_JOIN_PATH = 3
+
+
+def _name_overlap(question_terms, name):
+    """Fraction of a (snake_case) name's words that appear in the question."""
+    words = [stem(w) for w in tokenize(name) if w not in STOPWORDS]
+    if not words:
+        return 0.0
+    return sum(w in question_terms for w in words) / len(words)
+
+
+def table_text(table, description):
+    """Text embedded for a table, shared with embed_metadata.py so both sides compare alike."""
+    return "{} {}".format(table.replace("_", " "), description or "")
+
+
+def column_text(table, column, description):
+    """Text embedded for a column."""
+    return "{} {} {}".format(column.replace("_", " "), table.replace("_", " "), description or "")
+
+
+def vector_literal(vector):
+    return "[" + ",".join("{:.6f}".format(x) for x in vector) + "]"
+
+
+class SchemaIndex:
+    """Embedded view of a schema dict (as produced by schema_dump.get_schema)."""
+
+    def __init__(self, schema, embedder=None):
+        self.schema = schema
+        self.embedder = embedder or get_embedder()
+        self.version = hashlib.sha256(json.dumps(schema, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+        self.tables = list(schema)
+        self.columns = [(t, c['name']) for t in self.tables for c in schema[t]['columns']]
+
+        # FK graph (undirected) for join closure
+        self.neighbors = {t: set() for t in self.tables}
+        for table in self.tables:
+            for col in schema[table]['columns']:
+                fk = col.get('foreign_key')
+                if fk and fk['referenced_table'] in self.neighbors and fk['referenced_table'] != table:
+                    self.neighbors[table].add(fk['referenced_table'])
+                    self.neighbors[fk['referenced_table']].add(table)
+
+        table_texts = [table_text(t, schema[t].get('description')) for t in self.tables]
+        column_texts = [column_text(t, c, self._column(t, c).get('description')) for t, c in self.columns]
+        self.table_vectors = self.embedder.embed_batch(table_texts)
+        self.column_vectors = self.embedder.embed_batch(column_texts)
+
+    def _column(self, table, column):
+        return next(c for c in self.schema[table]['columns'] if c['name'] == column)
+
+    def scores(self, question, vector=None, db_scores=None):
+        """
+        Relevance scores ({table: score}, {(table, column): score}) for a question.
+        db_scores, if given, replaces the local similarities with pgvector ones.
+        """
+        if vector is None:
+            vector = self.embedder.embed(question)
+        terms = {stem(w) for w in tokenize(question) if w not in STOPWORDS}
+
+        if db_scores is not None:
+            table_sims, column_sims = db_scores
+        else:
+            table_sims = dict(zip(self.tables, (self.table_vectors @ vector).tolist()))
+            column_sims = dict(zip(self.columns, (self.column_vectors @ vector).tolist()))
+
+        column_scores = {
+            (t, c): column_sims.get((t, c), 0.0) + _NAME_BONUS * _name_overlap(terms, c)
+            for t, c in self.columns}
+        table_scores = {}
+        for table in self.tables:
+            best_column = max((column_scores[(table, c['name'])] for c in self.schema[table]['columns']),
+                              default=0.0)
+            table_scores[table] = (max(table_sims.get(table, 0.0), best_column)
+                                   + _NAME_BONUS * _name_overlap(terms, table))
+        return table_scores, column_scores
+
+    def _join_closure(self, selected):
+        """Add tables on short FK paths between the selected tables."""
+        result = list(selected)
+        for i, start in enumerate(selected):
+            for goal in selected[i + 1:]:
+                # BFS for the shortest FK path from start to goal
+                previous = {start: None}
+                queue = deque([start])
+                while queue and goal not in previous:
+                    node = queue.popleft()
+                    for neighbor in self.neighbors[node]:
+                        if neighbor not in previous:
+                            previous[neighbor] = node
+                            queue.append(neighbor)
+                if goal not in previous:
+                    continue
+                path = []
+                node = previous[goal]
+                while node is not None and node != start:
+                    path.append(node)
+                    node = previous[node]
+                if len(path) + 1 <= _MAX_JOIN_PATH:
+                    result.extend(t for t in path if t not in result)
+        # Tables the selection references directly, so lookups like company names stay possible
+        for table in list(result):
+            for col in self.schema[table]['columns']:
+                fk = col.get('foreign_key')
+                if fk and fk['referenced_table'] in self.schema and fk['referenced_table'] not in result:
+                    result.append(fk['referenced_table'])
+        return result
+
+    def select(self, question, top_k_tables=4, top_k_columns=12, vector=None, db_scores=None):
+        """Return a pruned schema dict holding only the tables and columns relevant to the question."""
+        table_scores, column_scores = self.scores(question, vector, db_scores)
+        ranked = sorted(self.tables, key=lambda t: table_scores[t], reverse=True)
+        selected = self._join_closure(ranked[:top_k_tables])
+
+        pruned = {}
+        for table in sorted(selected, key=self.tables.index):
+            columns = self.schema[table]['columns']
+            if len(columns) > top_k_columns:
+                ranked_columns = sorted(
+                    (c['name'] for c in columns if not (c['is_primary_key'] or c['foreign_key'])),
+                    key=lambda name: column_scores[(table, name)], reverse=True)
+                keep = set(ranked_columns[:top_k_columns])
+                columns = [c for c in columns if c['is_primary_key'] or c['foreign_key'] or c['name'] in keep]
+            pruned[table] = dict(self.schema[table], columns=columns)
+        return pruned
+
+
+def pgvector_scores(vector, conn, model, column_limit=200):
+    """
+    Similarities from the pgvector embedding columns of table_metadata and
+    column_metadata, as filled by embed_metadata.py with the given embedding
+    model. Returns ({table: sim}, {(table, column): sim}).
+    """
+    literal = vector_literal(vector)
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT table_name, 1 - (embedding <=> %(v)s::vector) AS similarity
+            FROM table_metadata
+            WHERE embedding IS NOT NULL AND embedding_model = %(model)s
+        """, {'v': literal, 'model': model})
+        table_sims = {}
+        for table, sim in cur.fetchall():
+            table_sims[table] = max(sim, table_sims.get(table, -1.0))
+        cur.execute("""
+            SELECT table_name, column_name, 1 - (embedding <=> %(v)s::vector) AS similarity
+            FROM column_metadata
+            WHERE embedding IS NOT NULL AND embedding_model = %(model)s
+            ORDER BY embedding <=> %(v)s::vector
+            LIMIT %(limit)s
+        """, {'v': literal, 'model': model, 'limit': column_limit})
+        column_sims = {(t, c): sim for t, c, sim in cur.fetchall()}
+    return table_sims, column_sims
+
+
+_schema = None
+_index = None
+_index_mtime = None
+_index_lock = threading.Lock()
+
+
+def get_schema_index():
+    """
+    SchemaIndex over the raw schema dumped by schema_dump.py, or None when
+    retrieval is off or no dump exists. Reloaded when the dump file changes.
+    In auto mode a schema with too few tables is never embedded.
+    """
+    global _schema, _index, _index_mtime
+    mode = os.getenv("SCHEMA_RETRIEVAL", "auto")
+    path = os.getenv("SCHEMA_RAW_PATH", "schema_raw.json")
+    if mode == "off" or not os.path.exists(path):
+        return None
+
+    with _index_lock:
+        mtime = os.path.getmtime(path)
+        if _schema is None or mtime != _index_mtime:
+            with open(path) as f:
+                _schema = json.load(f)
+            _index = None
+            _index_mtime = mtime
+        if mode == "auto" and len(_schema) <= int(os.getenv("SCHEMA_RETRIEVAL_MIN_TABLES", "8")):
+            return None
+        if _index is None:
+            _index = SchemaIndex(_schema)
+            logger.info("Loaded schema index with {} tables from {}".format(len(_schema), path))
+        return _index
+
+
+def retrieve_schema(question, index=None, conn=None):
+    """
+    Prompt text for the tables and columns relevant to the question.
+    conn is a database connection, needed only for the pgvector source.
+    """
+    index = index or get_schema_index()
+    if index is None:
+        return None
+
+    vector = index.embedder.embed(question)
+    db_scores = None
+    if os.getenv("SCHEMA_RETRIEVAL_SOURCE", "local") == "pgvector" and conn is not None:
+        try:
+            db_scores = pgvector_scores(vector, conn, index.embedder.name)
+        except Exception as e:
+            logger.warning("pgvector schema lookup failed, using local similarities: {}".format(str(e)))
+            conn.rollback()
+
+    pruned = index.select(
+        question,
+        top_k_tables=int(os.getenv("SCHEMA_TOP_K_TABLES", "4")),
+        top_k_columns=int(os.getenv("SCHEMA_TOP_K_COLUMNS", "12")),
+        vector=vector,
+        db_scores=db_scores,
+    )
+    logger.info("Schema retrieval kept {} of {} tables: {}".format(
+        len(pruned), len(index.tables), ", ".join(pruned)))
+    return schema_to_prompt_format(pruned)
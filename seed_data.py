@@ -0,0 +1,473 @@
+"""
+Generated seed data for the companies database, at any scale.
+
+The insert_*.sql files load a few hundred random rows, so nothing tested
+against them looks like production volume. This script generates the same
+five tables at a chosen total row count, from a thousand rows up to a hundred
+million, and loads them with parallel COPY streams:
+
+- companies with unique tickers, and sectors and industries as in insert_companies.sql
+- stock_prices: a daily random walk per company over the business days up to END_DATE
+- company_financials: QUARTERS quarters per company, growing over time
+- analyst_estimates: targets around each company's last close
+- supply_chain: each company buys from a few other companies, never from itself
+
+Every company's rows come from random generators seeded with --seed and the
+company id. The same seed therefore gives the same data whatever the number
+of workers, so a slow query can be reproduced against the same data.
+
+Loading drops and recreates the tables from create_tables.sql, so point
+DB_NAME at a database used only for testing. It then drops their primary and
+foreign keys, and COPYs ranges of companies on --workers connections at once.
+Afterwards it adds the keys back, indexes the usual join and filter columns,
+and runs ANALYZE.
+
+Examples:
+    python seed_data.py --rows 1000000 --workers 8
+    python seed_data.py --rows 100000000 --workers 16 --seed 7
+    python seed_data.py --rows 50000 --plan
+
+Configuration (environment variables):
+    DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT   database to load
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import date, timedelta
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+# Tables created by create_tables.sql, in an order that respects foreign keys
+DATA_TABLES = ["supply_chain", "analyst_estimates", "stock_prices", "company_financials", "companies"]
+
+MIN_ROWS = 1000
+MAX_ROWS = 100000000
+
+# Last day of generated prices; financials and estimates lead up to it
+END_DATE = date(2024, 12, 31)
+
+# Rows per company in the tables that do not grow with the scale
+QUARTERS = 20
+ESTIMATES_PER_COMPANY = 10
+SUPPLIERS_PER_COMPANY = 5
+
+# One company per this many rows, within COMPANY_LIMITS
+ROWS_PER_COMPANY = 1000
+COMPANY_LIMITS = (10, 100000)
+
+SECTORS = {
+    "Technology": ["Software", "Hardware", "Semiconductors", "IT Services", "Internet"],
+    "Healthcare": ["Pharmaceuticals", "Biotechnology", "Medical Devices", "Healthcare Services", "Health Insurance"],
+    "Financial Services": ["Banking", "Insurance", "Asset Management", "Financial Technology", "Investment Banking"],
+    "Consumer Goods": ["Retail", "Food & Beverage", "Apparel", "Personal Products", "Consumer Electronics"],
+    "Industrial": ["Aerospace & Defense", "Machinery", "Transportation", "Construction", "Manufacturing"],
+    "Energy": ["Other"],
+    "Utilities": ["Other"],
+    "Materials": ["Other"],
+    "Real Estate": ["Other"],
+    "Communication Services": ["Other"],
+}
+HEADQUARTERS = ["New York, NY", "San Francisco, CA", "Chicago, IL", "Boston, MA", "Seattle, WA", "Austin, TX",
+                "Los Angeles, CA", "Denver, CO", "Atlanta, GA", "Dallas, TX"]
+CEO_NAMES = ["John Smith", "Sarah Johnson", "Michael Chen", "Emily Davis", "Robert Wilson", "Jennifer Brown",
+             "David Rodriguez", "Lisa Wong", "James Miller", "Patricia Thompson"]
+NAME_WORDS = ["Apex", "Blue", "Cedar", "Delta", "Ember", "Falcon", "Granite", "Harbor", "Iron", "Juniper",
+              "Keystone", "Lumen", "Meridian", "North", "Orbit", "Pioneer", "Quantum", "River", "Summit", "Vertex"]
+NAME_SUFFIXES = ["Systems", "Holdings", "Group", "Industries", "Labs", "Partners", "Technologies", "Corp"]
+ANALYST_FIRMS = ["Morgan Stanley", "Goldman Sachs", "JP Morgan", "Bank of America", "Citigroup", "Wells Fargo",
+                 "UBS", "Credit Suisse", "Deutsche Bank", "Barclays"]
+COMPONENTS = ["Processors", "Memory", "Batteries", "Displays", "Raw Materials", "Software", "Services",
+              "Logistics", "Manufacturing", "Components"]
+RISK_LEVELS = ["Low", "Medium", "High"]
+
+COLUMNS = {
+    "companies": ["company_id", "ticker", "company_name", "sector", "industry", "founded_date", "headquarters",
+                  "employee_count", "ceo_name"],
+    "stock_prices": ["price_id", "company_id", "price_date", "open_price", "high_price", "low_price",
+                     "close_price", "volume", "adj_close"],
+    "company_financials": ["financial_id", "company_id", "fiscal_year", "fiscal_quarter", "revenue",
+                           "gross_profit", "operating_income", "net_income", "eps", "total_assets",
+                           "total_liabilities", "cash_and_equivalents", "report_date"],
+    "analyst_estimates": ["estimate_id", "company_id", "analyst_firm", "target_price", "recommendation",
+                          "estimated_eps_next_quarter", "estimated_revenue_next_quarter", "estimate_date"],
+    "supply_chain": ["relationship_id", "company_id", "supplier_id", "component", "annual_value",
+                     "contract_start_date", "contract_end_date", "risk_level"],
+}
+
+# Serial key of each table, whose sequence is moved past the loaded ids
+ID_COLUMNS = {table: columns[0] for table, columns in COLUMNS.items()}
+
+# Created after the load, together with the primary and foreign keys
+INDEXES = [
+    "CREATE INDEX stock_prices_company_date_idx ON stock_prices (company_id, price_date)",
+    "CREATE INDEX stock_prices_date_idx ON stock_prices (price_date)",
+    "CREATE INDEX company_financials_company_period_idx ON company_financials (company_id, fiscal_year, fiscal_quarter)",
+    "CREATE INDEX analyst_estimates_company_date_idx ON analyst_estimates (company_id, estimate_date)",
+    "CREATE INDEX supply_chain_company_idx ON supply_chain (company_id)",
+    "CREATE INDEX supply_chain_supplier_idx ON supply_chain (supplier_id)",
+    "CREATE INDEX companies_sector_idx ON companies (sector)",
+]
+
+# Characters buffered per read() of a COPY stream
+_COPY_CHUNK_CHARS = 1 << 16
+
+
+def db_settings():
+    return {
+        "dbname": os.getenv("DB_NAME"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "host": os.getenv("DB_HOST"),
+        "port": os.getenv("DB_PORT"),
+    }
+
+
+def plan(rows):
+    """Companies, trading days and rows per table for about rows rows in total."""
+    companies = min(max(rows // ROWS_PER_COMPANY, COMPANY_LIMITS[0]), COMPANY_LIMITS[1])
+    fixed = 1 + QUARTERS + ESTIMATES_PER_COMPANY + SUPPLIERS_PER_COMPANY
+    trading_days = max(1, (rows - companies * fixed) // companies)
+    return {
+        "companies": companies,
+        "trading_days": trading_days,
+        "rows": {
+            "companies": companies,
+            "stock_prices": companies * trading_days,
+            "company_financials": companies * QUARTERS,
+            "analyst_estimates": companies * ESTIMATES_PER_COMPANY,
+            "supply_chain": companies * SUPPLIERS_PER_COMPANY,
+        },
+    }
+
+
+def trading_dates(days):
+    """The last days business days up to END_DATE, oldest first, as ISO strings."""
+    dates = []
+    day = END_DATE
+    while len(dates) < days:
+        if day.weekday() < 5:
+            dates.append(day.isoformat())
+        day -= timedelta(days=1)
+    dates.reverse()
+    return dates
+
+
+def quarter_periods():
+    """(fiscal_year, fiscal_quarter, report_date) of the last QUARTERS quarters up to END_DATE."""
+    periods = []
+    year, quarter = END_DATE.year, (END_DATE.month - 1) // 3 + 1
+    for _ in range(QUARTERS):
+        quarter_end = date(year, quarter * 3, 1) + timedelta(days=31)
+        quarter_end = quarter_end.replace(day=1) - timedelta(days=1)
+        periods.append((year, quarter, (quarter_end + timedelta(days=30)).isoformat()))
+        year, quarter = (year, quarter - 1) if quarter > 1 else (year - 1, 4)
+    periods.reverse()
+    return periods
+
+
+def _rng(seed, table, company_id):
+    return random.Random("{}:{}:{}".format(seed, table, company_id))
+
+
+def _ticker(company_id):
+    """Unique ticker: the company id in base 26, as letters (1 -> AAAA)."""
+    letters = []
+    n = company_id - 1
+    for _ in range(4):
+        n, digit = divmod(n, 26)
+        letters.append(chr(65 + digit))
+    while n:
+        n, digit = divmod(n - 1, 26)
+        letters.append(chr(65 + digit))
+    return "".join(reversed(letters))
+
+
+def company_lines(seed, first, last):
+    for company_id in range(first, last + 1):
+        rng = _rng(seed, "companies", company_id)
+        sector = rng.choice(list(SECTORS))
+        name = "{} {} {}".format(rng.choice(NAME_WORDS), rng.choice(NAME_WORDS), rng.choice(NAME_SUFFIXES))
+        founded = date(1950, 1, 1) + timedelta(days=rng.randrange(365 * 70))
+        yield "{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n".format(
+            company_id, _ticker(company_id), name, sector, rng.choice(SECTORS[sector]), founded.isoformat(),
+            rng.choice(HEADQUARTERS), rng.randint(100, 200000), rng.choice(CEO_NAMES))
+
+
+def stock_price_lines(seed, first, last, dates, last_close):
+    """Daily prices of each company; its final close is recorded in last_close."""
+    days = len(dates)
+    for company_id in range(first, last + 1):
+        rng = _rng(seed, "stock_prices", company_id)
+        gauss = rng.gauss
+        close = rng.uniform(10, 500)
+        base_volume = rng.uniform(11, 15)
+        price_id = (company_id - 1) * days
+        for price_date in dates:
+            price_id += 1
+            open_price = min(max(close * (1 + gauss(0, 0.005)), 1.0), 1000000.0)
+            close = min(max(open_price * (1 + gauss(0.0003, 0.02)), 1.0), 1000000.0)
+            high = max(open_price, close) * (1 + abs(gauss(0, 0.01)))
+            low = min(open_price, close) * (1 - abs(gauss(0, 0.01)))
+            yield "{}\t{}\t{}\t{:.2f}\t{:.2f}\t{:.2f}\t{:.2f}\t{}\t{:.2f}\n".format(
+                price_id, company_id, price_date, open_price, high, low, close,
+                int(rng.lognormvariate(base_volume, 0.5)), close)
+        last_close[company_id] = close
+
+
+def financial_lines(seed, first, last, periods):
+    for company_id in range(first, last + 1):
+        rng = _rng(seed, "company_financials", company_id)
+        revenue = rng.uniform(1e7, 5e9)
+        gross_margin = rng.uniform(0.2, 0.7)
+        operating_margin = gross_margin * rng.uniform(0.2, 0.6)
+        shares = rng.uniform(5e7, 5e9)
+        assets = revenue * rng.uniform(2, 8)
+        financial_id = (company_id - 1) * QUARTERS
+        for fiscal_year, fiscal_quarter, report_date in periods:
+            financial_id += 1
+            revenue *= 1 + rng.gauss(0.015, 0.05)
+            operating_income = revenue * (operating_margin + rng.gauss(0, 0.03))
+            net_income = operating_income * rng.uniform(0.6, 0.85)
+            assets *= 1 + rng.gauss(0.01, 0.02)
+            yield "{}\t{}\t{}\t{}\t{:.2f}\t{:.2f}\t{:.2f}\t{:.2f}\t{:.2f}\t{:.2f}\t{:.2f}\t{:.2f}\t{}\n".format(
+                financial_id, company_id, fiscal_year, fiscal_quarter, revenue,
+                revenue * (gross_margin + rng.gauss(0, 0.02)), operating_income, net_income,
+                net_income / shares, assets, assets * rng.uniform(0.3, 0.8), assets * rng.uniform(0.05, 0.2),
+                report_date)
+
+
+def estimate_lines(seed, first, last, last_close):
+    for company_id in range(first, last + 1):
+        rng = _rng(seed, "analyst_estimates", company_id)
+        price = last_close.get(company_id, 100.0)
+        eps = rng.uniform(-1, 8)
+        revenue = rng.uniform(1e7, 5e9)
+        estimate_id = (company_id - 1) * ESTIMATES_PER_COMPANY
+        for _ in range(ESTIMATES_PER_COMPANY):
+            estimate_id += 1
+            upside = rng.gauss(0.08, 0.15)
+            if upside > 0.2:
+                recommendation = "Buy"
+            elif upside > 0.08:
+                recommendation = "Overweight"
+            elif upside > -0.05:
+                recommendation = "Hold"
+            elif upside > -0.15:
+                recommendation = "Underweight"
+            else:
+                recommendation = "Sell"
+            estimate_date = END_DATE - timedelta(days=rng.randrange(180))
+            yield "{}\t{}\t{}\t{:.2f}\t{}\t{:.2f}\t{:.2f}\t{}\n".format(
+                estimate_id, company_id, rng.choice(ANALYST_FIRMS), max(price * (1 + upside), 1.0),
+                recommendation, eps * rng.uniform(0.9, 1.1), revenue * rng.uniform(0.9, 1.1),
+                estimate_date.isoformat())
+
+
+def supply_chain_lines(seed, first, last, companies):
+    for company_id in range(first, last + 1):
+        rng = _rng(seed, "supply_chain", company_id)
+        # Suppliers are other companies of the whole dataset, so the graph spans worker ranges
+        suppliers = set()
+        while len(suppliers) < min(SUPPLIERS_PER_COMPANY, companies - 1):
+            supplier_id = rng.randint(1, companies)
+            if supplier_id != company_id:
+                suppliers.add(supplier_id)
+        relationship_id = (company_id - 1) * SUPPLIERS_PER_COMPANY
+        for supplier_id in sorted(suppliers):
+            relationship_id += 1
+            start = END_DATE - timedelta(days=rng.randrange(365 * 5))
+            end = start + timedelta(days=365 * rng.randint(1, 5))
+            yield "{}\t{}\t{}\t{}\t{:.2f}\t{}\t{}\t{}\n".format(
+                relationship_id, company_id, supplier_id, rng.choice(COMPONENTS), rng.uniform(1e5, 5e8),
+                start.isoformat(), end.isoformat(), rng.choice(RISK_LEVELS))
+
+
+class CopyStream:
+    """File-like view of an iterator of COPY text lines, for cursor.copy_expert."""
+
+    def __init__(self, lines):
+        self._lines = lines
+        self._buffer = b""
+        self.rows = 0
+
+    def read(self, size=-1):
+        want = _COPY_CHUNK_CHARS if size is None or size < 0 else size
+        parts = []
+        length = len(self._buffer)
+        for line in self._lines:
+            parts.append(line)
+            length += len(line)
+            if length >= want:
+                break
+        self.rows += len(parts)
+        data = self._buffer + "".join(parts).encode("utf-8")
+        self._buffer = data[want:]
+        return data[:want]
+
+    readline = read
+
+
+def load_range(settings, seed, first, last, companies, trading_days):
+    """Generate and COPY every table's rows for companies first..last; returns rows per table."""
+    import psycopg2
+
+    dates = trading_dates(trading_days)
+    last_close = {}
+    # stock_prices is loaded before analyst_estimates, which reads the last closes
+    streams = [
+        ("companies", company_lines(seed, first, last)),
+        ("stock_prices", stock_price_lines(seed, first, last, dates, last_close)),
+        ("company_financials", financial_lines(seed, first, last, quarter_periods())),
+        ("analyst_estimates", estimate_lines(seed, first, last, last_close)),
+        ("supply_chain", supply_chain_lines(seed, first, last, companies)),
+    ]
+    counts = {}
+    conn = psycopg2.connect(**settings)
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("SET synchronous_commit = off")
+            for table, lines in streams:
+                stream = CopyStream(lines)
+                cur.copy_expert("COPY {} ({}) FROM STDIN".format(table, ", ".join(COLUMNS[table])), stream)
+                counts[table] = stream.rows
+    finally:
+        conn.close()
+    return counts
+
+
+def _run_statements(settings, statements, workers):
+    """Run DDL statements on up to workers connections at once (autocommit)."""
+    import psycopg2
+
+    def run(statement):
+        started = time.perf_counter()
+        conn = psycopg2.connect(**settings)
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(statement)
+        finally:
+            conn.close()
+        print("  {:.1f}s  {}".format(time.perf_counter() - started, statement))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for future in as_completed([executor.submit(run, statement) for statement in statements]):
+            future.result()
+
+
+def recreate_tables(settings):
+    """Drop and recreate the data tables, then drop their keys; returns the key definitions to restore."""
+    import psycopg2
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    conn = psycopg2.connect(**settings)
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("DROP TABLE IF EXISTS {} CASCADE".format(", ".join(DATA_TABLES)))
+            with open(os.path.join(here, "create_tables.sql")) as f:
+                cur.execute(f.read())
+            cur.execute(
+                "SELECT conrelid::regclass::text, conname, contype, pg_get_constraintdef(oid) FROM pg_constraint "
+                "WHERE conrelid = ANY(%s::regclass[]) AND contype IN ('p', 'f')", (DATA_TABLES,))
+            keys = cur.fetchall()
+            # Foreign keys first: the primary keys they reference cannot go before them
+            for table, name, kind, _ in sorted(keys, key=lambda key: key[2] != "f"):
+                cur.execute("ALTER TABLE {} DROP CONSTRAINT {}".format(table, name))
+    finally:
+        conn.close()
+    return keys
+
+
+def restore_keys(settings, keys, workers):
+    """Add the primary keys back, build the indexes, then validate the foreign keys."""
+    add = "ALTER TABLE {} ADD CONSTRAINT {} {}"
+    print("Adding primary keys...")
+    _run_statements(settings, [add.format(t, n, d) for t, n, kind, d in keys if kind == "p"], workers)
+    print("Creating indexes...")
+    _run_statements(settings, INDEXES, workers)
+    # One at a time: each locks the referenced companies table
+    print("Adding foreign keys...")
+    _run_statements(settings, [add.format(t, n, d) for t, n, kind, d in keys if kind == "f"], 1)
+
+
+def finish(settings):
+    """Move the serial sequences past the loaded ids and refresh planner statistics."""
+    import psycopg2
+
+    conn = psycopg2.connect(**settings)
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            for table, column in ID_COLUMNS.items():
+                cur.execute("SELECT setval(pg_get_serial_sequence(%s, %s), "
+                            "(SELECT COALESCE(MAX({}), 0) + 1 FROM {}), false)".format(column, table),
+                            (table, column))
+            cur.execute("ANALYZE {}".format(", ".join(DATA_TABLES)))
+    finally:
+        conn.close()
+
+
+def load(rows, workers=4, seed=0, settings=None):
+    """Recreate the data tables and load about rows generated rows; returns rows loaded per table."""
+    settings = settings or db_settings()
+    layout = plan(rows)
+    companies = layout["companies"]
+    print("Generating {:,} companies with {:,} trading days each (seed {}).".format(
+        companies, layout["trading_days"], seed))
+
+    started = time.perf_counter()
+    keys = recreate_tables(settings)
+
+    # Several ranges per worker, so the last ranges do not leave workers idle
+    chunk = max(1, -(-companies // (workers * 4)))
+    ranges = [(first, min(first + chunk - 1, companies)) for first in range(1, companies + 1, chunk)]
+    totals = dict.fromkeys(COLUMNS, 0)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(load_range, settings, seed, first, last, companies, layout["trading_days"])
+                   for first, last in ranges]
+        for done, future in enumerate(as_completed(futures), 1):
+            for table, count in future.result().items():
+                totals[table] += count
+            loaded = sum(totals.values())
+            print("  {}/{} ranges, {:,} rows, {:,.0f} rows/s".format(
+                done, len(ranges), loaded, loaded / (time.perf_counter() - started)))
+    print("Loaded {:,} rows in {:.1f}s.".format(sum(totals.values()), time.perf_counter() - started))
+
+    restore_keys(settings, keys, workers)
+    finish(settings)
+    print("Done in {:.1f}s.".format(time.perf_counter() - started))
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate and load seed data at a chosen scale.")
+    parser.add_argument("--rows", type=int, default=1000000,
+                        help="approximate total rows, {:,} to {:,}".format(MIN_ROWS, MAX_ROWS))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="parallel COPY streams")
+    parser.add_argument("--seed", type=int, default=0, help="random seed; the same seed gives the same data")
+    parser.add_argument("--plan", action="store_true", help="print the rows per table and exit")
+    args = parser.parse_args()
+    if not MIN_ROWS <= args.rows <= MAX_ROWS:
+        parser.error("--rows must be between {:,} and {:,}".format(MIN_ROWS, MAX_ROWS))
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    layout = plan(args.rows)
+    for table, count in layout["rows"].items():
+        print("{:<20} {:>14,}".format(table, count))
+    if args.plan:
+        return
+
+    load_dotenv()
+    settings = db_settings()
+    missing = [key for key in ("dbname", "user", "host", "port") if not settings[key]]
+    if missing:
+        sys.exit("Set DB_NAME, DB_USER, DB_HOST and DB_PORT (missing: {}).".format(", ".join(missing)))
+    load(args.rows, workers=args.workers, seed=args.seed, settings=settings)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,32 @@
-import json
 import os
 import sys
 import re
 import logging
 import argparse
-from datetime import datetime
-import decimal
-from flask import Flask, request, Response, jsonify, render_template, send_from_directory, redirect
+import uuid
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, request, Response, jsonify, render_template, send_from_directory, redirect, stream_with_context
 from dotenv import load_dotenv
+from sql_cache import get_sql_cache, schema_version
+from result_cache import get_result_cache
+from result_store import get_result_store, paged_sql
+from result_cursors import get_cursor_registry
+from result_export import EXPORT_BATCH_ROWS, ExportError, ResultWriter, export_chunks, stored_batches
+from result_encoding import QueryResult, dumps, encode_rows
+from sql_utils import is_read_only, written_tables
+from sql_guard import guard_sql
+from sql_repair import run_with_repair, get_repair_cache
+from schema_retrieval import get_schema_index, retrieve_schema
+from chart_planner import CHART_MAX_ROWS, CHART_MAX_POINTS, is_number, local_visualization, sample_rows
+from chart_cache import get_chart_cache, bind_template
+from prompt_encoding import encode_results
+from prompt_cache import system_blocks, record_usage, prompt_cache_stats
+from sql_stream import stream_sql_generation
+import tracing
+from tracing import span
+from analysis import analysis_request, parse_analysis_message, extract_analysis, extract_suggestions
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -37,6 +56,7 @@ except ImportError:
 # Try to import database libraries (but don't fail if they're missing)
 try:
     import psycopg2
+    from db_pool import get_pool, pool_stats
     psycopg2_available = True
 except ImportError:
     logger.warning("psycopg2 not found. PostgreSQL functionality will not be available.")
@@ -56,23 +76,9 @@ except ImportError:
     logger.warning("sqlite3 not found. SQLite functionality will be limited to mock data.")
     sqlite_available = False
 
-# Custom JSON encoder to handle datetime and decimal objects
-class DateTimeEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        elif isinstance(obj, decimal.Decimal):
-            return float(obj)
-        return super().default(obj)
-
-def execute_sql(query, dbname=os.getenv("DB_NAME"), 
-                user=os.getenv("DB_USER"), 
-                password=os.getenv("DB_PASSWORD"), 
-                host=os.getenv("DB_HOST"), 
-                port=os.getenv("DB_PORT")):
+def check_db_settings(dbname, user, host, port):
     """
-    Connects to the PostgreSQL database and executes the given query.
-    Raises exceptions if the database connection fails or the query fails.
+    Raises if required connection details are missing or psycopg2 is not installed.
     """
     # Check if required connection details are present
     if not dbname:
@@ -96,69 +102,159 @@ def execute_sql(query, dbname=os.getenv("DB_NAME"),
         logger.error("Cannot execute SQL: psycopg2 library is not installed.")
         raise ImportError("psycopg2 library is required but not installed. Please install it to connect to PostgreSQL.")
 
-    conn = None
-    cur = None
+def execute_sql(query, dbname=os.getenv("DB_NAME"), 
+                user=os.getenv("DB_USER"), 
+                password=os.getenv("DB_PASSWORD"), 
+                host=os.getenv("DB_HOST"), 
+                port=os.getenv("DB_PORT")):
+    """
+    Executes the given query on a pooled connection to the PostgreSQL database,
+    after the checks in sql_guard (SqlRejected if it fails them). Read-only
+    statements return a QueryResult, other statements an empty list.
+    Raises exceptions if the database connection fails or the query fails.
+    """
+    check_db_settings(dbname, user, host, port)
+
+    # Serve repeated reads from the result cache. The cache and the guard use
+    # the same definition of a read, so WITH, TABLE and VALUES queries count too
+    is_read = is_read_only(query)
+    cache_scope = (dbname, host, port)
+    result_cache = get_result_cache()
+    if result_cache and is_read:
+        cached_results = result_cache.get(query, cache_scope)
+        if cached_results is not None:
+            logger.info("Returning {} cached results for query: {}".format(len(cached_results), query))
+            return cached_results
+
     try:
-        # Connect to PostgreSQL
-        conn = psycopg2.connect(
-            dbname=dbname,
-            user=user,
-            password=password, # Will be None if not set, psycopg2 handles this
-            host=host,
-            port=port
-        )
-        logger.info("Connected to database '{}' on {}:{}".format(dbname, host, port))
-
-        cur = conn.cursor()
-
-        # Execute the query
-        logger.info("Executing SQL query: {}".format(query))
-        cur.execute(query)
-
-        # If it's a SELECT statement, fetch results
-        if query.strip().lower().startswith("select"):
-            results = cur.fetchall()
-            # Get column names
-            colnames = [desc[0] for desc in cur.description]
-            # Convert to list of dictionaries
-            results = [dict(zip(colnames, row)) for row in results]
-            logger.info("Query returned {} results.".format(len(results)))
-        else:
-            # For non-SELECT queries (INSERT, UPDATE, DELETE), report rows affected if available
-            rowcount = cur.rowcount
-            logger.info("Query executed successfully. Rows affected: {}".format(rowcount if rowcount != -1 else 'N/A'))
-            results = [] # Return empty list for non-select queries
+        # Check out a warm connection from the process-wide pool
+        pool = get_pool(dbname=dbname, user=user, password=password, host=host, port=port)
+        with pool.connection() as conn:
+            # Reject or limit expensive statements before they run
+            with span("sql_guard"):
+                guarded_query = guard_sql(conn, query)
+            with conn.cursor() as cur:
+                # Execute the query
+                logger.info("Executing SQL query: {}".format(guarded_query))
+                with span("db_query") as attributes:
+                    cur.execute(guarded_query)
+                    # If the statement reads, fetch results
+                    if is_read:
+                        results = cur.fetchall()
+                        attributes["db.rows"] = len(results)
+
+                if is_read:
+                    # Keep the row tuples; row dicts are built only where they are read
+                    colnames = [desc[0] for desc in cur.description]
+                    results = QueryResult(colnames, results)
+                    logger.info("Query returned {} results.".format(len(results)))
+                else:
+                    # For writes (INSERT, UPDATE, DELETE), report rows affected if available
+                    rowcount = cur.rowcount
+                    logger.info("Query executed successfully. Rows affected: {}".format(rowcount if rowcount != -1 else 'N/A'))
+                    results = [] # Return empty list for writes
 
-        # Commit changes if it wasn't a SELECT query
-        if not query.strip().lower().startswith("select"):
-            conn.commit()
-            logger.info("Changes committed to the database.")
+            # Commit changes if the statement wrote
+            if not is_read:
+                conn.commit()
+                logger.info("Changes committed to the database.")
+
+        if result_cache:
+            if is_read:
+                result_cache.put(query, results, cache_scope)
+            else:
+                # Evict cached results that read the tables this statement wrote
+                result_cache.invalidate_tables(written_tables(query))
 
         return results
 
     except Exception as e:
-        # Rollback in case of error during transaction
-        if conn:
-            conn.rollback()
+        # The pool rolls back (or discards) the connection on error
         logger.error("Database error occurred for query: {}".format(query))
         logger.error("Error details: {}".format(str(e)))
         # Re-raise the exception to be handled by the caller
         raise e
 
-    finally:
-        # Ensure the cursor and connection are closed
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
-            logger.info("Database connection closed.")
+# Rows per NDJSON "rows" line
+QUERY_STREAM_BATCH_SIZE = int(os.getenv("QUERY_STREAM_BATCH_SIZE", "500"))
 
-def get_sql_from_claude(question):
+def stream_sql(query, batch_size=QUERY_STREAM_BATCH_SIZE,
+               dbname=os.getenv("DB_NAME"),
+               user=os.getenv("DB_USER"),
+               password=os.getenv("DB_PASSWORD"),
+               host=os.getenv("DB_HOST"),
+               port=os.getenv("DB_PORT")):
     """
-    Gets SQL query from Claude using the Tools API.
+    Executes a SELECT on a named (server-side) cursor and yields
+    (column_names, rows) batches of at most batch_size row tuples, so only one
+    batch is held in memory however large the result is. The pooled connection
+    is held until the generator is exhausted or closed. The guard adds no
+    row limit: every row is streamed.
     """
-    # Hard-coded schema information
-    hardcoded_schema = """
+    check_db_settings(dbname, user, host, port)
+
+    pool = get_pool(dbname=dbname, user=user, password=password, host=host, port=port)
+    with pool.connection() as conn:
+        with span("sql_guard"):
+            guarded_query = guard_sql(conn, query, limit_rows=False)
+        with conn.cursor(name="stream_{}".format(uuid.uuid4().hex)) as cur:
+            cur.itersize = batch_size
+            logger.info("Streaming SQL query: {}".format(guarded_query))
+            # Time to the first batch; later batches wait on the client
+            with span("db_query"):
+                cur.execute(guarded_query)
+                row_count = 0
+                rows = cur.fetchmany(batch_size)
+            colnames = [desc[0] for desc in cur.description]
+            yield colnames, rows
+            row_count += len(rows)
+            while len(rows) == batch_size:
+                rows = cur.fetchmany(batch_size)
+                if rows:
+                    yield colnames, rows
+                    row_count += len(rows)
+            logger.info("Streamed {} rows.".format(row_count))
+
+def page_rows(entry, offset, limit, dbname=os.getenv("DB_NAME"),
+              user=os.getenv("DB_USER"),
+              password=os.getenv("DB_PASSWORD"),
+              host=os.getenv("DB_HOST"),
+              port=os.getenv("DB_PORT")):
+    """
+    Rows offset..offset+limit of a stored result as lists in column order:
+    from memory when the rows are held, otherwise from a cursor held open over
+    its SQL (result_cursors), or by re-running the SQL for just that page when
+    held cursors are turned off.
+    """
+    if entry.rows is not None:
+        return entry.page(offset, limit)
+    registry = get_cursor_registry()
+    if registry is None:
+        return execute_sql(paged_sql(entry.sql, offset, limit)).page(0, limit)
+    check_db_settings(dbname, user, host, port)
+    pool = get_pool(dbname=dbname, user=user, password=password, host=host, port=port)
+    _, rows, _ = registry.page(entry, offset, limit, pool)
+    return rows
+
+def check_sql(query, limit_rows=True, dbname=os.getenv("DB_NAME"),
+              user=os.getenv("DB_USER"),
+              password=os.getenv("DB_PASSWORD"),
+              host=os.getenv("DB_HOST"),
+              port=os.getenv("DB_PORT")):
+    """
+    Runs sql_guard's checks (static checks and EXPLAIN) on the query without
+    executing it. Raises like execute_sql would, or like stream_sql with
+    limit_rows=False.
+    """
+    check_db_settings(dbname, user, host, port)
+    pool = get_pool(dbname=dbname, user=user, password=password, host=host, port=port)
+    with pool.connection() as conn:
+        # The pool rolls back the transaction on return
+        with span("sql_guard"):
+            guard_sql(conn, query, limit_rows=limit_rows)
+
+# Hard-coded schema information
+HARDCODED_SCHEMA = """
    analyst_estimates table:
    Description: Wall Street analyst recommendations and price targets
    Columns:
@@ -226,26 +322,50 @@ def get_sql_from_claude(question):
       * contract_end_date: End date of the supplier contract
       * risk_level: Risk assessment level of the supply relationship
     """
-    
-    # Define the SQL generation tool
-    tools = [
-        {
-            "name": "generate_sql",
-            "description": "Generate a SQL query based on the user's request and the database schema",
-            "input_schema": {
-                "type": "object",
-                "properties": {
-                    "sql_query": {
-                        "type": "string",
-                        "description": "The SQL query to execute"
-                    }
-                },
-                "required": ["sql_query"]
-            }
+
+# Fingerprint of the schema given to the model; cached SQL is only reused
+# for questions asked against the same schema version.
+SCHEMA_VERSION = schema_version(HARDCODED_SCHEMA)
+
+def get_schema_for_question(question, schema_index):
+    """
+    Schema text for the prompt: the tables and columns relevant to the question
+    when schema retrieval is enabled, otherwise the full hard-coded schema.
+    """
+    if schema_index is None:
+        return HARDCODED_SCHEMA
+    try:
+        if os.getenv("SCHEMA_RETRIEVAL_SOURCE") == "pgvector" and psycopg2_available:
+            pool = get_pool(dbname=os.getenv("DB_NAME"), user=os.getenv("DB_USER"),
+                            password=os.getenv("DB_PASSWORD"), host=os.getenv("DB_HOST"),
+                            port=os.getenv("DB_PORT"))
+            with pool.connection() as conn:
+                return retrieve_schema(question, schema_index, conn)
+        return retrieve_schema(question, schema_index)
+    except Exception as e:
+        logger.error("Schema retrieval failed, using the full schema: {}".format(str(e)))
+        return HARDCODED_SCHEMA
+
+# Tool the model calls with the generated SQL
+SQL_TOOLS = [
+    {
+        "name": "generate_sql",
+        "description": "Generate a SQL query based on the user's request and the database schema",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "sql_query": {
+                    "type": "string",
+                    "description": "The SQL query to execute"
+                }
+            },
+            "required": ["sql_query"]
         }
-    ]
+    }
+]
 
-    system_prompt = """You are a database expert that converts natural language into SQL queries.
+# System prompt for SQL generation; the schema text is filled in once per schema version
+SQL_SYSTEM_PROMPT = """You are a database expert that converts natural language into SQL queries.
 
 Database Expert:
 - Convert natural language questions into SQL queries based ONLY on the provided schema.
@@ -261,45 +381,136 @@ IMPORTANT INSTRUCTIONS FOR DATABASE QUERIES:
    - All foreign keys are explicitly marked with "(FOREIGN KEY references table.column)".
 4. If the schema doesn't contain exactly what the user is asking for, use the most relevant tables and columns FROM THE PROVIDED SCHEMA.
 5. Pay close attention to column names including their exact spelling and table prefixes.
-6. Use JOINs, subqueries, and advanced SQL features when appropriate, but ensure all referenced tables/columns are in the provided schema.""".format(hardcoded_schema)
+6. Use JOINs, subqueries, and advanced SQL features when appropriate, but ensure all referenced tables/columns are in the provided schema."""
+
+def sql_request(question, schema_description):
+    """
+    Messages API arguments for generating SQL for a question against the given schema text.
+    The system prompt is built once per schema version and marked for prompt caching,
+    so only the question varies between requests.
+    """
+    system = system_blocks("sql", schema_version(schema_description),
+                           lambda: SQL_SYSTEM_PROMPT.format(schema_description))
+
+    return dict(
+        model="claude-3-7-sonnet-20250219",
+        max_tokens=1000,
+        temperature=0.1,
+        system=system,
+        messages=[
+            {"role": "user", "content": "Generate a SQL query for this request using only the provided schema: {}".format(question)}
+        ],
+        tools=SQL_TOOLS,
+        tool_choice={"type": "auto"}
+    )
+
+def repair_request(question, sql_query, error, schema_description):
+    """
+    Messages API arguments asking for a corrected query after sql_query failed
+    with error. The system prompt is the cached one of sql_request.
+    """
+    request = sql_request(question, schema_description)
+    request["messages"] = [{"role": "user", "content": """Generate a SQL query for this request using only the provided schema: {}
+
+This query was generated for the request but failed:
+{}
+
+Error:
+{}
+
+Call generate_sql with a corrected query.""".format(question, sql_query, error)}]
+    request["tool_choice"] = {"type": "tool", "name": "generate_sql"}
+    return request
+
+def parse_sql_message(message):
+    """
+    Returns (sql_query, None) if the model called generate_sql, otherwise
+    (None, text_response).
+    """
+    # Extract SQL if Claude used the tool
+    if message.content and len(message.content) > 0:
+        for content_block in message.content:
+            if content_block.type == 'tool_use' and content_block.name == "generate_sql":
+                return content_block.input.get("sql_query", ""), None
+
+    # If no tool was used, check for text response
+    response_text = ""
+    if message.content:
+        for content_block in message.content:
+            if content_block.type == 'text':
+                response_text += content_block.text.strip()
+
+    return None, response_text
+
+def get_sql_from_claude(question):
+    """
+    Gets SQL query from Claude using the Tools API. The tool input is
+    streamed and the SQL returned as soon as it is complete.
+    Repeated and near-duplicate questions are answered from the SQL cache.
+    On wide schemas only the relevant slice of the schema is sent.
+    """
+    schema_index = get_schema_index()
+    current_schema_version = schema_index.version if schema_index else SCHEMA_VERSION
+
+    sql_cache = get_sql_cache()
+    if sql_cache:
+        cached_sql = sql_cache.lookup(question, current_schema_version)
+        if cached_sql:
+            return cached_sql, None
+
+    schema_description = get_schema_for_question(question, schema_index)
 
     try:
-        # Send the request to Claude with tools enabled
-        message = client.messages.create(
-            model="claude-3-7-sonnet-20250219",
-            max_tokens=1000,
-            temperature=0.1,
-            system=system_prompt,
-            messages=[
-                {"role": "user", "content": "Generate a SQL query for this request using only the provided schema: {}".format(question)}
-            ],
-            tools=tools,
-            tool_choice={"type": "auto"}
-        )
-        
-        # Extract SQL if Claude used the tool
-        if message.content and len(message.content) > 0:
-            for content_block in message.content:
-                if content_block.type == 'tool_use' and content_block.name == "generate_sql":
-                    sql_query = content_block.input.get("sql_query", "")
-                    print("\nGenerated SQL Query:\n{}".format(sql_query))
-                    return sql_query, None
-        
-        # If no tool was used, check for text response
-        response_text = ""
-        if message.content:
-            for content_block in message.content:
-                if content_block.type == 'text':
-                    response_text += content_block.text.strip()
-        
-        return None, response_text
+        # Stream the request and return as soon as the tool input holds the whole SQL;
+        # the rest of the message streams on while the caller executes it
+        with span("llm_sql"):
+            sql_query, response_text = stream_sql_generation(
+                client.messages.stream(**sql_request(question, schema_description)),
+                on_message=lambda message: record_usage("SQL", message))
+        if sql_query is not None:
+            print("\nGenerated SQL Query:\n{}".format(sql_query))
+            if sql_cache and sql_query:
+                sql_cache.store(question, current_schema_version, sql_query)
+        return sql_query, response_text
     
     except Exception as e:
         print("Error calling Claude API: {}".format(str(e)))
         return None, "Error generating SQL: {}".format(str(e))
 
+def repair_sql_from_claude(question, sql_query, error):
+    """Corrected SQL for a query that failed with error, or None."""
+    try:
+        schema_description = get_schema_for_question(question, get_schema_index())
+        with span("llm_sql_repair"):
+            message = client.messages.create(**repair_request(question, sql_query, error, schema_description))
+            record_usage("SQL repair", message)
+        fixed_sql, _ = parse_sql_message(message)
+        if fixed_sql:
+            logger.info("Repaired SQL Query: {}".format(fixed_sql))
+        return fixed_sql
+    except Exception as e:
+        logger.error("Error repairing SQL: {}".format(str(e)))
+        return None
+
+def checked_sql(question, sql_query, limit_rows=True):
+    """
+    The query, repaired until it passes the guard's static and EXPLAIN checks.
+    Used before streaming, where failures can no longer be repaired once rows
+    are being sent. When repair fails the query is returned unchanged and
+    execution reports the error. limit_rows=False checks it as stream_sql
+    will run it.
+    """
+    try:
+        return run_with_repair(question, sql_query, functools.partial(check_sql, limit_rows=limit_rows),
+                               repair_sql_from_claude)[0]
+    except Exception as e:
+        logger.warning("Could not repair SQL before streaming: {}".format(str(e)))
+        return sql_query
+
 # Initialize Flask app
 app = Flask(__name__)
+# Per-stage timings of every request, exported at /metrics
+tracing.init_app(app)
 
 # System prompt for SQL generation
 SYSTEM_PROMPT = """
@@ -317,63 +528,117 @@ Follow these rules:
 9. Don't reference tables or columns that weren't mentioned or implied in the question.
 """
 
-def get_visualization_from_claude(results):
-    """Generate a visualization using Anthropic's Claude model."""
+# Rows of a result shown to the model for charts, and rows summarised for analysis
+VISUALIZATION_MAX_ROWS = 20
+ANALYSIS_MAX_ROWS = int(os.getenv("ANALYSIS_MAX_ROWS", "50000"))
+
+def visualization_request(results):
+    """Messages API arguments for a Chart.js visualization of the results."""
+    # Column statistics plus a few rows that represent the whole result
+    results_text = encode_results(results, max_rows=VISUALIZATION_MAX_ROWS)
+    
+    system_prompt = """
+    You are an expert data visualization assistant. Your task is to create beautiful, interactive visualizations based on the data provided.
+    
+    Guidelines:
+    1. Analyze the data structure and values to determine the most appropriate visualization type (bar chart, line chart, pie chart, scatter plot, etc.).
+    2. Create clean, professional visualizations using Chart.js.
+    3. Your response must contain valid HTML, CSS, and JavaScript that renders a visualization. It MUST include a <canvas> element whose id is exactly __CHART_ID__.
+    4. Include the Chart.js library via CDN WITHIN the returned HTML snippet.
+    5. Make the visualization responsive and visually appealing with proper labels, titles, and colors.
+    6. Return ONLY the HTML code needed to display the visualization, nothing else.
+    7. For numerical data, consider appropriate scales and formats.
+    8. Choose appropriate colors that are visually pleasing and accessible.
+    9. IMPORTANT: Your entire response should be valid HTML that can be directly injected into a webpage.
+    10. If the data has date/time values, consider using them for the x-axis.
+    11. If there are multiple numeric columns, create a visualization that best represents their relationship.
+    12. Add a clear title that describes what the visualization shows.
+    13. CRITICAL JAVASCRIPT REQUIREMENT: All JavaScript code that initializes the Chart.js chart MUST be placed within its own <script> tag. This ENTIRE script block MUST be wrapped inside an event listener that waits for the DOM to be ready, like `document.addEventListener('DOMContentLoaded', function() { ... your chart code ... });` or placed at the very end of the HTML snippet you return. This ensures the canvas element exists before the script tries to use it.
+    14. CRITICAL DATA REQUIREMENT: Do not hard-code any data values. Your code is reused as a template for other results with the same columns. Write `const rows = __CHART_DATA__;` exactly once; __CHART_DATA__ is replaced with a JSON array of row objects keyed by the column names in the CSV header of the data (dates as ISO strings). Compute all labels, datasets and any value-dependent title text from `rows`.
+    """
+    
+    user_prompt = """
+    Please create a visualization for the following data:
+    
+    {}
+    
+    Analyze this data and create the most appropriate chart using Chart.js. Return only the HTML code that renders the visualization.
+    """.format(results_text)
+
+    return dict(
+        model="claude-3-sonnet-20240229",
+        max_tokens=4000,
+        system=system_prompt,
+        messages=[{"role": "user", "content": user_prompt}]
+    )
+
+def parse_visualization_message(message):
+    """Visualization HTML from the model's reply, without code fences."""
+    visualization_html = message.content[0].text
+    
+    # If the response is wrapped in code blocks, remove them
+    return re.sub(r'```html|```', '', visualization_html).strip()
+
+def chart_data_json(results):
+    """JSON rows bound into a chart template: the whole result, reduced to CHART_MAX_POINTS rows."""
+    return dumps(sample_rows(results[:CHART_MAX_ROWS], CHART_MAX_POINTS)).decode("utf-8")
+
+def get_visualization_from_claude(results, question=None):
+    """
+    Generate a visualization using Anthropic's Claude model. The model writes
+    a template that is cached by result shape and question intent, so later
+    results of the same shape are charted without calling it.
+    """
     try:
-        logger.info("Requesting visualization from Claude API")
-        
-        # Convert results to JSON string for the prompt
-        results_json = json.dumps(results[:20])  # Limit to 20 items to avoid token limits
-        
-        system_prompt = """
-        You are an expert data visualization assistant. Your task is to create beautiful, interactive visualizations based on the data provided.
-        
-        Guidelines:
-        1. Analyze the data structure and values to determine the most appropriate visualization type (bar chart, line chart, pie chart, scatter plot, etc.).
-        2. Create clean, professional visualizations using Chart.js.
-        3. Your response must contain valid HTML, CSS, and JavaScript that renders a visualization. It MUST include a <canvas> element with a unique ID.
-        4. Include the Chart.js library via CDN WITHIN the returned HTML snippet.
-        5. Make the visualization responsive and visually appealing with proper labels, titles, and colors.
-        6. Return ONLY the HTML code needed to display the visualization, nothing else.
-        7. For numerical data, consider appropriate scales and formats.
-        8. Choose appropriate colors that are visually pleasing and accessible.
-        9. IMPORTANT: Your entire response should be valid HTML that can be directly injected into a webpage.
-        10. If the data has date/time values, consider using them for the x-axis.
-        11. If there are multiple numeric columns, create a visualization that best represents their relationship.
-        12. Add a clear title that describes what the visualization shows.
-        13. CRITICAL JAVASCRIPT REQUIREMENT: All JavaScript code that initializes the Chart.js chart MUST be placed within its own <script> tag. This ENTIRE script block MUST be wrapped inside an event listener that waits for the DOM to be ready, like `document.addEventListener('DOMContentLoaded', function() { ... your chart code ... });` or placed at the very end of the HTML snippet you return. This ensures the canvas element exists before the script tries to use it.
-        """
-        
-        user_prompt = """
-        Please create a visualization for the following data:
-        
-        ```json
-        {}
-        ```
-        
-        Analyze this data and create the most appropriate chart using Chart.js. Return only the HTML code that renders the visualization.
-        """.format(results_json)
-        
-        message = client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=4000,
-            system=system_prompt,
-            messages=[{"role": "user", "content": user_prompt}]
-        )
-        
-        # Extract the visualization HTML
-        visualization_html = message.content[0].text
-        
-        # If the response is wrapped in code blocks, remove them
-        visualization_html = re.sub(r'```html|```', '', visualization_html).strip()
-        
-        logger.info("Successfully generated visualization from Claude API")
-        return visualization_html
+        chart_cache = get_chart_cache()
+        template = chart_cache.lookup(results, question) if chart_cache else None
+        if template is None:
+            logger.info("Requesting visualization from Claude API")
+            
+            with span("llm_visualization"):
+                message = client.messages.create(**visualization_request(results))
+                record_usage("Visualization", message)
+            
+            # Extract the visualization HTML
+            template = parse_visualization_message(message)
+            if chart_cache:
+                chart_cache.store(results, question, template)
+            
+            logger.info("Successfully generated visualization from Claude API")
+        return bind_template(template, chart_data_json(results))
     
     except Exception as e:
         logger.error("Error generating visualization: {}".format(str(e)))
         return "<div class='error'>Error generating visualization: {}</div>".format(str(e))
 
+def get_visualization(results, question=None):
+    """
+    Chart HTML for the results: drawn by the rule-based chart planner when it
+    recognises the shape of the data, otherwise generated by Claude.
+    """
+    with span("chart_planner"):
+        local_chart = local_visualization(results[:CHART_MAX_ROWS])
+    return local_chart or get_visualization_from_claude(results, question)
+
+def get_analysis_from_claude(question, sql_query, results):
+    """
+    Gets Claude's analysis of the query results (same prompt as the chat app).
+    Returns {"analysis": ..., "suggestions": ...}.
+    """
+    try:
+        logger.info("Requesting analysis from Claude API")
+        with span("llm_analysis"):
+            message = client.messages.create(**analysis_request(question, sql_query, results[:ANALYSIS_MAX_ROWS]))
+            record_usage("Analysis", message)
+        analysis_response = parse_analysis_message(message)
+        return {
+            "analysis": extract_analysis(analysis_response) or analysis_response,
+            "suggestions": extract_suggestions(analysis_response)
+        }
+    except Exception as e:
+        logger.error("Error generating analysis: {}".format(str(e)))
+        return {"analysis": "Error analyzing results: {}".format(str(e)), "suggestions": None}
+
 # Web interface routes
 @app.route('/')
 def index():
@@ -384,11 +649,184 @@ def index():
 def serve_static(path):
     return send_from_directory('static', path)
 
+@app.route('/pool-stats')
+def get_pool_stats():
+    """Expose connection pool counters (checked out, waiting, created, recycled) and held result cursors."""
+    registry = get_cursor_registry()
+    return jsonify({
+        "pools": pool_stats() if psycopg2_available else [],
+        "result_cursors": registry.stats() if registry else None
+    })
+
+@app.route('/cache-stats')
+def get_cache_stats():
+    """Expose hit/miss counters for the application caches."""
+    sql_cache = get_sql_cache()
+    result_cache = get_result_cache()
+    chart_cache = get_chart_cache()
+    repair_cache = get_repair_cache()
+    return jsonify({
+        "sql_generation": sql_cache.stats() if sql_cache else None,
+        "results": result_cache.stats() if result_cache else None,
+        "result_handles": get_result_store().stats(),
+        "chart_templates": chart_cache.stats() if chart_cache else None,
+        "prompt": prompt_cache_stats(),
+        "sql_repairs": repair_cache.stats() if repair_cache else None
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Expose request and stage latency histograms and model token counters to Prometheus."""
+    return tracing.metrics_response()
+
+def ndjson_line(obj):
+    """Serialize one NDJSON message."""
+    return dumps(obj) + b"\n"
+
+def stream_query_results(sql_query, question=None):
+    """
+    Generator of NDJSON lines for a streamed query: a "meta" line with the SQL
+    and column names, one "rows" line per cursor batch, then an "end" line with
+    the row count and a result handle. Errors after the response has started
+    are sent as an "error" line.
+    """
+    row_count = 0
+    started = False
+    store = get_result_store()
+    # Rows are also kept for the result handle until they outgrow the store's per-result limit
+    kept_rows, kept_bytes = [], 0
+    try:
+        for colnames, rows in stream_sql(sql_query):
+            if not started:
+                yield ndjson_line({"type": "meta", "sql_query": sql_query, "columns": colnames})
+                started = True
+            if rows:
+                row_count += len(rows)
+                yield ndjson_line({"type": "rows", "rows": encode_rows(colnames, rows)})
+                if kept_rows is not None:
+                    kept_bytes += QueryResult(colnames, rows).estimate_size()
+                    if kept_bytes <= store.max_entry_bytes:
+                        kept_rows.extend(rows)
+                    else:
+                        kept_rows = None
+        if kept_rows is not None:
+            kept_rows = QueryResult(colnames, kept_rows)
+        result_handle = store.put(sql_query, colnames, kept_rows, row_count, question)
+        yield ndjson_line({"type": "end", "row_count": row_count, "result_handle": result_handle})
+        logger.info("Successfully streamed SQL query with {} results".format(row_count))
+    except Exception as e:
+        logger.error("Error streaming SQL results: {}".format(str(e)))
+        if not started:
+            yield ndjson_line({"type": "meta", "sql_query": sql_query, "columns": []})
+        yield ndjson_line({
+            "type": "error",
+            "message": "I generated a SQL query, but there was an error executing it: {}".format(str(e))
+        })
+
+def stream_pipeline_results(question, sql_query):
+    """
+    Generator of NDJSON lines for the combined pipeline. The results are sent
+    as in stream_query_results, then analysis and visualization are generated
+    concurrently from the rows already in memory and each is sent as an
+    "analysis" or "visualization" line as soon as it is ready, before the
+    final "end" line.
+    """
+    try:
+        results = execute_sql(sql_query)
+    except Exception as e:
+        logger.error("Error executing SQL: {}".format(str(e)))
+        yield ndjson_line({"type": "meta", "sql_query": sql_query, "columns": []})
+        yield ndjson_line({
+            "type": "error",
+            "message": "I generated a SQL query, but there was an error executing it: {}".format(str(e))
+        })
+        return
+
+    columns = results.columns
+    yield ndjson_line({"type": "meta", "sql_query": sql_query, "columns": columns})
+    for start in range(0, len(results), QUERY_STREAM_BATCH_SIZE):
+        yield ndjson_line({"type": "rows",
+                           "rows": encode_rows(columns, results.rows[start:start + QUERY_STREAM_BATCH_SIZE])})
+
+    if results:
+        # A chart the planner can draw is sent straight away; only the model calls run in parallel
+        chartable = check_visualization_data(results) is None
+        local_chart = None
+        if chartable:
+            with span("chart_planner"):
+                local_chart = local_visualization(results[:CHART_MAX_ROWS])
+        if local_chart:
+            yield ndjson_line({"type": "visualization", "visualization_html": local_chart})
+        executor = ThreadPoolExecutor(max_workers=2)
+        try:
+            # Each call runs in a copy of the request's context so its spans count toward the request
+            futures = {executor.submit(contextvars.copy_context().run,
+                                       get_analysis_from_claude, question, sql_query, results): "analysis"}
+            if chartable and not local_chart:
+                futures[executor.submit(contextvars.copy_context().run,
+                                        get_visualization_from_claude, results, question)] = "visualization"
+            for future in as_completed(futures):
+                if futures[future] == "analysis":
+                    yield ndjson_line(dict(future.result(), type="analysis"))
+                else:
+                    yield ndjson_line({"type": "visualization", "visualization_html": future.result()})
+        finally:
+            # Don't hold the worker for a client that went away
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    result_handle = get_result_store().put(sql_query, columns, results, question=question)
+    yield ndjson_line({"type": "end", "row_count": len(results), "result_handle": result_handle})
+    logger.info("Pipeline finished for SQL query with {} results".format(len(results)))
+
+def query_results_payload(sql_query, results, question=None, columnar=False):
+    """
+    JSON body of a /query response for a SQL query that was executed. Row
+    results are also kept in the result store and referenced by result_handle.
+    With columnar, rows are sent as one array per column (see result_encoding)
+    instead of a list of row objects.
+    """
+    # Check if results contain an error message
+    if isinstance(results, dict) and "error" in results:
+        logger.error("SQL execution error: {}".format(results['error']))
+        return {
+            "sql_query": sql_query,
+            "message": "The SQL query was generated but could not be executed: {}".format(results['error']),
+            "has_error": True
+        }
+    
+    # Check if we have empty results
+    if not results or len(results) == 0:
+        logger.warning("SQL query produced no results: {}".format(sql_query))
+        return {
+            "sql_query": sql_query,
+            "message": "The query executed successfully but did not return any results.",
+            "results": [],
+            "empty_results": True
+        }
+    
+    # Log successful query execution
+    logger.info("Successfully executed SQL query with {} results".format(len(results)))
+    
+    result_handle = get_result_store().put(sql_query, results.columns, results, question=question)
+    if columnar:
+        return dict(results.to_columnar(), sql_query=sql_query, result_handle=result_handle, success=True)
+    return {
+        "sql_query": sql_query,
+        "results": results.records(),
+        "result_handle": result_handle,
+        "success": True
+    }
+
 @app.route('/query', methods=['POST'])
 def query():
     """API endpoint for processing questions and returning SQL query results."""
     data = request.json
     user_question = data.get('question', '')
+    # Clients can ask for rows to be streamed as NDJSON instead of one JSON document
+    stream = data.get('stream', False) or 'application/x-ndjson' in request.headers.get('Accept', '')
+    pipeline = data.get('pipeline', False)
+    # "columnar" sends rows as one array per column
+    columnar = data.get('format') == 'columnar'
     
     if not user_question:
         return jsonify({"error": "No question provided"}), 400
@@ -396,41 +834,28 @@ def query():
     try:
         logger.info("Processing question: {}".format(user_question))
         # Get SQL from Claude
-        sql_query, text_response = get_sql_from_claude(user_question)
+        with span("sql_generation"):
+            sql_query, text_response = get_sql_from_claude(user_question)
         
-        # If SQL was generated, execute it
+        # Pipeline mode: results, then analysis and chart generated in parallel, in one response
+        if sql_query and pipeline and sql_query.strip().lower().startswith("select"):
+            sql_query = checked_sql(user_question, sql_query)
+            return Response(stream_with_context(stream_pipeline_results(user_question, sql_query)),
+                            mimetype='application/x-ndjson')
+
+        # Stream SELECT results batch by batch from a server-side cursor
+        if sql_query and stream and sql_query.strip().lower().startswith("select"):
+            sql_query = checked_sql(user_question, sql_query, limit_rows=False)
+            return Response(stream_with_context(stream_query_results(sql_query, user_question)),
+                            mimetype='application/x-ndjson')
+
+        # If SQL was generated, execute it, repairing it with the model if it fails
         if sql_query:
             try:
-                results = execute_sql(sql_query)
-                
-                # Check if results contain an error message
-                if isinstance(results, dict) and "error" in results:
-                    logger.error("SQL execution error: {}".format(results['error']))
-                    return jsonify({
-                        "sql_query": sql_query,
-                        "message": "The SQL query was generated but could not be executed: {}".format(results['error']),
-                        "has_error": True
-                    })
-                
-                # Check if we have empty results
-                if not results or len(results) == 0:
-                    logger.warning("SQL query produced no results: {}".format(sql_query))
-                    return jsonify({
-                        "sql_query": sql_query,
-                        "message": "The query executed successfully but did not return any results.",
-                        "results": [],
-                        "empty_results": True
-                    })
-                
-                # Log successful query execution
-                result_count = len(results) if isinstance(results, list) else 0
-                logger.info("Successfully executed SQL query with {} results".format(result_count))
-                
-                return jsonify({
-                    "sql_query": sql_query,
-                    "results": results,
-                    "success": True
-                })
+                sql_query, results = run_with_repair(user_question, sql_query, execute_sql, repair_sql_from_claude)
+                payload = query_results_payload(sql_query, results, user_question, columnar)
+                with span("serialize"):
+                    return Response(dumps(payload), mimetype='application/json')
             except Exception as e:
                 logger.error("Error executing SQL: {}".format(str(e)))
                 return jsonify({
@@ -452,51 +877,145 @@ def query():
             "has_error": True
         }), 500
 
+def rows_for_handle(entry, limit=None):
+    """
+    Row dicts of a stored result (at most limit of them). Results stored
+    without rows are fetched again by re-running their SQL.
+    """
+    if entry.rows is not None:
+        return entry.rows if limit is None else entry.rows[:limit]
+    if limit is None:
+        return execute_sql(entry.sql)
+    return execute_sql(paged_sql(entry.sql, 0, limit, stable=False))
+
+def check_visualization_data(results):
+    """
+    Returns a (payload, status) response when the results cannot be charted,
+    or None when they are fit for visualization.
+    """
+    if not results:
+        logger.warning("No results provided for visualization")
+        return {"error": "No results provided."}, 400
+    
+    # Check if the data is suitable for visualization
+    if len(results) < 2:
+        logger.warning("Not enough data points for visualization")
+        return {
+            "visualization_html": "<div class='error-message'>Not enough data points to create a meaningful visualization.</div>"
+        }, 200
+    
+    # Check if there's at least one numeric column
+    has_numeric = isinstance(results[0], dict) and any(is_number(value) for value in results[0].values())
+    
+    if not has_numeric:
+        logger.warning("No numeric columns for visualization")
+        return {
+            "visualization_html": "<div class='error-message'>No numeric data found. Visualization requires at least one column with numeric values.</div>"
+        }, 200
+    
+    return None
+
 @app.route('/generate-visualization', methods=['POST'])
 def generate_visualization():
     """API endpoint to generate visualizations from query results."""
     try:
         data = request.json
-        results = data.get('results', [])
-        
-        if not results:
-            logger.warning("No results provided for visualization")
-            return jsonify({"error": "No results provided."}), 400
+        result_handle = data.get('result_handle')
+        question = data.get('question')
+        if result_handle:
+            entry = get_result_store().get(result_handle)
+            if entry is None:
+                return jsonify({"error": "Result handle expired or unknown."}), 404
+            with span("result_fetch"):
+                results = rows_for_handle(entry, CHART_MAX_ROWS)
+            question = question or entry.question
+        else:
+            results = data.get('results', [])
         
-        # Check if the data is suitable for visualization
-        if len(results) < 2:
-            logger.warning("Not enough data points for visualization")
-            return jsonify({
-                "visualization_html": "<div class='error-message'>Not enough data points to create a meaningful visualization.</div>"
-            })
+        error_response = check_visualization_data(results)
+        if error_response:
+            payload, status = error_response
+            return jsonify(payload), status
         
-        # Check if there's at least one numeric column
-        has_numeric = False
-        if results and isinstance(results[0], dict):
-            for key, value in results[0].items():
-                if isinstance(value, (int, float)) or (isinstance(value, str) and value.replace('.', '', 1).isdigit()):
-                    has_numeric = True
-                    break
+        # Chart planner first, Claude for shapes it does not handle
+        logger.info("Generating visualization for {} data points".format(len(results)))
+        visualization_html = get_visualization(results, question)
         
-        if not has_numeric:
-            logger.warning("No numeric columns for visualization")
+        with span("serialize"):
             return jsonify({
-                "visualization_html": "<div class='error-message'>No numeric data found. Visualization requires at least one column with numeric values.</div>"
+                "visualization_html": visualization_html
             })
-        
-        # Get visualization HTML from Claude
-        logger.info("Generating visualization for {} data points".format(len(results)))
-        visualization_html = get_visualization_from_claude(results)
-        
-        return jsonify({
-            "visualization_html": visualization_html
-        })
     except Exception as e:
         logger.error("Error generating visualization: {}".format(str(e)))
         return jsonify({
             "visualization_html": "<div class='error-message'>Error generating visualization: {}</div>".format(str(e))
         }), 500
 
+@app.route('/analyze', methods=['POST'])
+def analyze():
+    """API endpoint to analyse a stored result, referenced by its result handle."""
+    data = request.json
+    entry = get_result_store().get(data.get('result_handle', ''))
+    if entry is None:
+        return jsonify({"error": "Result handle expired or unknown."}), 404
+    try:
+        with span("result_fetch"):
+            results = rows_for_handle(entry, ANALYSIS_MAX_ROWS)
+        question = data.get('question') or entry.question or ""
+        return jsonify(get_analysis_from_claude(question, entry.sql, results))
+    except Exception as e:
+        logger.error("Error analyzing results: {}".format(str(e)))
+        return jsonify({"error": "Error analyzing results: {}".format(str(e))}), 500
+
+@app.route('/results/<result_handle>')
+def get_results_page(result_handle):
+    """
+    API endpoint returning one page of a stored result: ?offset=0&limit=100.
+    next_offset is the offset of the following page, or null after the last.
+    """
+    entry = get_result_store().get(result_handle)
+    if entry is None:
+        return jsonify({"error": "Result handle expired or unknown."}), 404
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = min(max(1, request.args.get('limit', 100, type=int)), 1000)
+    try:
+        with span("result_fetch"):
+            rows = page_rows(entry, offset, limit)
+    except Exception as e:
+        logger.error("Error fetching result page: {}".format(str(e)))
+        return jsonify({"error": "Error fetching results: {}".format(str(e))}), 500
+    return Response(dumps({
+        "result_handle": result_handle,
+        "columns": entry.columns,
+        "rows": encode_rows(entry.columns, rows),
+        "offset": offset,
+        "limit": limit,
+        "next_offset": offset + len(rows) if len(rows) == limit else None,
+        "row_count": entry.row_count
+    }), mimetype='application/json')
+
+@app.route('/export/<result_handle>.<export_format>')
+def export_result(result_handle, export_format):
+    """
+    Download a stored result as csv, arrow or parquet (?compression=...),
+    written batch by batch; results held only as SQL are streamed from a
+    server-side cursor.
+    """
+    entry = get_result_store().get(result_handle)
+    if entry is None:
+        return jsonify({"error": "Result handle expired or unknown."}), 404
+    try:
+        writer = ResultWriter(entry.columns, export_format, request.args.get('compression'))
+    except ExportError as e:
+        return jsonify({"error": str(e)}), 400
+    if entry.rows is not None:
+        batches = stored_batches(entry)
+    else:
+        batches = (rows for _, rows in stream_sql(entry.sql, batch_size=EXPORT_BATCH_ROWS))
+    return Response(stream_with_context(export_chunks(writer, batches)), mimetype=writer.mimetype,
+                    headers={"Content-Disposition": "attachment; filename=results-{}.{}".format(
+                        result_handle[:8], writer.extension)})
+
 # Add a 404 error handler
 @app.errorhandler(404)
 def page_not_found(e):
@@ -0,0 +1,278 @@
+"""
+Cache for natural-language -> SQL generation.
+
+Lookups first try an exact match on the normalised question, then fall back to
+the most similar cached question (cosine similarity of embeddings) generated
+against the same schema version. A similar question only reuses the SQL
+when both questions name the same things: their words other than filler
+("show me", "what are", "the") must be the same, up to order and plurals.
+"top 5 tech companies by revenue" or "top 5 companies by revenue growth"
+therefore never get the SQL of "top 5 companies by revenue", however similar
+their embeddings are. Entries expire after a TTL and the least recently used
+entries are evicted once the cache is full.
+
+Configuration (environment variables):
+    SQL_CACHE_ENABLED      set to 0 to disable the cache (default 1)
+    SQL_CACHE_BACKEND      "memory" (default) or "sqlite"
+    SQL_CACHE_PATH         SQLite file for the sqlite backend (default sql_cache.db)
+    SQL_CACHE_TTL          seconds an entry stays valid (default 86400)
+    SQL_CACHE_MAX_ENTRIES  maximum number of cached questions (default 1000)
+    SQL_CACHE_SIMILARITY   minimum cosine similarity for a near-duplicate hit (default 0.85;
+                           raise it for sharper embedding models)
+"""
+import os
+import re
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from embeddings import get_embedder, stem, tokenize, STOPWORDS
+
+logger = logging.getLogger(__name__)
+
+def normalize_question(question):
+    """Lowercase, strip punctuation and collapse whitespace."""
+    text = unicodedata.normalize("NFKC", question).lower()
+    text = re.sub(r"[^\w\s.%-]", " ", text)
+    text = re.sub(r"(?<!\d)[.-]|[.-](?!\d)", " ", text)
+    return " ".join(text.split())
+
+
+def schema_version(schema_text):
+    """Short stable fingerprint of the schema text given to the model."""
+    return hashlib.sha256(schema_text.encode("utf-8")).hexdigest()[:16]
+
+
+def _guard_terms(normalized):
+    """
+    Words that must match for a near-duplicate hit: numbers, entities
+    (company names, sectors), filters, measures and words like "top" or
+    "bottom" all change the SQL, so every word but filler counts.
+    """
+    words = frozenset(stem(t) for t in tokenize(normalized) if t not in STOPWORDS)
+    # Whole numbers too, so "1.5" and "5.1" differ
+    return words | frozenset(t for t in normalized.split() if any(ch.isdigit() for ch in t))
+
+
+class MemoryBackend:
+    """In-process LRU store."""
+
+    def __init__(self, max_entries=1000, ttl=86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (version, question) -> (sql, vector, created_at)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, version, question):
+        with self._lock:
+            entry = self._entries.get((version, question))
+            if entry is None:
+                return None
+            if time.time() - entry[2] > self.ttl:
+                del self._entries[(version, question)]
+                self.evictions += 1
+                return None
+            self._entries.move_to_end((version, question))
+            return entry[0]
+
+    def candidates(self, version):
+        """(question, sql, vector) for every live entry of a schema version."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            return [(q, e[0], e[1]) for (v, q), e in self._entries.items() if v == version and e[2] >= cutoff]
+
+    def put(self, version, question, sql, vector):
+        with self._lock:
+            self._entries[(version, question)] = (sql, vector, time.time())
+            self._entries.move_to_end((version, question))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def touch(self, version, question):
+        with self._lock:
+            if (version, question) in self._entries:
+                self._entries.move_to_end((version, question))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """Persistent store shared by all worker processes on a host."""
+
+    def __init__(self, path="sql_cache.db", max_entries=1000, ttl=86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sql_generation_cache (
+                    schema_version TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    sql_query TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (schema_version, question)
+                )
+            """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, version, question):
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT sql_query, created_at FROM sql_generation_cache WHERE schema_version = ? AND question = ?",
+            (version, question)).fetchone()
+        if row is None:
+            return None
+        if time.time() - row[1] > self.ttl:
+            with conn:
+                conn.execute("DELETE FROM sql_generation_cache WHERE schema_version = ? AND question = ?",
+                             (version, question))
+            self.evictions += 1
+            return None
+        self.touch(version, question)
+        return row[0]
+
+    def candidates(self, version):
+        rows = self._conn().execute(
+            "SELECT question, sql_query, embedding FROM sql_generation_cache "
+            "WHERE schema_version = ? AND created_at >= ?",
+            (version, time.time() - self.ttl)).fetchall()
+        return [(q, sql, np.frombuffer(blob, dtype=np.float32)) for q, sql, blob in rows]
+
+    def put(self, version, question, sql, vector):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sql_generation_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (version, question, sql, np.asarray(vector, dtype=np.float32).tobytes(), now, now))
+            conn.execute("DELETE FROM sql_generation_cache WHERE created_at < ?", (now - self.ttl,))
+            excess = conn.execute("SELECT COUNT(*) FROM sql_generation_cache").fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM sql_generation_cache WHERE rowid IN ("
+                    "SELECT rowid FROM sql_generation_cache ORDER BY last_access LIMIT ?)", (excess,))
+                self.evictions += excess
+
+    def touch(self, version, question):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "UPDATE sql_generation_cache SET last_access = ? WHERE schema_version = ? AND question = ?",
+                (time.time(), version, question))
+
+    def clear(self):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM sql_generation_cache")
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM sql_generation_cache").fetchone()[0]
+
+
+class SQLGenerationCache:
+    """Exact-then-semantic cache of generated SQL, keyed by schema version."""
+
+    def __init__(self, backend, embedder=None, similarity_threshold=0.85):
+        self.backend = backend
+        self.embedder = embedder or get_embedder()
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+
+    def lookup(self, question, version):
+        """Return cached SQL for the question, or None on a miss."""
+        normalized = normalize_question(question)
+        sql = self.backend.get(version, normalized)
+        if sql is not None:
+            with self._lock:
+                self.hits_exact += 1
+            logger.info("SQL cache hit (exact) for question: {}".format(question))
+            return sql
+
+        candidates = self.backend.candidates(version)
+        if candidates:
+            guard = _guard_terms(normalized)
+            candidates = [c for c in candidates if _guard_terms(c[0]) == guard]
+        if candidates:
+            vector = self.embedder.embed(normalized)
+            similarities = np.stack([c[2] for c in candidates]) @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.similarity_threshold:
+                cached_question, sql, _ = candidates[best]
+                self.backend.touch(version, cached_question)
+                with self._lock:
+                    self.hits_semantic += 1
+                logger.info("SQL cache hit (similarity {:.3f}) for question: {} ~ {}".format(
+                    float(similarities[best]), question, cached_question))
+                return sql
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def store(self, question, version, sql):
+        normalized = normalize_question(question)
+        self.backend.put(version, normalized, sql, self.embedder.embed(normalized))
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits_exact + self.hits_semantic + self.misses
+            return {
+                "backend": type(self.backend).__name__,
+                "entries": len(self.backend),
+                "hits_exact": self.hits_exact,
+                "hits_semantic": self.hits_semantic,
+                "misses": self.misses,
+                "evictions": self.backend.evictions,
+                "hit_rate": (self.hits_exact + self.hits_semantic) / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_sql_cache():
+    """Process-wide cache configured from SQL_CACHE_*; None when disabled."""
+    global _cache
+    if os.getenv("SQL_CACHE_ENABLED", "1") == "0":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            ttl = float(os.getenv("SQL_CACHE_TTL", "86400"))
+            max_entries = int(os.getenv("SQL_CACHE_MAX_ENTRIES", "1000"))
+            if os.getenv("SQL_CACHE_BACKEND", "memory") == "sqlite":
+                backend = SQLiteBackend(os.getenv("SQL_CACHE_PATH", "sql_cache.db"), max_entries, ttl)
+            else:
+                backend = MemoryBackend(max_entries, ttl)
+            _cache = SQLGenerationCache(backend, similarity_threshold=float(os.getenv("SQL_CACHE_SIMILARITY", "0.85")))
+        return _cache
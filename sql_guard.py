@@ -0,0 +1,218 @@
+"""
+Validation of SQL before it is executed.
+
+Model-generated SQL used to go straight to cur.execute, so a single unbounded
+cross join could keep the database busy for minutes. Every statement now
+passes three gates, inside the transaction that will run it:
+
+1. Static checks: exactly one statement, read-only, and every table (and
+   every alias-qualified column) exists in the schema dumped by
+   schema_dump.py. The name check is skipped when there is no dump.
+2. EXPLAIN (FORMAT JSON): a query the planner expects to return more than
+   SQL_GUARD_MAX_ROWS rows gets a LIMIT (or is rejected), and a query whose
+   estimated total cost is above SQL_GUARD_MAX_COST is rejected. The row
+   limit protects the paths that build the whole result in memory. Callers
+   that read rows batch by batch from a cursor (streamed /query, exports,
+   held result cursors) pass limit_rows=False, so their results are never
+   cut short without notice.
+3. SET LOCAL statement_timeout, so the statement is cancelled by the server
+   if it still runs too long, and SET TRANSACTION READ ONLY (unless
+   SQL_GUARD_READ_ONLY=0), so the server refuses any write the static check
+   missed.
+
+Rejections raise SqlRejected, which callers report like any other query error.
+
+Configuration (environment variables):
+    SQL_GUARD_ENABLED         set to 0 to skip the EXPLAIN gate and name checks (default 1)
+    SQL_GUARD_READ_ONLY       set to 0 to allow writes (default 1)
+    SQL_GUARD_MAX_COST        highest planner total cost accepted (default 10000000)
+    SQL_GUARD_MAX_ROWS        estimated rows above which a LIMIT is added (default 100000)
+    SQL_GUARD_AUTO_LIMIT      set to 0 to reject such queries instead of limiting them (default 1)
+    SQL_STATEMENT_TIMEOUT_MS  per-statement timeout, 0 for none (default 30000)
+    SCHEMA_RAW_PATH           raw schema written by schema_dump.py (default schema_raw.json)
+"""
+import os
+import json
+import logging
+import threading
+
+import sql_utils
+
+logger = logging.getLogger(__name__)
+
+SQL_GUARD_ENABLED = os.getenv("SQL_GUARD_ENABLED", "1") != "0"
+SQL_GUARD_READ_ONLY = os.getenv("SQL_GUARD_READ_ONLY", "1") != "0"
+SQL_GUARD_MAX_COST = float(os.getenv("SQL_GUARD_MAX_COST", "10000000"))
+SQL_GUARD_MAX_ROWS = int(os.getenv("SQL_GUARD_MAX_ROWS", "100000"))
+SQL_GUARD_AUTO_LIMIT = os.getenv("SQL_GUARD_AUTO_LIMIT", "1") != "0"
+SQL_STATEMENT_TIMEOUT_MS = int(os.getenv("SQL_STATEMENT_TIMEOUT_MS", "30000"))
+
+
+class SqlRejected(ValueError):
+    """Raised when a statement fails validation and is not executed."""
+
+
+_schema = None
+_schema_mtime = None
+_schema_lock = threading.Lock()
+
+
+def load_schema():
+    """
+    {table: set of column names} from the raw schema dump, or None when
+    there is no dump. Reloaded when the dump file changes.
+    """
+    global _schema, _schema_mtime
+    path = os.getenv("SCHEMA_RAW_PATH", "schema_raw.json")
+    if not os.path.exists(path):
+        return None
+    with _schema_lock:
+        mtime = os.path.getmtime(path)
+        if _schema is None or mtime != _schema_mtime:
+            with open(path) as f:
+                raw = json.load(f)
+            _schema = {table.lower(): {c['name'].lower() for c in info['columns']} for table, info in raw.items()}
+            _schema_mtime = mtime
+        return _schema
+
+
+def check_names(sql, schema):
+    """Raise SqlRejected for a table, or an alias-qualified column, missing from the schema."""
+    aliases = {}
+    for name, alias in sql_utils.table_references(sql):
+        # Catalog tables are not in the dump
+        if name not in schema and not name.startswith("pg_"):
+            raise SqlRejected("Table {} does not exist.".format(name))
+        aliases[name] = name
+        if alias:
+            aliases[alias] = name
+
+    tokens = sql_utils.tokenize(sql)
+    for i in range(len(tokens) - 2):
+        qualifier, dot, column = tokens[i], tokens[i + 1], tokens[i + 2]
+        if dot.text != "." or qualifier.kind not in ("word", "quoted_ident") or column.kind not in ("word", "quoted_ident"):
+            continue
+        if i > 0 and tokens[i - 1].text == ".":
+            continue
+        table = aliases.get(qualifier.value.lower())
+        if table in schema and column.value.lower() not in schema[table]:
+            raise SqlRejected("Column {}.{} does not exist (table {}).".format(qualifier.value, column.value, table))
+
+
+def check_static(sql, schema=None):
+    """Checks that need no database: a single read-only statement naming known tables and columns."""
+    if len(sql_utils.split_statements(sql)) != 1:
+        raise SqlRejected("Exactly one SQL statement can be executed at a time.")
+    if SQL_GUARD_READ_ONLY and not sql_utils.is_read_only(sql):
+        raise SqlRejected("Only read-only queries can be executed.")
+    if SQL_GUARD_ENABLED:
+        schema = schema if schema is not None else load_schema()
+        if schema:
+            check_names(sql, schema)
+
+
+def has_top_level_limit(sql):
+    """True if the statement ends in its own LIMIT or FETCH clause (not one inside a subquery)."""
+    depth = 0
+    for token in sql_utils.tokenize(sql):
+        if token.text == "(":
+            depth += 1
+        elif token.text == ")":
+            depth -= 1
+        elif depth == 0 and token.kind == "word" and token.value in ("limit", "fetch"):
+            return True
+    return False
+
+
+def limited_sql(sql, limit):
+    """The statement with at most limit rows."""
+    statement = sql.strip().rstrip(";").rstrip()
+    if has_top_level_limit(statement):
+        return "SELECT * FROM ({}\n) AS limited_result LIMIT {}".format(statement, int(limit))
+    return "{}\nLIMIT {}".format(statement, int(limit))
+
+
+# Statements that cannot themselves be EXPLAINed; they return a few rows of plan or setting
+_UNEXPLAINABLE = {"explain", "show"}
+
+
+def _needs_plan_check(sql):
+    """True if the EXPLAIN gate applies: a read-only statement other than EXPLAIN or SHOW."""
+    return sql_utils.is_read_only(sql) and sql_utils.first_keyword(sql) not in _UNEXPLAINABLE
+
+
+def explain_sql(sql):
+    return "EXPLAIN (FORMAT JSON) " + sql.strip().rstrip(";")
+
+
+def plan_estimate(explain_output):
+    """(total cost, estimated rows) from the output of EXPLAIN (FORMAT JSON)."""
+    if isinstance(explain_output, str):
+        explain_output = json.loads(explain_output)
+    plan = explain_output[0]["Plan"]
+    return plan["Total Cost"], plan["Plan Rows"]
+
+
+READ_ONLY_STATEMENT = "SET TRANSACTION READ ONLY"
+
+
+def timeout_statement():
+    return "SET LOCAL statement_timeout = {}".format(int(SQL_STATEMENT_TIMEOUT_MS))
+
+
+def _check_cost(sql, cost, rows):
+    if cost > SQL_GUARD_MAX_COST:
+        raise SqlRejected("Query rejected: the planner estimates a cost of {:.0f} (limit {:.0f}) for {:.0f} rows. "
+                          "Narrow it down with filters or aggregation.".format(cost, SQL_GUARD_MAX_COST, rows))
+
+
+def _needs_limit(cost, rows):
+    if rows <= SQL_GUARD_MAX_ROWS:
+        return False
+    if not SQL_GUARD_AUTO_LIMIT:
+        raise SqlRejected("Query rejected: the planner estimates {:.0f} rows (limit {}).".format(
+            rows, SQL_GUARD_MAX_ROWS))
+    return True
+
+
+def guard_sql(conn, sql, limit_rows=True):
+    """
+    Validate sql on a psycopg2 connection inside the transaction that will
+    execute it, and set its statement_timeout (and read-only mode). Returns the SQL to execute
+    (with a LIMIT added if needed and limit_rows is set); raises SqlRejected.
+    """
+    check_static(sql)
+    with conn.cursor() as cur:
+        if SQL_GUARD_READ_ONLY:
+            cur.execute(READ_ONLY_STATEMENT)
+        if SQL_STATEMENT_TIMEOUT_MS:
+            cur.execute(timeout_statement())
+        if not SQL_GUARD_ENABLED or not _needs_plan_check(sql):
+            return sql
+        cur.execute(explain_sql(sql))
+        cost, rows = plan_estimate(cur.fetchone()[0])
+        if limit_rows and _needs_limit(cost, rows):
+            sql = limited_sql(sql, SQL_GUARD_MAX_ROWS)
+            logger.warning("Planner estimates {:.0f} rows; limiting the query to {}.".format(rows, SQL_GUARD_MAX_ROWS))
+            cur.execute(explain_sql(sql))
+            cost, rows = plan_estimate(cur.fetchone()[0])
+        _check_cost(sql, cost, rows)
+    return sql
+
+
+async def guard_sql_async(conn, sql, limit_rows=True):
+    """Async counterpart of guard_sql for an asyncpg connection inside a transaction."""
+    check_static(sql)
+    if SQL_GUARD_READ_ONLY:
+        await conn.execute(READ_ONLY_STATEMENT)
+    if SQL_STATEMENT_TIMEOUT_MS:
+        await conn.execute(timeout_statement())
+    if not SQL_GUARD_ENABLED or not _needs_plan_check(sql):
+        return sql
+    cost, rows = plan_estimate(await conn.fetchval(explain_sql(sql)))
+    if limit_rows and _needs_limit(cost, rows):
+        sql = limited_sql(sql, SQL_GUARD_MAX_ROWS)
+        logger.warning("Planner estimates {:.0f} rows; limiting the query to {}.".format(rows, SQL_GUARD_MAX_ROWS))
+        cost, rows = plan_estimate(await conn.fetchval(explain_sql(sql)))
+    _check_cost(sql, cost, rows)
+    return sql
@@ -0,0 +1,233 @@
+"""
+Repair loop for generated SQL that fails.
+
+When a query fails with a database error (or is turned down by sql_guard),
+the failing SQL and the error are sent back to the model for a corrected
+query, instead of returning the error and having the user ask again. The
+loop is capped at SQL_REPAIR_MAX_ATTEMPTS model calls and a total wall-clock
+budget of SQL_REPAIR_BUDGET_SECONDS.
+
+Every fix that ends in a working query is remembered under the failing SQL
+and its error, so the same failure is repaired locally next time without a
+model call.
+
+The run callable decides how much is tried: for streamed responses it only
+runs sql_guard's static checks and EXPLAIN; otherwise it executes the query,
+whose guard still runs EXPLAIN before anything is executed.
+
+Configuration (environment variables):
+    SQL_REPAIR_ENABLED            set to 0 to disable repairs (default 1)
+    SQL_REPAIR_MAX_ATTEMPTS       model calls per query (default 2)
+    SQL_REPAIR_BUDGET_SECONDS     wall-clock budget for a query's repairs (default 20)
+    SQL_REPAIR_CACHE_MAX_ENTRIES  known fixes kept (default 500)
+"""
+import os
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import sql_utils
+from sql_guard import SqlRejected
+
+logger = logging.getLogger(__name__)
+
+# SQLSTATE classes that no rewrite of the query can fix: connection problems,
+# insufficient resources, operator intervention (includes statement_timeout), system errors
+_UNREPAIRABLE_CLASSES = {"08", "53", "57", "58", "XX"}
+
+# Returned by _RepairState.failed when the model should be asked for a fix
+_ASK_MODEL = object()
+
+
+def sqlstate(error):
+    """SQLSTATE of a psycopg2 or asyncpg error, or None."""
+    return getattr(error, "pgcode", None) or getattr(error, "sqlstate", None)
+
+
+def is_repairable(error):
+    """True for errors caused by the query text: SQL errors from the server or a guard rejection."""
+    if isinstance(error, SqlRejected):
+        return True
+    code = sqlstate(error)
+    return bool(code) and code[:2] not in _UNREPAIRABLE_CLASSES
+
+
+def error_message(error):
+    """Error text for the model: the server message with its LINE/HINT details."""
+    return str(error).strip()
+
+
+def error_signature(error):
+    """Stable key for a failure: SQLSTATE and the first line of the message."""
+    first_line = error_message(error).splitlines()[0] if error_message(error) else ""
+    return "{}:{}".format(sqlstate(error) or type(error).__name__, re.sub(r"\s+", " ", first_line))
+
+
+class RepairCache:
+    """LRU of known fixes keyed by canonical failing SQL and error signature."""
+
+    def __init__(self, max_entries=500):
+        self.max_entries = max_entries
+        self._fixes = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.repairs = 0
+        self.failures = 0
+
+    @staticmethod
+    def key(sql, signature):
+        return (sql_utils.canonicalize(sql), signature)
+
+    def get(self, sql, signature):
+        key = self.key(sql, signature)
+        with self._lock:
+            fixed = self._fixes.get(key)
+            if fixed is None:
+                self.misses += 1
+                return None
+            self._fixes.move_to_end(key)
+            self.hits += 1
+            return fixed
+
+    def put(self, sql, signature, fixed):
+        key = self.key(sql, signature)
+        with self._lock:
+            self._fixes[key] = fixed
+            self._fixes.move_to_end(key)
+            while len(self._fixes) > self.max_entries:
+                self._fixes.popitem(last=False)
+
+    def record(self, repaired):
+        with self._lock:
+            if repaired:
+                self.repairs += 1
+            else:
+                self.failures += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._fixes),
+                "hits": self.hits,
+                "misses": self.misses,
+                "repaired_queries": self.repairs,
+                "unrepaired_queries": self.failures,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_repair_cache():
+    """Process-wide cache of known fixes; None when repairs are disabled."""
+    global _cache
+    if os.getenv("SQL_REPAIR_ENABLED", "1") == "0":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = RepairCache(max_entries=int(os.getenv("SQL_REPAIR_CACHE_MAX_ENTRIES", "500")))
+        return _cache
+
+
+class _RepairState:
+    """Bookkeeping of one query's repair loop."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.max_attempts = int(os.getenv("SQL_REPAIR_MAX_ATTEMPTS", "2"))
+        self.deadline = time.monotonic() + float(os.getenv("SQL_REPAIR_BUDGET_SECONDS", "20"))
+        self.attempts = 0
+        self.tried = set()
+        self.failures = []
+
+    def failed(self, sql, error):
+        """
+        Note a failure; returns a known fix to try, _ASK_MODEL to ask the
+        model, or None to give up.
+        """
+        if not is_repairable(error):
+            return None
+        signature = error_signature(error)
+        self.failures.append((sql, signature))
+        self.tried.add(sql_utils.canonicalize(sql))
+        fixed = self.cache.get(sql, signature)
+        if fixed is not None and sql_utils.canonicalize(fixed) not in self.tried:
+            logger.info("Applying a known fix for: {}".format(signature))
+            return fixed
+        if self.attempts >= self.max_attempts or time.monotonic() >= self.deadline:
+            return None
+        self.attempts += 1
+        logger.info("Asking the model to repair the query (attempt {}): {}".format(self.attempts, signature))
+        return _ASK_MODEL
+
+    def accept(self, fixed):
+        """True if the model's fix is new and worth running."""
+        return bool(fixed) and sql_utils.canonicalize(fixed) not in self.tried
+
+    def succeeded(self, sql):
+        for failed_sql, signature in self.failures:
+            self.cache.put(failed_sql, signature, sql)
+        if self.failures:
+            self.cache.record(True)
+            logger.info("Repaired query after {} failures: {}".format(len(self.failures), sql))
+
+    def gave_up(self):
+        if self.failures:
+            self.cache.record(False)
+
+
+def run_with_repair(question, sql, run, fix):
+    """
+    run(sql) until it succeeds, repairing the SQL after each failure with a
+    known fix or fix(question, sql, error_text) (a model call that returns
+    new SQL or None). Returns (final_sql, run's result); raises the last
+    error when the query cannot be repaired.
+    """
+    cache = get_repair_cache()
+    if cache is None:
+        return sql, run(sql)
+    state = _RepairState(cache)
+    while True:
+        try:
+            result = run(sql)
+        except Exception as e:
+            action = state.failed(sql, e)
+            if action is _ASK_MODEL:
+                fixed = fix(question, sql, error_message(e))
+                action = fixed if state.accept(fixed) else None
+            if action is None:
+                state.gave_up()
+                raise
+            sql = action
+            continue
+        state.succeeded(sql)
+        return sql, result
+
+
+async def run_with_repair_async(question, sql, run, fix):
+    """Async counterpart of run_with_repair; run and fix are coroutine functions."""
+    cache = get_repair_cache()
+    if cache is None:
+        return sql, await run(sql)
+    state = _RepairState(cache)
+    while True:
+        try:
+            result = await run(sql)
+        except Exception as e:
+            action = state.failed(sql, e)
+            if action is _ASK_MODEL:
+                fixed = await fix(question, sql, error_message(e))
+                action = fixed if state.accept(fixed) else None
+            if action is None:
+                state.gave_up()
+                raise
+            sql = action
+            continue
+        state.succeeded(sql)
+        return sql, result
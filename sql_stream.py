@@ -0,0 +1,194 @@
+"""
+Early SQL extraction from a streamed generate_sql tool call.
+
+The model streams the tool input as partial JSON deltas. SqlInputWatcher
+scans them as they arrive and returns the sql_query value as soon as its
+closing quote is seen, so the caller can validate and execute the SQL while
+the rest of the message (closing braces, trailing explanation text, usage)
+is still being streamed. The remainder of the stream is drained in the
+background and its text logged.
+"""
+import re
+import json
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+
+from tracing import first_token, first_token_async
+
+logger = logging.getLogger(__name__)
+
+SQL_TOOL_NAME = "generate_sql"
+
+_SQL_KEY = re.compile(r'"sql_query"\s*:\s*"')
+
+
+class SqlInputWatcher:
+    """Accumulates partial JSON of the tool input and spots the end of the sql_query string."""
+
+    def __init__(self):
+        self._buffer = ""
+        self._start = None
+        self._pos = 0
+        self._escaped = False
+        self.sql = None
+
+    def feed(self, partial_json):
+        """Add a delta; returns the SQL once the sql_query string is complete, otherwise None."""
+        if self.sql is not None:
+            return self.sql
+        self._buffer += partial_json
+        if self._start is None:
+            match = _SQL_KEY.search(self._buffer)
+            if match is None:
+                return None
+            self._start = self._pos = match.end()
+        buffer = self._buffer
+        for i in range(self._pos, len(buffer)):
+            ch = buffer[i]
+            if self._escaped:
+                self._escaped = False
+            elif ch == "\\":
+                self._escaped = True
+            elif ch == '"':
+                self.sql = json.loads(buffer[self._start - 1:i + 1])
+                return self.sql
+        self._pos = len(buffer)
+        return None
+
+
+def _handle_event(event, state):
+    """Update state from one stream event; returns the SQL when it became complete."""
+    if event.type == "content_block_start":
+        block = event.content_block
+        state["in_sql_tool"] = block.type == "tool_use" and block.name == SQL_TOOL_NAME
+        if block.type == "text" and block.text:
+            state["text"].append(block.text)
+    elif event.type == "content_block_delta":
+        if event.delta.type == "text_delta":
+            state["text"].append(event.delta.text)
+        elif event.delta.type == "input_json_delta" and state["in_sql_tool"]:
+            return state["watcher"].feed(event.delta.partial_json)
+    elif event.type == "content_block_stop" and state["in_sql_tool"]:
+        state["in_sql_tool"] = False
+        # A complete tool call whose input has no sql_query string
+        if state["watcher"].sql is None:
+            return ""
+    return None
+
+
+def _new_state():
+    return {"watcher": SqlInputWatcher(), "in_sql_tool": False, "text": []}
+
+
+def read_until_sql(stream, on_text=None):
+    """
+    Consume stream events until the generate_sql input holds a complete
+    sql_query. Returns (sql_query, text so far), or (None, full text) if the
+    model answered without calling the tool. on_text, if given, receives each
+    text fragment as it arrives.
+    """
+    state = _new_state()
+    for event in stream:
+        seen = len(state["text"])
+        sql_query = _handle_event(event, state)
+        if on_text:
+            for fragment in state["text"][seen:]:
+                on_text(fragment)
+        if sql_query is not None:
+            return sql_query, "".join(state["text"]).strip()
+    return None, "".join(state["text"]).strip()
+
+
+async def read_until_sql_async(stream, on_text=None):
+    """Async counterpart of read_until_sql for AsyncAnthropic streams; on_text is a coroutine function."""
+    state = _new_state()
+    async for event in stream:
+        seen = len(state["text"])
+        sql_query = _handle_event(event, state)
+        if on_text:
+            for fragment in state["text"][seen:]:
+                await on_text(fragment)
+        if sql_query is not None:
+            return sql_query, "".join(state["text"]).strip()
+    return None, "".join(state["text"]).strip()
+
+
+def _trailing_text(event):
+    if event.type == "content_block_delta" and event.delta.type == "text_delta":
+        return event.delta.text
+    return ""
+
+
+def _drain(stream_manager, stream, on_message):
+    try:
+        trailing = "".join(_trailing_text(event) for event in stream).strip()
+        if trailing:
+            logger.info("Model text after the SQL: {}".format(trailing))
+        if on_message:
+            on_message(stream.get_final_message())
+    except Exception as e:
+        logger.warning("Error draining the SQL generation stream: {}".format(str(e)))
+    finally:
+        stream_manager.__exit__(None, None, None)
+
+
+def stream_sql_generation(stream_manager, on_message=None, on_text=None, stage="SQL"):
+    """
+    Run a streamed SQL generation request (a client.messages.stream(...)
+    manager) and return (sql_query, text) as soon as the SQL is complete.
+    The rest of the message is drained on a background thread; on_message
+    receives the final message either way. If on_text raises, the upstream
+    stream is closed and the exception propagates. The time to first token
+    is recorded under stage.
+    """
+    started = time.perf_counter()
+    stream = stream_manager.__enter__()
+    try:
+        sql_query, text = read_until_sql(first_token(stage, stream, started), on_text)
+    except BaseException:
+        stream_manager.__exit__(None, None, None)
+        raise
+    if sql_query is None:
+        _drain(stream_manager, stream, on_message)
+    else:
+        threading.Thread(target=contextvars.copy_context().run,
+                         args=(_drain, stream_manager, stream, on_message), daemon=True).start()
+    return sql_query, text
+
+
+async def _drain_async(stream_manager, stream, on_message):
+    try:
+        trailing = "".join([_trailing_text(event) async for event in stream]).strip()
+        if trailing:
+            logger.info("Model text after the SQL: {}".format(trailing))
+        if on_message:
+            on_message(await stream.get_final_message())
+    except Exception as e:
+        logger.warning("Error draining the SQL generation stream: {}".format(str(e)))
+    finally:
+        await stream_manager.__aexit__(None, None, None)
+
+
+# Drain tasks still running, referenced so they are not garbage collected
+_drain_tasks = set()
+
+
+async def stream_sql_generation_async(stream_manager, on_message=None, on_text=None, stage="SQL"):
+    """Async counterpart of stream_sql_generation for AsyncAnthropic; drains in a task."""
+    started = time.perf_counter()
+    stream = await stream_manager.__aenter__()
+    try:
+        sql_query, text = await read_until_sql_async(first_token_async(stage, stream, started), on_text)
+    except BaseException:
+        await stream_manager.__aexit__(None, None, None)
+        raise
+    if sql_query is None:
+        await _drain_async(stream_manager, stream, on_message)
+    else:
+        task = asyncio.create_task(_drain_async(stream_manager, stream, on_message))
+        _drain_tasks.add(task)
+        task.add_done_callback(_drain_tasks.discard)
+    return sql_query, text
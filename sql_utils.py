@@ -0,0 +1,329 @@
+"""
+Lightweight SQL text helpers: tokenizing, canonicalising and finding the
+tables a statement reads from or writes to.
+
+This is not a full SQL parser. It understands enough PostgreSQL lexical
+structure (quoted identifiers, string and dollar-quoted literals, comments)
+to produce a stable cache key and a conservative table list.
+"""
+import re
+
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<line_comment>--[^\n]*)
+  | (?P<block_comment>/\*.*?\*/)
+  | (?P<string>[eE]?'(?:[^']|'')*')
+  | (?P<dollar>\$(?P<tag>[A-Za-z_]*)\$.*?\$(?P=tag)\$)
+  | (?P<quoted_ident>"(?:[^"]|"")*")
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+)
+  | (?P<param>\$\d+|%\(\w+\)s|%s)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<op>::|<=|>=|<>|!=|\|\||->>|->|[^\s])
+""", re.VERBOSE | re.DOTALL)
+
+# Statements whose first keyword means they only read data
+READ_KEYWORDS = {"select", "with", "values", "table", "show", "explain"}
+
+# Keywords that modify data or schema
+WRITE_KEYWORDS = {"insert", "update", "delete", "merge", "truncate", "drop", "alter", "create",
+                  "grant", "revoke", "comment", "copy", "vacuum", "analyze", "reindex", "cluster",
+                  "refresh", "lock", "call", "do", "set", "reset", "discard", "prepare", "execute"}
+
+# Functions whose result changes between executions of the same text
+VOLATILE_FUNCTIONS = {"now", "random", "clock_timestamp", "statement_timestamp", "transaction_timestamp",
+                      "timeofday", "nextval", "setval", "currval", "gen_random_uuid", "uuid_generate_v4",
+                      "setseed", "pg_sleep"}
+VOLATILE_KEYWORDS = {"current_date", "current_time", "current_timestamp", "localtime", "localtimestamp"}
+
+
+class Token:
+    __slots__ = ("kind", "text")
+
+    def __init__(self, kind, text):
+        self.kind = kind
+        self.text = text
+
+    @property
+    def value(self):
+        """Lowercased keyword/identifier text, unquoted for quoted identifiers."""
+        if self.kind == "quoted_ident":
+            return self.text[1:-1].replace('""', '"')
+        if self.kind == "word":
+            return self.text.lower()
+        return self.text
+
+    def __repr__(self):
+        return "Token({}, {!r})".format(self.kind, self.text)
+
+
+def tokenize(sql):
+    """Split SQL into tokens, dropping whitespace and comments."""
+    tokens = []
+    for match in _TOKEN_RE.finditer(sql):
+        kind = match.lastgroup
+        if kind == "tag":
+            kind = "dollar"
+        if kind in ("ws", "line_comment", "block_comment"):
+            continue
+        tokens.append(Token(kind, match.group(0)))
+    return tokens
+
+
+def canonicalize(sql):
+    """
+    Canonical form of a statement: comments dropped, whitespace collapsed,
+    keywords and unquoted identifiers lowercased, trailing semicolons removed.
+    Literals and quoted identifiers are kept verbatim.
+    """
+    tokens = tokenize(sql)
+    while tokens and tokens[-1].text == ";":
+        tokens.pop()
+    return " ".join(t.text.lower() if t.kind == "word" else t.text for t in tokens)
+
+
+def split_statements(sql):
+    """Token lists for each ;-separated statement (empty statements dropped)."""
+    statements, current = [], []
+    for token in tokenize(sql):
+        if token.kind == "op" and token.text == ";":
+            if current:
+                statements.append(current)
+            current = []
+        else:
+            current.append(token)
+    if current:
+        statements.append(current)
+    return statements
+
+
+def has_top_level_order_by(sql):
+    """True if the statement orders its own result (an ORDER BY outside any parentheses)."""
+    depth = 0
+    previous = None
+    for token in tokenize(sql):
+        if token.text == "(":
+            depth += 1
+        elif token.text == ")":
+            depth -= 1
+        elif depth == 0 and token.kind == "word":
+            if previous == "order" and token.value == "by":
+                return True
+            previous = token.value
+    return False
+
+
+def first_keyword(sql):
+    for token in tokenize(sql):
+        if token.kind == "word":
+            return token.value
+        if token.text != "(":
+            return None
+    return None
+
+
+def _explained_statement(tokens):
+    """Tokens of the statement an EXPLAIN runs or plans, after its options."""
+    i = 1
+    if i < len(tokens) and tokens[i].text == "(":
+        depth = 0
+        while i < len(tokens):
+            depth += tokens[i].text == "("
+            depth -= tokens[i].text == ")"
+            i += 1
+            if depth == 0:
+                break
+    while i < len(tokens) and tokens[i].kind == "word" and tokens[i].value in ("analyze", "analyse", "verbose"):
+        i += 1
+    return tokens[i:]
+
+
+def _is_read_only(tokens):
+    first = next((t for t in tokens if t.text != "("), None)
+    if first is None or first.kind != "word" or first.value not in READ_KEYWORDS:
+        return False
+    if first.value == "explain":
+        # EXPLAIN ANALYZE runs the statement, and EXPLAIN of a write is no read either
+        return _is_read_only(_explained_statement(tokens))
+    words = [t.value for t in tokens if t.kind == "word"]
+    if any(w in ("insert", "update", "delete", "merge", "truncate") for w in words):
+        return False
+    # SELECT ... INTO creates a table; FOR UPDATE/SHARE takes row locks
+    if "into" in words and first.value == "select":
+        return False
+    for i, w in enumerate(words[:-1]):
+        if w == "for" and words[i + 1] in ("update", "share", "no"):
+            return False
+    return True
+
+
+def is_read_only(sql):
+    """True for a single statement that can only read data."""
+    statements = split_statements(sql)
+    return len(statements) == 1 and _is_read_only(statements[0])
+
+
+def is_deterministic(sql):
+    """False if the statement calls volatile functions like now() or random()."""
+    tokens = tokenize(sql)
+    for i, token in enumerate(tokens):
+        if token.kind != "word":
+            continue
+        if token.value in VOLATILE_KEYWORDS:
+            return False
+        if token.value in VOLATILE_FUNCTIONS and i + 1 < len(tokens) and tokens[i + 1].text == "(":
+            return False
+    return True
+
+
+def _read_name(tokens, i, column_list=False):
+    """
+    Read a possibly schema-qualified name starting at tokens[i]; returns (name, next_index).
+    With column_list, a following parenthesis is the column list of INSERT INTO t (...).
+    """
+    if i >= len(tokens) or tokens[i].kind not in ("word", "quoted_ident"):
+        return None, i
+    parts = [tokens[i].value]
+    i += 1
+    while i + 1 < len(tokens) and tokens[i].text == "." and tokens[i + 1].kind in ("word", "quoted_ident"):
+        parts.append(tokens[i + 1].value)
+        i += 2
+    if i < len(tokens) and tokens[i].text == "(" and not column_list:
+        # A function call such as generate_series(...), not a table
+        return None, i
+    return parts[-1], i
+
+
+_ALIAS_STOP = {"where", "join", "inner", "left", "right", "full", "cross", "natural", "on", "using",
+               "group", "order", "having", "limit", "offset", "union", "intersect", "except",
+               "window", "for", "fetch", "returning", "set", "values", "lateral", "tablesample",
+               "select", "with", "default", "overriding"}
+
+
+# Functions that use FROM inside their argument list
+_FROM_FUNCTIONS = {"extract", "substring", "trim", "overlay", "position"}
+
+# Keywords that close a FROM list, so later commas are not table separators
+_FROM_LIST_END = {"where", "group", "order", "having", "limit", "offset", "union", "intersect",
+                  "except", "window", "fetch", "returning", "set", "values", "select"}
+
+# Words that may sit between FROM/TABLE/... and the table name
+_NAME_MODIFIERS = {"only", "lateral", "table", "if", "not", "exists"}
+
+
+def table_references(sql):
+    """
+    (table, alias) pairs for every table named in FROM/JOIN/UPDATE/INTO/TABLE
+    clauses. CTE names are excluded. Table names are lowercased and unqualified.
+    """
+    tokens = tokenize(sql)
+    cte_names = set()
+    for i, token in enumerate(tokens):
+        if token.kind in ("word", "quoted_ident") and i + 2 < len(tokens):
+            prev = tokens[i - 1].value if i > 0 else None
+            if prev in ("with", "recursive", ",") and tokens[i + 1].value == "as" and tokens[i + 2].text == "(":
+                cte_names.add(token.value.lower())
+            elif prev in ("with", "recursive", ",") and tokens[i + 1].text == "(":
+                # WITH name (col, ...) AS (...)
+                depth, j = 0, i + 1
+                while j < len(tokens):
+                    depth += tokens[j].text == "("
+                    depth -= tokens[j].text == ")"
+                    j += 1
+                    if depth == 0:
+                        break
+                if j + 1 < len(tokens) and tokens[j].value == "as":
+                    cte_names.add(token.value.lower())
+
+    refs = []
+    parens = []          # word before each open parenthesis, to spot EXTRACT(x FROM y) and friends
+    from_lists = set()   # parenthesis depths at which a FROM list is open
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        depth = len(parens)
+        if token.text == "(":
+            parens.append(tokens[i - 1].value if i > 0 and tokens[i - 1].kind == "word" else None)
+            i += 1
+            continue
+        if token.text == ")":
+            from_lists.discard(depth)
+            if parens:
+                parens.pop()
+            i += 1
+            continue
+
+        keyword = token.value if token.kind == "word" else None
+        if keyword == "from" and ((parens and parens[-1] in _FROM_FUNCTIONS)
+                                  or (i > 0 and tokens[i - 1].value == "distinct")):
+            keyword = None
+        if keyword in _FROM_LIST_END:
+            from_lists.discard(depth)
+
+        if keyword in ("from", "join", "update", "into", "table", "truncate") or (
+                token.text == "," and depth in from_lists):
+            if keyword == "from":
+                from_lists.add(depth)
+            i += 1
+            while i < len(tokens) and tokens[i].kind == "word" and tokens[i].value in _NAME_MODIFIERS:
+                i += 1
+            name, i = _read_name(tokens, i, column_list=keyword == "into")
+            if name is None:
+                continue
+            alias = None
+            if i < len(tokens) and tokens[i].kind == "word" and tokens[i].value == "as":
+                i += 1
+            if (i < len(tokens) and tokens[i].kind in ("word", "quoted_ident")
+                    and tokens[i].value not in _ALIAS_STOP):
+                alias = tokens[i].value.lower()
+                i += 1
+            if name.lower() not in cte_names:
+                refs.append((name.lower(), alias))
+            continue
+        i += 1
+    return refs
+
+
+def referenced_tables(sql):
+    """Set of tables a statement touches."""
+    return {name for name, _ in table_references(sql)}
+
+
+def written_tables(sql):
+    """
+    Tables a data-modifying statement writes to, or None when they cannot be
+    determined (DO blocks, function calls, DDL on unknown objects...).
+    """
+    written = set()
+    for tokens in split_statements(sql):
+        words = [t for t in tokens if t.kind in ("word", "quoted_ident")]
+        if not words:
+            continue
+        first = words[0].value
+        if first in READ_KEYWORDS and first != "with":
+            continue
+        statement_sql = " ".join(t.text for t in tokens)
+        refs = table_references(statement_sql)
+        if first == "with":
+            if not any(w.value in ("insert", "update", "delete", "merge") for w in words):
+                continue
+        elif first not in ("insert", "update", "delete", "truncate", "alter", "drop", "create"):
+            return None
+        if first in ("alter", "drop", "create"):
+            kinds = [w.value for w in words[1:4]]
+            if "table" not in kinds:
+                return None
+            idx = next(i for i, t in enumerate(tokens) if t.kind == "word" and t.value == "table")
+            j = idx + 1
+            while j < len(tokens) and tokens[j].kind == "word" and tokens[j].value in ("if", "not", "exists", "only"):
+                j += 1
+            name, _ = _read_name(tokens, j)
+            if name is None:
+                return None
+            written.add(name.lower())
+            continue
+        if not refs:
+            return None
+        # The write target is the first table named after INSERT INTO/UPDATE/DELETE FROM/TRUNCATE;
+        # other tables in the statement are only read, but evicting them too is harmless.
+        written.update(name for name, _ in refs)
+    return written
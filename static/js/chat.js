@@ -108,11 +108,41 @@ document.addEventListener('DOMContentLoaded', function() {
                 throw new Error(`Server responded with ${response.status}: ${response.statusText}`);
             }
             
-            // Get reader from response body stream
+            // Read the server-sent events from the response body stream
             const reader = response.body.getReader();
             const decoder = new TextDecoder();
+            let buffered = '';
+            let sqlText = '';
             let receivedText = '';
             
+            // Render the SQL (if any) followed by the text received so far
+            function render() {
+                botMessageContent.innerHTML = marked.parse(sqlText + receivedText);
+                chatMessages.scrollTop = chatMessages.scrollHeight;
+            }
+            
+            // Handle one "event: ...\ndata: ..." frame; heartbeat comments are ignored
+            function handleFrame(frame) {
+                let eventName = 'message';
+                let data = '';
+                frame.split('\n').forEach(line => {
+                    if (line.startsWith('event: ')) eventName = line.slice(7);
+                    else if (line.startsWith('data: ')) data += line.slice(6);
+                });
+                if (!data) return;
+                const payload = JSON.parse(data);
+                if (eventName === 'delta') {
+                    receivedText += payload.text;
+                } else if (eventName === 'sql') {
+                    sqlText = formatSQLResponse({ sql_query: payload.sql_query });
+                } else if (eventName === 'error') {
+                    receivedText += (receivedText ? '\n\n' : '') + payload.message;
+                } else {
+                    return;
+                }
+                render();
+            }
+            
             // Function to read stream
             function readStream() {
                 return reader.read().then(({ done, value }) => {
@@ -120,15 +150,11 @@ document.addEventListener('DOMContentLoaded', function() {
                         return;
                     }
                     
-                    // Decode the chunk
-                    const chunk = decoder.decode(value, { stream: true });
-                    receivedText += chunk;
-                    
-                    // Update bot message with current accumulated text
-                    botMessageContent.innerHTML = marked.parse(receivedText);
-                    
-                    // Scroll to bottom
-                    chatMessages.scrollTop = chatMessages.scrollHeight;
+                    // Split the decoded chunk into complete frames
+                    buffered += decoder.decode(value, { stream: true });
+                    const frames = buffered.split('\n\n');
+                    buffered = frames.pop();
+                    frames.forEach(handleFrame);
                     
                     // Continue reading
                     return readStream();
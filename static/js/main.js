@@ -37,6 +37,36 @@ function createPieChart(canvas, data) {
     console.warn("createPieChart is deprecated - all visualizations are now handled by Claude");
 }
 
+// Read an NDJSON (newline-delimited JSON) response body, calling onMessage
+// for each parsed line as soon as it arrives
+async function readNdjson(response, onMessage) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+        
+        let newlineIndex;
+        while ((newlineIndex = buffer.indexOf('\n')) >= 0) {
+            const line = buffer.slice(0, newlineIndex).trim();
+            buffer = buffer.slice(newlineIndex + 1);
+            if (line) {
+                onMessage(JSON.parse(line));
+            }
+        }
+    }
+    
+    buffer += decoder.decode();
+    if (buffer.trim()) {
+        onMessage(JSON.parse(buffer));
+    }
+}
+
 // Event listeners for modal interactions
 document.addEventListener('DOMContentLoaded', function() {
     // Get DOM elements
@@ -46,6 +76,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const chartModal = document.getElementById('chart-modal');
     const closeBtn = document.querySelector('.close-btn');
     const loadingSpinner = document.querySelector('.loading-spinner');
+    const pipelineToggle = document.getElementById('pipeline-toggle');
 
     // Initialize event listeners
     if (queryForm) {
@@ -92,7 +123,12 @@ document.addEventListener('DOMContentLoaded', function() {
                     'Content-Type': 'application/json',
                 },
                 body: JSON.stringify({
-                    question: question
+                    question: question,
+                    stream: true,
+                    // Unstreamed results come as one array per column
+                    format: 'columnar',
+                    // Ask for analysis and chart in the same response
+                    pipeline: Boolean(pipelineToggle && pipelineToggle.checked)
                 }),
             });
             
@@ -100,6 +136,14 @@ document.addEventListener('DOMContentLoaded', function() {
                 throw new Error('Network response was not ok');
             }
             
+            // SELECT results are streamed as NDJSON; everything else is a single JSON document
+            const contentType = response.headers.get('Content-Type') || '';
+            if (contentType.includes('application/x-ndjson')) {
+                thinkingIndicator.remove();
+                await displayStreamingResponse(response);
+                return;
+            }
+            
             const data = await response.json();
             
             // Remove thinking indicator
@@ -170,6 +214,206 @@ document.addEventListener('DOMContentLoaded', function() {
         chatMessages.scrollTop = chatMessages.scrollHeight;
     }
     
+    // Add an error message with error styling
+    function addErrorMessage(text) {
+        const errorDiv = document.createElement('div');
+        errorDiv.className = 'message bot-message error-message';
+        
+        const errorContent = document.createElement('div');
+        errorContent.className = 'message-content';
+        
+        const errorParagraph = document.createElement('p');
+        errorParagraph.textContent = text;
+        errorParagraph.style.color = '#d32f2f';
+        
+        errorContent.appendChild(errorParagraph);
+        errorDiv.appendChild(errorContent);
+        chatMessages.appendChild(errorDiv);
+        return errorDiv;
+    }
+    
+    // Add the generated SQL as a code message
+    function addSqlMessage(sqlQuery) {
+        const sqlDiv = document.createElement('div');
+        sqlDiv.className = 'message bot-message sql-message';
+        
+        const sqlContent = document.createElement('div');
+        sqlContent.className = 'message-content';
+        
+        const sqlPre = document.createElement('pre');
+        sqlPre.textContent = sqlQuery;
+        
+        sqlContent.appendChild(sqlPre);
+        sqlDiv.appendChild(sqlContent);
+        chatMessages.appendChild(sqlDiv);
+        return sqlDiv;
+    }
+    
+    // Add a note that the query returned no rows
+    function addEmptyResultsMessage() {
+        const emptyDiv = document.createElement('div');
+        emptyDiv.className = 'message bot-message';
+        
+        const emptyContent = document.createElement('div');
+        emptyContent.className = 'message-content';
+        
+        const emptyParagraph = document.createElement('p');
+        emptyParagraph.innerHTML = '<i class="fas fa-info-circle"></i> The query executed successfully but returned no results.';
+        emptyParagraph.style.color = '#ff9800';
+        
+        emptyContent.appendChild(emptyParagraph);
+        emptyDiv.appendChild(emptyContent);
+        chatMessages.appendChild(emptyDiv);
+        return emptyDiv;
+    }
+    
+    // Create a results message with a table that rows can be appended to
+    function createResultsMessage(columns) {
+        const resultsDiv = document.createElement('div');
+        resultsDiv.className = 'message bot-message results-message';
+        
+        const resultsContent = document.createElement('div');
+        resultsContent.className = 'message-content';
+        
+        // Add results header
+        const resultsHeader = document.createElement('div');
+        resultsHeader.className = 'results-header';
+        resultsHeader.textContent = 'Query Results (0 rows)';
+        resultsContent.appendChild(resultsHeader);
+        
+        // Add results body
+        const resultsBody = document.createElement('div');
+        resultsBody.className = 'results-body';
+        
+        // Create table container
+        const tableContainer = document.createElement('div');
+        tableContainer.className = 'table-container';
+        
+        const table = createTable(columns);
+        tableContainer.appendChild(table.element);
+        resultsBody.appendChild(tableContainer);
+        
+        resultsContent.appendChild(resultsBody);
+        resultsDiv.appendChild(resultsContent);
+        chatMessages.appendChild(resultsDiv);
+        
+        return {
+            element: resultsDiv,
+            body: resultsBody,
+            // rows are arrays of values in column order
+            appendRows: function(rows) {
+                table.appendRows(rows);
+                resultsHeader.textContent = `Query Results (${table.rowCount()} rows)`;
+            },
+            // Offer a scrollable view of every row of a stored result, read page by page
+            enableBrowsing: function(resultHandle, rowCount) {
+                if (!resultHandle || !(rowCount > table.displayLimit)) {
+                    return;
+                }
+                const browseBtn = document.createElement('button');
+                browseBtn.className = 'browse-btn';
+                browseBtn.innerHTML = `<i class="fas fa-table"></i> Browse all ${formatNumber(rowCount)} rows`;
+                browseBtn.addEventListener('click', () => {
+                    tableContainer.replaceChildren(createVirtualTable(resultHandle, columns, rowCount));
+                    tableContainer.classList.add('table-container-virtual');
+                    browseBtn.remove();
+                });
+                resultsBody.insertBefore(browseBtn, tableContainer.nextSibling);
+            }
+        };
+    }
+    
+    // Add the "Visualize Data" button under a results message; with a result
+    // handle the server reads the rows itself instead of us uploading them
+    function addVisualizeButton(resultsBody, data, resultHandle) {
+        const visualizeBtn = document.createElement('button');
+        visualizeBtn.className = 'visualize-btn';
+        visualizeBtn.innerHTML = '<i class="fas fa-chart-bar"></i> Visualize Data';
+        
+        // Add a pulse animation to draw attention
+        visualizeBtn.style.animation = 'pulse 2s infinite';
+        
+        // Add CSS for the pulse animation if not already in the stylesheet
+        if (!document.getElementById('pulse-animation-style')) {
+            const style = document.createElement('style');
+            style.id = 'pulse-animation-style';
+            style.textContent = `
+                @keyframes pulse {
+                    0% { box-shadow: 0 0 0 0 rgba(76, 175, 80, 0.4); }
+                    70% { box-shadow: 0 0 0 10px rgba(76, 175, 80, 0); }
+                    100% { box-shadow: 0 0 0 0 rgba(76, 175, 80, 0); }
+                }
+            `;
+            document.head.appendChild(style);
+        }
+        
+        // Enhanced click event with animation and logging
+        visualizeBtn.addEventListener('click', function() {
+            console.log("Visualize button clicked");
+            // Remove pulse animation when clicked
+            this.style.animation = 'none';
+            // Add a small visual feedback
+            this.classList.add('clicked');
+            // Call the visualization function
+            visualizeData(data, resultHandle);
+        });
+        
+        // Add button in a prominent container
+        const buttonContainer = document.createElement('div');
+        buttonContainer.className = 'button-container';
+        buttonContainer.style.textAlign = 'center';
+        buttonContainer.style.width = '100%';
+        buttonContainer.style.marginTop = '15px';
+        buttonContainer.appendChild(visualizeBtn);
+        
+        resultsBody.appendChild(buttonContainer);
+        
+        // Log that the button was added
+        console.log("Visualization button added to results");
+    }
+    
+    // Add "Download CSV" and "Download Parquet" links for a stored result under a results message
+    function addExportLink(resultsBody, resultHandle) {
+        [['csv', 'CSV'], ['parquet', 'Parquet']].forEach(([format, label]) => {
+            const exportLink = document.createElement('a');
+            exportLink.className = 'export-link';
+            exportLink.href = `/export/${resultHandle}.${format}`;
+            exportLink.innerHTML = `<i class="fas fa-download"></i> Download ${label}`;
+            resultsBody.appendChild(exportLink);
+        });
+    }
+    
+    // Add the analysis (and suggested follow-ups) of a result set
+    function addAnalysisMessage(message) {
+        let text = `Analysis:\n${message.analysis}`;
+        if (message.suggestions) {
+            text += `\n\nSuggestions:\n${message.suggestions}`;
+        }
+        return addMessage(text, 'bot');
+    }
+    
+    // Add a chart generated by the server as a chat message
+    function addVisualizationMessage(visualizationHtml) {
+        const chartDiv = document.createElement('div');
+        chartDiv.className = 'message bot-message visualization-message';
+        
+        const chartContent = document.createElement('div');
+        chartContent.className = 'message-content';
+        
+        const chartContainer = document.createElement('div');
+        chartContainer.className = 'chart-content';
+        
+        chartContent.appendChild(chartContainer);
+        chartDiv.appendChild(chartContent);
+        chatMessages.appendChild(chartDiv);
+        renderVisualization(chartContainer, visualizationHtml);
+        return chartDiv;
+    }
+    
+    // Rows kept in the page for the visualization button. Charts are made from
+    // the result handle; these rows are only sent when the server no longer has it.
+    const CHART_SAMPLE_ROWS = 1000;
+    
     // Display response from the server
     function displayResponse(data) {
         // Handle text message responses or error messages
@@ -177,19 +421,7 @@ document.addEventListener('DOMContentLoaded', function() {
             // Check if it's an error message
             if (data.has_error || data.no_sql) {
                 // Add error message with different styling
-                const errorDiv = document.createElement('div');
-                errorDiv.className = 'message bot-message error-message';
-                
-                const errorContent = document.createElement('div');
-                errorContent.className = 'message-content';
-                
-                const errorParagraph = document.createElement('p');
-                errorParagraph.textContent = data.message;
-                errorParagraph.style.color = '#d32f2f';
-                
-                errorContent.appendChild(errorParagraph);
-                errorDiv.appendChild(errorContent);
-                chatMessages.appendChild(errorDiv);
+                addErrorMessage(data.message);
             } else {
                 // Regular message
                 addMessage(data.message, 'bot');
@@ -201,122 +433,47 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // Always show the SQL query if available
         if (data.sql_query) {
-            // Add SQL code message
-            const sqlDiv = document.createElement('div');
-            sqlDiv.className = 'message bot-message sql-message';
-            
-            const sqlContent = document.createElement('div');
-            sqlContent.className = 'message-content';
-            
-            const sqlPre = document.createElement('pre');
-            sqlPre.textContent = data.sql_query;
-            
-            sqlContent.appendChild(sqlPre);
-            sqlDiv.appendChild(sqlContent);
-            chatMessages.appendChild(sqlDiv);
+            addSqlMessage(data.sql_query);
         }
         
         // Handle empty results specifically
         if (data.empty_results) {
-            const emptyDiv = document.createElement('div');
-            emptyDiv.className = 'message bot-message';
-            
-            const emptyContent = document.createElement('div');
-            emptyContent.className = 'message-content';
-            
-            const emptyParagraph = document.createElement('p');
-            emptyParagraph.innerHTML = '<i class="fas fa-info-circle"></i> The query executed successfully but returned no results.';
-            emptyParagraph.style.color = '#ff9800';
-            
-            emptyContent.appendChild(emptyParagraph);
-            emptyDiv.appendChild(emptyContent);
-            chatMessages.appendChild(emptyDiv);
-            
+            addEmptyResultsMessage();
             scrollToBottom();
             return;
         }
         
+        // Columnar results ({columns, data: one array per column}) or row objects
+        let columns = [];
+        let rows = [];
+        if (Array.isArray(data.columns) && Array.isArray(data.data)) {
+            columns = data.columns;
+            rows = columnarRows(data.data, data.row_count);
+        } else if (data.results && Array.isArray(data.results) && data.results.length > 0) {
+            columns = Object.keys(data.results[0]);
+            rows = data.results.map(row => columns.map(column => row[column]));
+        }
+        
         // Add results message if we have results
-        if (data.results && Array.isArray(data.results) && data.results.length > 0) {
-            // Create results message
-            const resultsDiv = document.createElement('div');
-            resultsDiv.className = 'message bot-message results-message';
+        if (rows.length > 0) {
+            const results = createResultsMessage(columns);
+            results.appendRows(rows);
             
-            const resultsContent = document.createElement('div');
-            resultsContent.className = 'message-content';
-            
-            // Add results header
-            const resultsHeader = document.createElement('div');
-            resultsHeader.className = 'results-header';
-            resultsHeader.textContent = `Query Results (${data.results.length} rows)`;
-            resultsContent.appendChild(resultsHeader);
-            
-            // Add results body
-            const resultsBody = document.createElement('div');
-            resultsBody.className = 'results-body';
-            
-            // Create table container
-            const tableContainer = document.createElement('div');
-            tableContainer.className = 'table-container';
-            
-            // Create table
-            const table = createTableFromData(data.results);
-            tableContainer.appendChild(table);
-            resultsBody.appendChild(tableContainer);
+            if (data.result_handle) {
+                results.enableBrowsing(data.result_handle, rows.length);
+                addExportLink(results.body, data.result_handle);
+            }
             
-            // Add visualization button if data is visualizable
-            if (canVisualize(data.results)) {
-                const visualizeBtn = document.createElement('button');
-                visualizeBtn.className = 'visualize-btn';
-                visualizeBtn.innerHTML = '<i class="fas fa-chart-bar"></i> Visualize Data';
-                
-                // Add a pulse animation to draw attention
-                visualizeBtn.style.animation = 'pulse 2s infinite';
-                
-                // Add CSS for the pulse animation if not already in the stylesheet
-                if (!document.getElementById('pulse-animation-style')) {
-                    const style = document.createElement('style');
-                    style.id = 'pulse-animation-style';
-                    style.textContent = `
-                        @keyframes pulse {
-                            0% { box-shadow: 0 0 0 0 rgba(76, 175, 80, 0.4); }
-                            70% { box-shadow: 0 0 0 10px rgba(76, 175, 80, 0); }
-                            100% { box-shadow: 0 0 0 0 rgba(76, 175, 80, 0); }
-                        }
-                    `;
-                    document.head.appendChild(style);
-                }
-                
-                // Enhanced click event with animation and logging
-                visualizeBtn.addEventListener('click', function() {
-                    console.log("Visualize button clicked");
-                    // Remove pulse animation when clicked
-                    this.style.animation = 'none';
-                    // Add a small visual feedback
-                    this.classList.add('clicked');
-                    // Call the visualization function
-                    visualizeData(data.results);
-                });
-                
-                // Add button in a prominent container
-                const buttonContainer = document.createElement('div');
-                buttonContainer.className = 'button-container';
-                buttonContainer.style.textAlign = 'center';
-                buttonContainer.style.width = '100%';
-                buttonContainer.style.marginTop = '15px';
-                buttonContainer.appendChild(visualizeBtn);
-                
-                resultsBody.appendChild(buttonContainer);
-                
-                // Log that the button was added
-                console.log("Visualization button added to results");
+            // Add visualization button if data is visualizable; keep only a sample,
+            // the server charts the whole result from its handle
+            const rowObjects = data.results
+                ? data.results.slice(0, CHART_SAMPLE_ROWS)
+                : rowsToObjects(columns, rows.slice(0, CHART_SAMPLE_ROWS));
+            if (canVisualize(rowObjects)) {
+                addVisualizeButton(results.body, rowObjects, data.result_handle);
             } else {
-                console.log("Data cannot be visualized:", data.results);
+                console.log("Data cannot be visualized:", rowObjects);
             }
-            
-            resultsContent.appendChild(resultsBody);
-            resultsDiv.appendChild(resultsContent);
-            chatMessages.appendChild(resultsDiv);
         } else if (!data.has_error && !data.empty_results) {
             // No results but not due to an error or empty results
             addMessage('No data was returned for this query.', 'bot');
@@ -326,16 +483,62 @@ document.addEventListener('DOMContentLoaded', function() {
         scrollToBottom();
     }
     
-    // Create table from data
-    function createTableFromData(data) {
+    // Display an NDJSON stream from /query, rendering row batches as they arrive
+    // (and, in pipeline mode, the analysis and chart as soon as each is ready)
+    async function displayStreamingResponse(response) {
+        let columns = [];
+        let results = null;
+        let visualized = false;
+        const rows = [];
+        
+        await readNdjson(response, message => {
+            if (message.type === 'meta') {
+                addSqlMessage(message.sql_query);
+                columns = message.columns;
+            } else if (message.type === 'rows') {
+                if (!results) {
+                    results = createResultsMessage(columns);
+                }
+                results.appendRows(message.rows);
+                // Keep the first rows for the visualization request; the table
+                // only renders a few and browsing reads pages by handle
+                const room = CHART_SAMPLE_ROWS - rows.length;
+                if (room > 0) {
+                    rowsToObjects(columns, message.rows.slice(0, room)).forEach(row => rows.push(row));
+                }
+            } else if (message.type === 'analysis') {
+                addAnalysisMessage(message);
+            } else if (message.type === 'visualization') {
+                addVisualizationMessage(message.visualization_html);
+                visualized = true;
+            } else if (message.type === 'end') {
+                if (!results) {
+                    addEmptyResultsMessage();
+                    return;
+                }
+                if (message.result_handle) {
+                    results.enableBrowsing(message.result_handle, message.row_count);
+                    addExportLink(results.body, message.result_handle);
+                }
+                if (!visualized && canVisualize(rows)) {
+                    addVisualizeButton(results.body, rows, message.result_handle);
+                }
+            } else if (message.type === 'error') {
+                addErrorMessage(message.message);
+            }
+            scrollToBottom();
+        });
+    }
+    
+    // Create a table for the given columns; rows are appended in batches
+    // and only the first displayLimit rows are rendered in the chat
+    function createTable(columns, displayLimit = 10) {
         const table = document.createElement('table');
         const thead = document.createElement('thead');
         const tbody = document.createElement('tbody');
         
         // Create table header
         const headerRow = document.createElement('tr');
-        const columns = Object.keys(data[0]);
-        
         columns.forEach(column => {
             const th = document.createElement('th');
             th.textContent = column;
@@ -344,44 +547,250 @@ document.addEventListener('DOMContentLoaded', function() {
         
         thead.appendChild(headerRow);
         table.appendChild(thead);
+        table.appendChild(tbody);
         
-        // Create table rows (limit to 10 rows for display in chat)
-        const displayLimit = Math.min(data.length, 10);
-        
-        for (let i = 0; i < displayLimit; i++) {
-            const row = document.createElement('tr');
-            
-            columns.forEach(column => {
-                const td = document.createElement('td');
-                const value = data[i][column];
+        // Limited data note, shown once there are more rows than displayed
+        const note = document.createElement('caption');
+        note.style.captionSide = 'bottom';
+        
+        let rowCount = 0;
+        
+        return {
+            element: table,
+            displayLimit: displayLimit,
+            rowCount: () => rowCount,
+            appendRows: function(rows) {
+                rows.forEach(values => {
+                    if (rowCount < displayLimit) {
+                        const row = document.createElement('tr');
+                        values.forEach(value => row.appendChild(createCell(value)));
+                        tbody.appendChild(row);
+                    }
+                    rowCount++;
+                });
                 
-                // Format value based on type
-                if (value === null) {
-                    td.textContent = 'NULL';
-                    td.style.color = '#999';
-                } else if (typeof value === 'number') {
-                    td.textContent = formatNumber(value);
-                } else {
-                    td.textContent = value;
+                if (rowCount > displayLimit) {
+                    note.textContent = `Showing ${displayLimit} of ${rowCount} rows.`;
+                    if (!note.parentNode) {
+                        table.appendChild(note);
+                    }
                 }
-                
-                row.appendChild(td);
-            });
-            
-            tbody.appendChild(row);
+            }
+        };
+    }
+    
+    // Create a table cell, formatting the value based on type
+    function createCell(value) {
+        const td = document.createElement('td');
+        fillCell(td, value);
+        return td;
+    }
+    
+    // Set a cell's text and style for a value
+    function fillCell(td, value) {
+        if (value === null) {
+            td.textContent = 'NULL';
+            td.style.color = '#999';
+        } else if (typeof value === 'number') {
+            td.textContent = formatNumber(value);
+            td.style.color = '';
+        } else if (value !== null && typeof value === 'object') {
+            td.textContent = JSON.stringify(value);
+            td.style.color = '';
+        } else {
+            td.textContent = value;
+            td.style.color = '';
         }
+    }
+    
+    // Scrollable table over every row of a stored result. Only the rows in view
+    // are in the DOM; they are read from /results/<handle> a page at a time as
+    // the user scrolls, and only the most recently used pages are kept.
+    function createVirtualTable(resultHandle, columns, rowCount) {
+        const ROW_HEIGHT = 33;
+        const VIEW_ROWS = 15;
+        const PAGE_ROWS = 200;
+        const MAX_CACHED_PAGES = 20;
+        const FETCH_DELAY_MS = 80;
+        // Browsers cap element heights (about 17M px in Firefox); beyond this the
+        // scrollbar is scaled, one pixel standing for several rows
+        const MAX_SCROLL_HEIGHT = 8000000;
+        
+        // The header and the visible rows exactly fill the viewport
+        const viewport = document.createElement('div');
+        viewport.className = 'virtual-table';
+        viewport.style.height = `${(VIEW_ROWS + 1) * ROW_HEIGHT}px`;
         
+        const table = document.createElement('table');
+        const thead = document.createElement('thead');
+        const headerRow = document.createElement('tr');
+        headerRow.style.height = `${ROW_HEIGHT}px`;
+        columns.forEach(column => {
+            const th = document.createElement('th');
+            th.textContent = column;
+            headerRow.appendChild(th);
+        });
+        thead.appendChild(headerRow);
+        table.appendChild(thead);
+        
+        // A fixed set of rows, refilled on every scroll
+        const tbody = document.createElement('tbody');
+        const rowElements = [];
+        for (let i = 0; i < VIEW_ROWS; i++) {
+            const tr = document.createElement('tr');
+            tr.style.height = `${ROW_HEIGHT}px`;
+            columns.forEach(() => tr.appendChild(document.createElement('td')));
+            tbody.appendChild(tr);
+            rowElements.push(tr);
+        }
         table.appendChild(tbody);
         
-        // Add limited data note if needed
-        if (data.length > displayLimit) {
-            const note = document.createElement('caption');
-            note.style.captionSide = 'bottom';
-            note.textContent = `Showing ${displayLimit} of ${data.length} rows.`;
-            table.appendChild(note);
+        // The table sticks to the top of the viewport; the spacer provides the scroll range
+        const spacer = document.createElement('div');
+        viewport.appendChild(table);
+        viewport.appendChild(spacer);
+        
+        const status = document.createElement('div');
+        status.className = 'virtual-table-status';
+        
+        const wrapper = document.createElement('div');
+        wrapper.appendChild(viewport);
+        wrapper.appendChild(status);
+        
+        const pages = new Map();
+        const pending = new Set();
+        let total = rowCount || 0;
+        let first = 0;
+        let fetchTimer = null;
+        let errorText = '';
+        
+        function scrollRange() {
+            return Math.min(MAX_SCROLL_HEIGHT, Math.max(0, total - VIEW_ROWS) * ROW_HEIGHT);
+        }
+        
+        function getRow(index) {
+            const page = pages.get(Math.floor(index / PAGE_ROWS));
+            return page ? page[index % PAGE_ROWS] : undefined;
+        }
+        
+        function render() {
+            const range = scrollRange();
+            const lastFirst = Math.max(0, total - VIEW_ROWS);
+            first = range > 0 ? Math.min(lastFirst, Math.round(viewport.scrollTop / range * lastFirst)) : 0;
+            rowElements.forEach((tr, i) => {
+                const index = first + i;
+                if (index >= total) {
+                    tr.style.visibility = 'hidden';
+                    return;
+                }
+                tr.style.visibility = '';
+                const values = getRow(index);
+                Array.from(tr.children).forEach((td, column) => {
+                    if (values) {
+                        fillCell(td, values[column]);
+                    } else {
+                        td.textContent = '…';
+                        td.style.color = '#bbb';
+                    }
+                });
+            });
+            const last = Math.min(total, first + VIEW_ROWS);
+            status.textContent = errorText ||
+                `Rows ${formatNumber(total ? first + 1 : 0)}–${formatNumber(last)} of ${formatNumber(total)}`;
+        }
+        
+        async function fetchPage(pageIndex) {
+            pending.add(pageIndex);
+            try {
+                const offset = pageIndex * PAGE_ROWS;
+                const response = await fetch(`/results/${resultHandle}?offset=${offset}&limit=${PAGE_ROWS}`);
+                const data = await response.json();
+                if (!response.ok) {
+                    throw new Error(data.error || 'Could not load rows');
+                }
+                pages.set(pageIndex, data.rows);
+                // Least recently used pages go first (a Map iterates in insertion order)
+                while (pages.size > MAX_CACHED_PAGES) {
+                    pages.delete(pages.keys().next().value);
+                }
+                if (data.row_count !== null && data.row_count !== undefined) {
+                    total = data.row_count;
+                } else if (data.next_offset === null) {
+                    total = offset + data.rows.length;
+                }
+                spacer.style.height = `${scrollRange()}px`;
+                errorText = '';
+            } catch (error) {
+                errorText = `Error loading rows: ${error.message}`;
+            } finally {
+                pending.delete(pageIndex);
+                render();
+            }
         }
         
-        return table;
+        // Load the pages covering the rows in view, once scrolling pauses
+        function scheduleFetch() {
+            clearTimeout(fetchTimer);
+            fetchTimer = setTimeout(() => {
+                const firstPage = Math.floor(first / PAGE_ROWS);
+                const lastPage = Math.floor(Math.min(total - 1, first + VIEW_ROWS - 1) / PAGE_ROWS);
+                for (let pageIndex = firstPage; pageIndex <= lastPage; pageIndex++) {
+                    if (pages.has(pageIndex)) {
+                        // Mark as recently used
+                        const rows = pages.get(pageIndex);
+                        pages.delete(pageIndex);
+                        pages.set(pageIndex, rows);
+                    } else if (!pending.has(pageIndex)) {
+                        fetchPage(pageIndex);
+                    }
+                }
+            }, FETCH_DELAY_MS);
+        }
+        
+        let frameRequested = false;
+        viewport.addEventListener('scroll', () => {
+            if (frameRequested) {
+                return;
+            }
+            frameRequested = true;
+            requestAnimationFrame(() => {
+                frameRequested = false;
+                render();
+                scheduleFetch();
+            });
+        });
+        
+        spacer.style.height = `${scrollRange()}px`;
+        render();
+        fetchPage(0);
+        return wrapper;
+    }
+    
+    // Rows (arrays in column order) from columnar data, one array per column
+    function columnarRows(columnData, rowCount) {
+        const count = rowCount !== undefined ? rowCount : (columnData.length ? columnData[0].length : 0);
+        const rows = new Array(count);
+        for (let i = 0; i < count; i++) {
+            rows[i] = columnData.map(values => values[i]);
+        }
+        return rows;
+    }
+    
+    // Row objects from rows in column order
+    function rowsToObjects(columns, rows) {
+        return rows.map(values => {
+            const row = {};
+            columns.forEach((column, i) => { row[column] = values[i]; });
+            return row;
+        });
+    }
+    
+    // Create table from data (an array of row objects)
+    function createTableFromData(data) {
+        const columns = Object.keys(data[0]);
+        const table = createTable(columns);
+        table.appendRows(data.map(row => columns.map(column => row[column])));
+        return table.element;
     }
 
     // Check if data can be visualized
@@ -463,8 +872,39 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // Render visualization HTML from the server into a container, running its scripts
+    function renderVisualization(chartContainer, visualizationHtml) {
+        // Use DOMParser to handle the incoming HTML string
+        const parser = new DOMParser();
+        const doc = parser.parseFromString(visualizationHtml, 'text/html');
+        
+        // Clear previous content
+        chartContainer.innerHTML = ''; 
+
+        // Append non-script elements from the parsed body
+        Array.from(doc.body.childNodes).forEach(node => {
+            if (node.nodeName !== 'SCRIPT') {
+                chartContainer.appendChild(node.cloneNode(true)); // Append HTML elements
+            }
+        });
+
+        // Find and execute script elements separately
+        const scripts = Array.from(doc.querySelectorAll('script'));
+        scripts.forEach(script => {
+            const newScript = document.createElement('script');
+            // Copy attributes like src
+            Array.from(script.attributes).forEach(attr => newScript.setAttribute(attr.name, attr.value));
+            // Copy inline content
+            if (script.textContent) {
+                newScript.textContent = script.textContent;
+            }
+            // Append the new script to the container to execute it in context
+            chartContainer.appendChild(newScript); 
+        });
+    }
+
     // Visualize data in a chart
-    function visualizeData(data) {
+    function visualizeData(data, resultHandle) {
         // Show modal
         const chartModal = document.getElementById('chart-modal');
         const loadingSpinner = document.querySelector('.loading-spinner');
@@ -484,16 +924,21 @@ document.addEventListener('DOMContentLoaded', function() {
         // Always use the Claude API for visualizations
         console.log("Sending data for Claude visualization:", data.length, "records");
         
-        // Get data to visualize
-        fetch('/generate-visualization', {
+        // Get data to visualize: by result handle when we have one, falling back
+        // to sending the rows if the server no longer holds that result
+        const requestVisualization = body => fetch('/generate-visualization', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({
-                results: data
-            }),
-        })
+            body: JSON.stringify(body),
+        });
+        const request = resultHandle
+            ? requestVisualization({ result_handle: resultHandle }).then(response =>
+                response.status === 404 ? requestVisualization({ results: data }) : response)
+            : requestVisualization({ results: data });
+        
+        request
         .then(response => {
             if (!response.ok) {
                 throw new Error('Network response was not ok: ' + response.status);
@@ -505,33 +950,7 @@ document.addEventListener('DOMContentLoaded', function() {
             // Hide loading spinner
             loadingSpinner.style.display = 'none';
             
-            // Use DOMParser to handle the incoming HTML string
-            const parser = new DOMParser();
-            const doc = parser.parseFromString(data.visualization_html, 'text/html');
-            
-            // Clear previous content
-            chartContainer.innerHTML = ''; 
-
-            // Append non-script elements from the parsed body
-            Array.from(doc.body.childNodes).forEach(node => {
-                if (node.nodeName !== 'SCRIPT') {
-                    chartContainer.appendChild(node.cloneNode(true)); // Append HTML elements
-                }
-            });
-
-            // Find and execute script elements separately
-            const scripts = Array.from(doc.querySelectorAll('script'));
-            scripts.forEach(script => {
-                const newScript = document.createElement('script');
-                // Copy attributes like src
-                Array.from(script.attributes).forEach(attr => newScript.setAttribute(attr.name, attr.value));
-                // Copy inline content
-                if (script.textContent) {
-                    newScript.textContent = script.textContent;
-                }
-                // Append the new script to the container to execute it in context
-                chartContainer.appendChild(newScript); 
-            });
+            renderVisualization(chartContainer, data.visualization_html);
         })
         .catch(error => {
             console.error('Error generating visualization:', error);
@@ -0,0 +1,304 @@
+"""
+Offline stand-in for the Anthropic client, used by benchmark.py.
+
+StubAnthropic and AsyncStubAnthropic answer messages.create and
+messages.stream the way the apps expect, without network access:
+
+- requests offering the generate_sql tool get a generate_sql call with the
+  SQL recorded for the question (matched by substring, case-insensitive)
+- requests offering analyze_data get an analyze_data call
+- other requests (charts) get a Chart.js template using the
+  __CHART_DATA__/__CHART_ID__ placeholders
+
+Responses are delayed to look like a real model: ttft seconds before the
+first token, then tokens_per_second. Usage counts are estimated from
+character counts.
+
+Recorded responses are a JSON object mapping question text to
+{"sql": ..., "analysis": ..., "suggestions": ...}; DEFAULT_RESPONSES covers the
+benchmark's default questions against the sample database.
+"""
+import json
+import time
+import asyncio
+import threading
+from types import SimpleNamespace
+
+# Question -> recorded response for the sample database (insert_*.sql)
+DEFAULT_RESPONSES = {
+    "Show the closing price of company 1 over time": {
+        "sql": "SELECT sp.price_date, sp.close_price FROM stock_prices sp "
+               "WHERE sp.company_id = 1 ORDER BY sp.price_date",
+    },
+    "What is the average closing price by sector?": {
+        "sql": "SELECT c.sector, AVG(sp.close_price) AS avg_close_price FROM stock_prices sp "
+               "JOIN companies c ON c.company_id = sp.company_id GROUP BY c.sector ORDER BY avg_close_price DESC",
+    },
+    "Total revenue by fiscal year": {
+        "sql": "SELECT cf.fiscal_year, SUM(cf.revenue) AS total_revenue FROM company_financials cf "
+               "GROUP BY cf.fiscal_year ORDER BY cf.fiscal_year",
+    },
+    "Top 10 companies by total trading volume": {
+        "sql": "SELECT c.company_name, SUM(sp.volume) AS total_volume FROM stock_prices sp "
+               "JOIN companies c ON c.company_id = sp.company_id GROUP BY c.company_name "
+               "ORDER BY total_volume DESC LIMIT 10",
+    },
+    "How many analyst recommendations of each type are there?": {
+        "sql": "SELECT ae.recommendation, COUNT(*) AS estimates FROM analyst_estimates ae "
+               "GROUP BY ae.recommendation ORDER BY estimates DESC",
+    },
+    "Show every daily stock price": {
+        "sql": "SELECT sp.company_id, sp.price_date, sp.open_price, sp.close_price, sp.volume "
+               "FROM stock_prices sp ORDER BY sp.price_date, sp.company_id",
+    },
+}
+
+DEFAULT_ANALYSIS = ("The results show clear differences between the groups. The largest values are "
+                    "concentrated in a few entries, while most of the rest sit close to the average.")
+DEFAULT_SUGGESTIONS = "Break the results down by quarter. Compare the top entries against their sector."
+
+CHART_TEMPLATE = """<div style="height: 400px;"><canvas id="__CHART_ID__"></canvas></div>
+<script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
+<script>
+document.addEventListener('DOMContentLoaded', function() {
+    const rows = __CHART_DATA__;
+    const keys = rows.length ? Object.keys(rows[0]) : [];
+    new Chart(document.getElementById('__CHART_ID__'), {
+        type: 'bar',
+        data: {
+            labels: rows.map(r => r[keys[0]]),
+            datasets: [{label: keys[1], data: rows.map(r => r[keys[1]])}]
+        },
+        options: {plugins: {title: {display: true, text: keys.join(' by ')}}}
+    });
+});
+</script>"""
+
+# Characters per estimated token, as in prompt_encoding
+_CHARS_PER_TOKEN = 3.5
+
+# Characters sent per streamed delta
+_CHUNK_CHARS = 16
+
+
+def _tokens(text):
+    return max(1, int(len(text) / _CHARS_PER_TOKEN))
+
+
+def _prompt_text(kwargs):
+    parts = []
+    system = kwargs.get("system") or ""
+    parts.append(system if isinstance(system, str) else " ".join(b.get("text", "") for b in system))
+    for message in kwargs.get("messages", []):
+        content = message["content"]
+        parts.append(content if isinstance(content, str) else json.dumps(content))
+    return "\n".join(parts)
+
+
+def _question_text(kwargs):
+    content = kwargs["messages"][-1]["content"]
+    return content if isinstance(content, str) else json.dumps(content)
+
+
+class _Reply:
+    """One canned reply: a list of (block type, payload) plus usage."""
+
+    def __init__(self, kwargs, responses):
+        self.blocks = []
+        tools = {tool["name"] for tool in kwargs.get("tools") or []}
+        question = _question_text(kwargs)
+        if "generate_sql" in tools:
+            sql = self._match(question, responses).get("sql")
+            if sql:
+                self.blocks.append(("tool_use", "generate_sql", {"sql_query": sql}))
+            else:
+                self.blocks.append(("text", "I can only answer questions about the companies database."))
+        elif "analyze_data" in tools:
+            response = self._match(question, responses)
+            self.blocks.append(("tool_use", "analyze_data", {
+                "analysis": response.get("analysis", DEFAULT_ANALYSIS),
+                "suggestions": response.get("suggestions", DEFAULT_SUGGESTIONS),
+            }))
+        else:
+            self.blocks.append(("text", CHART_TEMPLATE))
+        self.input_tokens = _tokens(_prompt_text(kwargs))
+        self.output_tokens = sum(_tokens(self._block_text(block)) for block in self.blocks)
+
+    @staticmethod
+    def _match(question, responses):
+        lowered = question.lower()
+        for known, response in responses.items():
+            if known.lower() in lowered:
+                return response
+        return {}
+
+    @staticmethod
+    def _block_text(block):
+        return block[1] if block[0] == "text" else json.dumps(block[2])
+
+    def message(self):
+        content = []
+        for block in self.blocks:
+            if block[0] == "text":
+                content.append(SimpleNamespace(type="text", text=block[1]))
+            else:
+                content.append(SimpleNamespace(type="tool_use", id="toolu_stub", name=block[1], input=block[2]))
+        return SimpleNamespace(
+            role="assistant", content=content,
+            stop_reason="tool_use" if any(b[0] == "tool_use" for b in self.blocks) else "end_turn",
+            usage=SimpleNamespace(input_tokens=self.input_tokens, output_tokens=self.output_tokens,
+                                  cache_creation_input_tokens=0, cache_read_input_tokens=0))
+
+    def events(self):
+        """Stream events in the order the Messages API sends them."""
+        yield SimpleNamespace(type="message_start")
+        for index, block in enumerate(self.blocks):
+            text = self._block_text(block)
+            if block[0] == "text":
+                yield SimpleNamespace(type="content_block_start", index=index,
+                                      content_block=SimpleNamespace(type="text", text=""))
+                delta = lambda chunk: SimpleNamespace(type="text_delta", text=chunk)
+            else:
+                yield SimpleNamespace(type="content_block_start", index=index,
+                                      content_block=SimpleNamespace(type="tool_use", id="toolu_stub",
+                                                                    name=block[1], input={}))
+                delta = lambda chunk: SimpleNamespace(type="input_json_delta", partial_json=chunk)
+            for start in range(0, len(text), _CHUNK_CHARS):
+                yield SimpleNamespace(type="content_block_delta", index=index,
+                                      delta=delta(text[start:start + _CHUNK_CHARS]))
+            yield SimpleNamespace(type="content_block_stop", index=index)
+        yield SimpleNamespace(type="message_stop")
+
+
+class _Stream:
+    def __init__(self, reply, ttft, tokens_per_second):
+        self._reply = reply
+        self._delay = _tokens("x" * _CHUNK_CHARS) / tokens_per_second if tokens_per_second else 0
+        self._ttft = ttft
+        self._events = self._paced()
+
+    def _paced(self):
+        time.sleep(self._ttft)
+        for event in self._reply.events():
+            if event.type == "content_block_delta":
+                time.sleep(self._delay)
+            yield event
+
+    def __iter__(self):
+        return self._events
+
+    def get_final_message(self):
+        for _ in self._events:
+            pass
+        return self._reply.message()
+
+    def close(self):
+        self._events.close()
+
+
+class _StreamManager:
+    def __init__(self, stream):
+        self._stream = stream
+
+    def __enter__(self):
+        return self._stream
+
+    def __exit__(self, *exc_info):
+        self._stream.close()
+
+
+class _Messages:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, **kwargs):
+        reply = self._owner.reply(kwargs)
+        time.sleep(self._owner.ttft + self._owner.generation_seconds(reply))
+        return reply.message()
+
+    def stream(self, **kwargs):
+        return _StreamManager(_Stream(self._owner.reply(kwargs), self._owner.ttft, self._owner.tokens_per_second))
+
+
+class StubAnthropic:
+    """Drop-in for anthropic.Anthropic answering from recorded responses."""
+
+    def __init__(self, responses=None, ttft=0.4, tokens_per_second=80.0):
+        self.responses = DEFAULT_RESPONSES if responses is None else responses
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.messages = _Messages(self)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def reply(self, kwargs):
+        reply = _Reply(kwargs, self.responses)
+        with self._lock:
+            self.requests += 1
+            self.input_tokens += reply.input_tokens
+            self.output_tokens += reply.output_tokens
+        return reply
+
+    def generation_seconds(self, reply):
+        return reply.output_tokens / self.tokens_per_second if self.tokens_per_second else 0
+
+
+class _AsyncStream:
+    def __init__(self, reply, ttft, tokens_per_second):
+        self._reply = reply
+        self._delay = _tokens("x" * _CHUNK_CHARS) / tokens_per_second if tokens_per_second else 0
+        self._ttft = ttft
+        self._events = self._paced()
+
+    async def _paced(self):
+        await asyncio.sleep(self._ttft)
+        for event in self._reply.events():
+            if event.type == "content_block_delta":
+                await asyncio.sleep(self._delay)
+            yield event
+
+    def __aiter__(self):
+        return self._events
+
+    async def get_final_message(self):
+        async for _ in self._events:
+            pass
+        return self._reply.message()
+
+    async def close(self):
+        await self._events.aclose()
+
+
+class _AsyncStreamManager:
+    def __init__(self, stream):
+        self._stream = stream
+
+    async def __aenter__(self):
+        return self._stream
+
+    async def __aexit__(self, *exc_info):
+        await self._stream.close()
+
+
+class _AsyncMessages:
+    def __init__(self, owner):
+        self._owner = owner
+
+    async def create(self, **kwargs):
+        reply = self._owner.reply(kwargs)
+        await asyncio.sleep(self._owner.ttft + self._owner.generation_seconds(reply))
+        return reply.message()
+
+    def stream(self, **kwargs):
+        return _AsyncStreamManager(
+            _AsyncStream(self._owner.reply(kwargs), self._owner.ttft, self._owner.tokens_per_second))
+
+
+class AsyncStubAnthropic(StubAnthropic):
+    """Drop-in for anthropic.AsyncAnthropic answering from recorded responses."""
+
+    def __init__(self, responses=None, ttft=0.4, tokens_per_second=80.0):
+        super().__init__(responses, ttft, tokens_per_second)
+        self.messages = _AsyncMessages(self)
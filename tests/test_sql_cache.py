@@ -0,0 +1,40 @@
+import pytest
+
+from embeddings import HashingEmbedder
+from sql_cache import MemoryBackend, SQLGenerationCache
+
+VERSION = "v1"
+CACHED_QUESTION = "top 5 companies by revenue"
+CACHED_SQL = "SELECT company_name FROM companies ORDER BY revenue DESC LIMIT 5"
+
+
+@pytest.fixture
+def cache():
+    cache = SQLGenerationCache(MemoryBackend(), embedder=HashingEmbedder())
+    cache.store(CACHED_QUESTION, VERSION, CACHED_SQL)
+    return cache
+
+
+@pytest.mark.parametrize("question", [
+    "Top 5 companies by revenue?",
+    "show me the top 5 companies by revenue",
+    "list the top 5 companies by revenue",
+])
+def test_rephrasing_reuses_sql(cache, question):
+    assert cache.lookup(question, VERSION) == CACHED_SQL
+
+
+@pytest.mark.parametrize("question", [
+    "top 5 companies by revenue for Apple",
+    "top 5 tech companies by revenue",
+    "top 5 companies by revenue growth",
+])
+def test_near_miss_is_not_a_hit(cache, question):
+    # Above the similarity threshold, but asking for something else
+    vector = cache.embedder.embed(question.lower())
+    assert float(vector @ cache.embedder.embed(CACHED_QUESTION)) >= cache.similarity_threshold
+    assert cache.lookup(question, VERSION) is None
+
+
+def test_other_schema_version_misses(cache):
+    assert cache.lookup(CACHED_QUESTION, "v2") is None
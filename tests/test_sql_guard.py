@@ -0,0 +1,117 @@
+import pytest
+
+import sql_guard
+import sql_utils
+from sql_guard import SqlRejected, check_static, has_top_level_limit, limited_sql
+
+SCHEMA = {
+    "companies": {"company_id", "ticker", "sector"},
+    "stock_prices": {"price_id", "company_id", "price_date", "close_price"},
+}
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM companies",
+    "  (SELECT 1) UNION (SELECT 2);",
+    "WITH recent AS (SELECT * FROM stock_prices) SELECT * FROM recent",
+    "TABLE companies",
+    "VALUES (1, 'a'), (2, 'b')",
+    "SHOW work_mem",
+    "EXPLAIN SELECT * FROM companies",
+    "EXPLAIN ANALYZE SELECT * FROM companies",
+    "EXPLAIN (ANALYZE, FORMAT JSON) SELECT * FROM companies",
+    "SELECT 'insert into companies' AS text",
+])
+def test_is_read_only_accepts_reads(sql):
+    assert sql_utils.is_read_only(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "INSERT INTO companies (ticker) VALUES ('X')",
+    "UPDATE companies SET sector = 'Energy'",
+    "DELETE FROM companies",
+    "DROP TABLE companies",
+    "CREATE TABLE x AS SELECT 1",
+    "WITH gone AS (DELETE FROM companies RETURNING *) SELECT * FROM gone",
+    "SELECT * INTO backup FROM companies",
+    "SELECT * FROM companies FOR UPDATE",
+    "SELECT * FROM companies FOR SHARE",
+    "SELECT * FROM companies FOR NO KEY UPDATE",
+    "EXPLAIN ANALYZE CREATE TABLE x AS SELECT 1",
+    "EXPLAIN ANALYZE DELETE FROM companies",
+    "EXPLAIN (ANALYZE) INSERT INTO companies (ticker) VALUES ('X')",
+    "EXPLAIN",
+    "SELECT 1; SELECT 2",
+    "SELECT 1; DROP TABLE companies",
+    "",
+])
+def test_is_read_only_rejects_writes(sql):
+    assert not sql_utils.is_read_only(sql)
+
+
+@pytest.mark.parametrize("sql, tables", [
+    ("INSERT INTO companies (ticker) VALUES ('X')", {"companies"}),
+    ("UPDATE public.stock_prices SET close_price = 1", {"stock_prices"}),
+    ("DELETE FROM companies WHERE company_id = 1", {"companies"}),
+    ("WITH gone AS (DELETE FROM companies RETURNING *) SELECT * FROM gone", {"companies"}),
+    ("SELECT * FROM companies", set()),
+])
+def test_written_tables(sql, tables):
+    assert tables <= sql_utils.written_tables(sql)
+    if not tables:
+        assert sql_utils.written_tables(sql) == set()
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT * FROM companies LIMIT 10", True),
+    ("SELECT * FROM companies FETCH FIRST 10 ROWS ONLY", True),
+    ("SELECT * FROM (SELECT * FROM companies LIMIT 10) AS c", False),
+    ("SELECT * FROM companies WHERE company_id IN (SELECT company_id FROM stock_prices LIMIT 5)", False),
+    ("SELECT 'limit 5' AS text FROM companies", False),
+])
+def test_has_top_level_limit(sql, expected):
+    assert has_top_level_limit(sql) is expected
+
+
+def test_limited_sql_appends_limit():
+    assert limited_sql("SELECT * FROM companies;", 100) == "SELECT * FROM companies\nLIMIT 100"
+
+
+def test_limited_sql_keeps_nested_limit_and_adds_its_own():
+    sql = "SELECT * FROM (SELECT * FROM companies LIMIT 10) AS c"
+    assert limited_sql(sql, 100) == sql + "\nLIMIT 100"
+
+
+def test_limited_sql_wraps_own_limit():
+    limited = limited_sql("SELECT * FROM companies LIMIT 500000", 100)
+    assert limited.startswith("SELECT * FROM (SELECT * FROM companies LIMIT 500000")
+    assert limited.endswith(") AS limited_result LIMIT 100")
+
+
+def test_check_static_accepts_known_names():
+    check_static("SELECT c.ticker, s.close_price FROM companies c JOIN stock_prices s "
+                 "ON s.company_id = c.company_id", SCHEMA)
+
+
+@pytest.mark.parametrize("sql, message", [
+    ("SELECT 1; SELECT 2", "one SQL statement"),
+    ("DELETE FROM companies", "read-only"),
+    ("EXPLAIN ANALYZE CREATE TABLE x AS SELECT 1", "read-only"),
+    ("SELECT * FROM company", "company does not exist"),
+    ("SELECT c.name FROM companies c", "c.name does not exist"),
+])
+def test_check_static_rejects(sql, message):
+    with pytest.raises(SqlRejected, match=message):
+        check_static(sql, SCHEMA)
+
+
+@pytest.mark.parametrize("sql, checked", [
+    ("SELECT * FROM companies", True),
+    ("WITH c AS (SELECT 1) SELECT * FROM c", True),
+    ("EXPLAIN SELECT * FROM companies", False),
+    ("SHOW work_mem", False),
+    ("DELETE FROM companies", False),
+])
+def test_explain_gate_skips_explain_and_show(sql, checked):
+    # EXPLAIN (FORMAT JSON) EXPLAIN ... and EXPLAIN ... SHOW are syntax errors
+    assert sql_guard._needs_plan_check(sql) is checked
@@ -0,0 +1,326 @@
+"""
+Per-stage latency tracing and metrics.
+
+Each request handled by the apps is a trace, and every stage of it (model
+calls, connection checkout, the SQL guard, the query, chart planning,
+serialization, ...) runs inside span(stage). Spans are reported three ways:
+
+- Prometheus histograms, served by the apps at GET /metrics:
+      sql_chat_request_seconds{endpoint, method, status}
+      sql_chat_stage_seconds{endpoint, stage}
+      sql_chat_llm_time_to_first_token_seconds{stage}
+      sql_chat_llm_tokens_total{stage, kind}   kind: input, output, cache_read, cache_write
+- one structured log line per request ("Request trace: {json}") with the
+  time spent in each stage, model tokens and time to first token
+- optionally OpenTelemetry spans, exported over OTLP/HTTP to a collector
+
+Stages that run on other threads (the chat producer, the pipeline's parallel
+model calls, stream draining) are counted against the request when the thread
+is started in a copy of the request's context (contextvars.copy_context()).
+
+prometheus_client and the OpenTelemetry SDK are optional: without
+prometheus_client /metrics answers 503, without the SDK no spans are exported.
+With several worker processes, set PROMETHEUS_MULTIPROC_DIR so /metrics
+aggregates all of them.
+
+Configuration (environment variables):
+    TRACING_OTLP_ENABLED         set to 1 to export OpenTelemetry spans (default 0)
+    OTEL_EXPORTER_OTLP_ENDPOINT  collector address (default http://localhost:4318)
+    OTEL_SERVICE_NAME            service name on exported spans (default sql-chat)
+    PROMETHEUS_MULTIPROC_DIR     shared directory for multi-process metrics (default unset)
+"""
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+try:
+    import prometheus_client
+    prometheus_available = True
+except ImportError:
+    logger.warning("prometheus_client not found. /metrics will not be available.")
+    prometheus_available = False
+
+try:
+    from opentelemetry import context as otel_context
+    from opentelemetry import trace as otel_trace
+    otel_available = True
+except ImportError:
+    otel_available = False
+
+# Histogram buckets in seconds: stages range from sub-millisecond conversions to long model calls
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TTFT_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 20.0)
+
+# Endpoint label of spans recorded outside any request (CLI mode, background threads)
+NO_ENDPOINT = "none"
+
+if prometheus_available:
+    REQUEST_SECONDS = prometheus_client.Histogram(
+        "sql_chat_request_seconds", "Time to complete a request, including streamed bodies",
+        ["endpoint", "method", "status"], buckets=STAGE_BUCKETS)
+    STAGE_SECONDS = prometheus_client.Histogram(
+        "sql_chat_stage_seconds", "Time spent in one stage of a request",
+        ["endpoint", "stage"], buckets=STAGE_BUCKETS)
+    LLM_TTFT_SECONDS = prometheus_client.Histogram(
+        "sql_chat_llm_time_to_first_token_seconds", "Time from sending a streamed model request to its first token",
+        ["stage"], buckets=TTFT_BUCKETS)
+    LLM_TOKENS = prometheus_client.Counter(
+        "sql_chat_llm_tokens", "Model tokens by request stage and kind",
+        ["stage", "kind"])
+
+
+class Trace:
+    """Stage timings and model usage of one request."""
+
+    def __init__(self, endpoint, method):
+        self.endpoint = endpoint
+        self.method = method
+        self.started = time.perf_counter()
+        self.status = None
+        self.stages = {}
+        self.llm = {}
+        self.otel_span = None
+        self.otel_token = None
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage, seconds):
+        with self._lock:
+            total, count = self.stages.get(stage, (0.0, 0))
+            self.stages[stage] = (total + seconds, count + 1)
+
+    def add_llm(self, stage, **values):
+        with self._lock:
+            entry = self.llm.setdefault(stage, {})
+            for key, value in values.items():
+                entry[key] = entry.get(key, 0) + value
+
+    def summary(self, seconds):
+        with self._lock:
+            return {
+                "endpoint": self.endpoint,
+                "method": self.method,
+                "status": self.status,
+                "seconds": round(seconds, 6),
+                "stages": {stage: {"seconds": round(total, 6), "count": count}
+                           for stage, (total, count) in self.stages.items()},
+                "llm": self.llm,
+            }
+
+
+_current = contextvars.ContextVar("trace", default=None)
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    """Process-wide OpenTelemetry tracer exporting over OTLP; None when export is off."""
+    global _tracer
+    if not otel_available or os.getenv("TRACING_OTLP_ENABLED", "0") != "1":
+        return None
+    with _tracer_lock:
+        if _tracer is None:
+            try:
+                from opentelemetry.sdk.resources import Resource
+                from opentelemetry.sdk.trace import TracerProvider
+                from opentelemetry.sdk.trace.export import BatchSpanProcessor
+                from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            except ImportError:
+                logger.warning("OpenTelemetry SDK or OTLP exporter not found. Spans will not be exported.")
+                return None
+            os.environ.setdefault("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318")
+            provider = TracerProvider(resource=Resource.create(
+                {"service.name": os.getenv("OTEL_SERVICE_NAME", "sql-chat")}))
+            provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+            otel_trace.set_tracer_provider(provider)
+            _tracer = otel_trace.get_tracer(__name__)
+            logger.info("Exporting OpenTelemetry spans to {}".format(os.environ["OTEL_EXPORTER_OTLP_ENDPOINT"]))
+        return _tracer
+
+
+def current_trace():
+    return _current.get()
+
+
+def start_request(endpoint, method):
+    """Start the trace of a request in the current context."""
+    trace = Trace(endpoint, method)
+    tracer = get_tracer()
+    if tracer is not None:
+        trace.otel_span = tracer.start_span("{} {}".format(method, endpoint), attributes={
+            "http.method": method, "http.route": endpoint})
+        trace.otel_token = otel_context.attach(otel_trace.set_span_in_context(trace.otel_span))
+    _current.set(trace)
+    return trace
+
+
+def finish_request(status=None):
+    """Finish the current request's trace: observe its duration and log its summary."""
+    trace = _current.get()
+    if trace is None:
+        return
+    _current.set(None)
+    if status is not None:
+        trace.status = status
+    seconds = time.perf_counter() - trace.started
+    status_label = str(trace.status) if trace.status is not None else "unknown"
+    if prometheus_available:
+        REQUEST_SECONDS.labels(trace.endpoint, trace.method, status_label).observe(seconds)
+    if trace.otel_span is not None:
+        trace.otel_span.set_attribute("http.status_code", trace.status or 0)
+        trace.otel_span.end()
+        try:
+            otel_context.detach(trace.otel_token)
+        except Exception:
+            pass
+    logger.info("Request trace: {}".format(json.dumps(trace.summary(seconds))))
+
+
+@contextmanager
+def span(stage, **attributes):
+    """
+    Time one stage of the current request. Yields a dict of attributes that
+    the stage can add to (e.g. a row count) for the exported span.
+    """
+    trace = _current.get()
+    endpoint = trace.endpoint if trace else NO_ENDPOINT
+    tracer = get_tracer()
+    started = time.perf_counter()
+    if tracer is None:
+        try:
+            yield attributes
+        finally:
+            _observe_stage(trace, endpoint, stage, time.perf_counter() - started)
+        return
+    with tracer.start_as_current_span(stage) as otel_span:
+        try:
+            yield attributes
+        finally:
+            seconds = time.perf_counter() - started
+            for key, value in attributes.items():
+                otel_span.set_attribute(key, value)
+            _observe_stage(trace, endpoint, stage, seconds)
+
+
+def _observe_stage(trace, endpoint, stage, seconds):
+    if prometheus_available:
+        STAGE_SECONDS.labels(endpoint, stage).observe(seconds)
+    if trace is not None:
+        trace.add_stage(stage, seconds)
+
+
+def record_llm_usage(stage, usage):
+    """Count the tokens of one model response (its usage object)."""
+    counts = {
+        "input": getattr(usage, "input_tokens", None) or 0,
+        "output": getattr(usage, "output_tokens", None) or 0,
+        "cache_read": getattr(usage, "cache_read_input_tokens", None) or 0,
+        "cache_write": getattr(usage, "cache_creation_input_tokens", None) or 0,
+    }
+    if prometheus_available:
+        for kind, tokens in counts.items():
+            if tokens:
+                LLM_TOKENS.labels(stage, kind).inc(tokens)
+    trace = _current.get()
+    if trace is not None:
+        trace.add_llm(stage, **{kind + "_tokens": tokens for kind, tokens in counts.items()})
+    if otel_available and get_tracer() is not None:
+        otel_span = otel_trace.get_current_span()
+        for kind, tokens in counts.items():
+            otel_span.set_attribute("llm.{}.{}_tokens".format(stage.lower().replace(" ", "_"), kind), tokens)
+
+
+def observe_ttft(stage, seconds):
+    """Record the time to first token of a streamed model request."""
+    if prometheus_available:
+        LLM_TTFT_SECONDS.labels(stage).observe(seconds)
+    trace = _current.get()
+    if trace is not None:
+        trace.add_llm(stage, ttft_seconds=round(seconds, 6))
+
+
+def _is_first_token(event):
+    return event.type == "content_block_delta"
+
+
+def first_token(stage, events, started):
+    """Pass stream events through, recording the time from started to the first token."""
+    for event in events:
+        if started is not None and _is_first_token(event):
+            observe_ttft(stage, time.perf_counter() - started)
+            started = None
+        yield event
+
+
+async def first_token_async(stage, events, started):
+    """Async counterpart of first_token for AsyncAnthropic streams."""
+    async for event in events:
+        if started is not None and _is_first_token(event):
+            observe_ttft(stage, time.perf_counter() - started)
+            started = None
+        yield event
+
+
+def _endpoint_label(request):
+    """Route pattern of a request (bounded cardinality), or "unmatched"."""
+    rule = getattr(request, "url_rule", None)
+    return rule.rule if rule is not None else "unmatched"
+
+
+def init_app(app):
+    """Trace every request of a Flask app. Streamed bodies are included when wrapped in stream_with_context."""
+    from flask import request
+
+    @app.before_request
+    def _start_trace():
+        start_request(_endpoint_label(request), request.method)
+
+    @app.after_request
+    def _record_status(response):
+        trace = _current.get()
+        if trace is not None:
+            trace.status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _finish_trace(exc):
+        finish_request(500 if exc is not None else None)
+
+
+def init_async_app(app):
+    """Async counterpart of init_app for a Quart app."""
+    from quart import request
+
+    @app.before_request
+    async def _start_trace():
+        start_request(_endpoint_label(request), request.method)
+
+    @app.after_request
+    async def _record_status(response):
+        trace = _current.get()
+        if trace is not None:
+            trace.status = response.status_code
+        return response
+
+    @app.teardown_request
+    async def _finish_trace(exc):
+        finish_request(500 if exc is not None else None)
+
+
+def metrics_response():
+    """(body, status, headers) of GET /metrics in the Prometheus text format."""
+    if not prometheus_available:
+        return "prometheus_client is not installed.\n", 503, {"Content-Type": "text/plain"}
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), 200, {"Content-Type": prometheus_client.CONTENT_TYPE_LATEST}